@@ -0,0 +1,158 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+"""
+Benchmark: readings scan throughput composing timestamps by joining
+date_t/time_t versus composing them from date_id/time_id without joins,
+either with SQLite's printf() or with a memoized Python SQL function.
+The readings queries keep the joins as long as they come out ahead here.
+
+    python bench/readings_timestamp.py --rows 3000000
+    python bench/readings_timestamp.py --dbase /var/dbase/tess.db
+"""
+
+# --------------------
+# System wide imports
+# -------------------
+
+import os
+import time
+import sqlite3
+import tempfile
+import datetime
+from argparse import ArgumentParser
+
+# ----------------
+# Module constants
+# ----------------
+
+JOIN_SQL = """
+    SELECT (d.sql_date || 'T' || t.time) AS timestamp, r.tess_id, r.frequency, r.magnitude
+    FROM tess_readings_t AS r
+    JOIN date_t AS d USING (date_id)
+    JOIN time_t AS t USING (time_id)
+    """
+
+PRINTF_SQL = """
+    SELECT printf('%04d-%02d-%02dT%02d:%02d:%02d',
+        r.date_id/10000, r.date_id/100%100, r.date_id%100,
+        r.time_id/10000, r.time_id/100%100, r.time_id%100) AS timestamp,
+        r.tess_id, r.frequency, r.magnitude
+    FROM tess_readings_t AS r
+    """
+
+FUNCTION_SQL = """
+    SELECT tstamp(r.date_id, r.time_id) AS timestamp, r.tess_id, r.frequency, r.magnitude
+    FROM tess_readings_t AS r
+    """
+
+VARIANTS = (
+    ("date_t/time_t join", JOIN_SQL),
+    ("printf() join-free", PRINTF_SQL),
+    ("tstamp() join-free", FUNCTION_SQL),
+)
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+
+def synthesize(path: str, rows: int) -> None:
+    """Minimal star schema with one reading per minute spread over 50 photometers"""
+    connection = sqlite3.connect(path)
+    connection.executescript(
+        """
+        CREATE TABLE date_t (date_id INTEGER PRIMARY KEY, sql_date TEXT);
+        CREATE TABLE time_t (time_id INTEGER PRIMARY KEY, time TEXT);
+        CREATE TABLE tess_readings_t (
+            date_id INTEGER, time_id INTEGER, tess_id INTEGER,
+            frequency REAL, magnitude REAL,
+            PRIMARY KEY (date_id, time_id, tess_id)
+        );
+        """
+    )
+    t0 = datetime.datetime(2020, 1, 1)
+    connection.executemany(
+        "INSERT INTO time_t VALUES (?,?)",
+        (
+            (h * 10000 + m * 100 + s, "%02d:%02d:%02d" % (h, m, s))
+            for h in range(24) for m in range(60) for s in range(60)
+        ),
+    )
+    ndays = rows // (24 * 60 * 50) + 2
+    connection.executemany(
+        "INSERT INTO date_t VALUES (?,?)",
+        (
+            (int(d.strftime("%Y%m%d")), d.strftime("%Y-%m-%d"))
+            for d in (t0 + datetime.timedelta(days=i) for i in range(ndays))
+        ),
+    )
+
+    def readings():
+        for i in range(rows):
+            minute, tess_id = divmod(i, 50)
+            ts = t0 + datetime.timedelta(minutes=minute)
+            yield (int(ts.strftime("%Y%m%d")), int(ts.strftime("%H%M%S")), tess_id, 10.0, 20.0)
+
+    connection.executemany("INSERT INTO tess_readings_t VALUES (?,?,?,?,?)", readings())
+    connection.commit()
+    connection.close()
+
+
+def register_tstamp(connection: sqlite3.Connection) -> None:
+    """tstamp(date_id, time_id) with a time_id indexed table and a memoized date dictionary"""
+    times = [None] * 240000
+    for hour in range(24):
+        for minute in range(60):
+            for second in range(60):
+                times[hour * 10000 + minute * 100 + second] = "T%02d:%02d:%02d" % (hour, minute, second)
+    dates = dict()
+
+    def tstamp(date_id, time_id):
+        try:
+            return dates[date_id] + times[time_id]
+        except KeyError:
+            dates[date_id] = "%04d-%02d-%02d" % (date_id // 10000, (date_id // 100) % 100, date_id % 100)
+            return dates[date_id] + times[time_id]
+
+    connection.create_function("tstamp", 2, tstamp, deterministic=True)
+
+
+def scan(connection: sqlite3.Connection, sql: str) -> tuple:
+    t0 = time.perf_counter()
+    n = 0
+    for _ in connection.execute(sql):
+        n += 1
+    return n, time.perf_counter() - t0
+
+
+def main():
+    parser = ArgumentParser(description="date_t/time_t join vs join-free readings scan benchmark")
+    parser.add_argument("-d", "--dbase", type=str, default=None, help="Existing database (default: synthesize one)")
+    parser.add_argument("-r", "--rows", type=int, default=2000000, help="Synthetic readings rows (default %(default)s)")
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="Best of N runs (default %(default)s)")
+    args = parser.parse_args()
+    tmpdir = None
+    path = args.dbase
+    if path is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(tmpdir.name, "bench.db")
+        print("Synthesizing %d readings in %s" % (args.rows, path))
+        synthesize(path, args.rows)
+    connection = sqlite3.connect("file:{0}?mode=ro".format(path), uri=True)
+    register_tstamp(connection)
+    baseline = None
+    for label, sql in VARIANTS:
+        n, elapsed = min((scan(connection, sql) for _ in range(args.repeat)), key=lambda r: r[1])
+        baseline = baseline or elapsed
+        print("%-20s %10d rows %8.3f s %12.0f rows/s  x%.2f" % (label, n, elapsed, n / elapsed, baseline / elapsed))
+    connection.close()
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import os
+import json
+import socket
+import sqlite3
+import logging
+from argparse import Namespace, ArgumentParser
+
+# -------------------
+# Third party imports
+# -------------------
+
+from lica.cli import execute
+
+# --------------
+# local imports
+# -------------
+
+from . import __version__, DEFAULT_DBASE, CURRENT
+from .utils import invalidation
+
+# ----------------
+# Global variables
+# ----------------
+
+log = logging.getLogger(__name__)
+
+INSTRUMENTS_SQL = """
+    SELECT mac_address, tess_id, zero_point, filter, location_id
+    FROM tess_t WHERE valid_state == :state
+    """
+
+NAMES_SQL = """
+    SELECT name, mac_address
+    FROM name_to_mac_t WHERE valid_state == :state
+    """
+
+LOCATIONS_SQL = """
+    SELECT location_id, site, longitude, latitude
+    FROM location_t
+    """
+
+# ------------------
+# Auxiliar functions
+# ------------------
+
+
+class Caches:
+    """
+    Reference for the tessdb server caches: instruments by MAC, MACs by name
+    and locations by id, loaded once and then only refreshed for the keys
+    named in an invalidation message instead of being thrown away whole.
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+        self.row = {"state": CURRENT}
+        self.caches = {
+            invalidation.MAC: (dict(), INSTRUMENTS_SQL, "mac_address"),
+            invalidation.NAME: (dict(), NAMES_SQL, "name"),
+            invalidation.LOCATION: (dict(), LOCATIONS_SQL, "location_id"),
+        }
+        for kind, (cache, sql, key) in self.caches.items():
+            cache.update((row[0], row[1:]) for row in connection.execute(sql, self.row))
+            log.info("Loaded %d %s", len(cache), kind)
+
+    def invalidate(self, payload: dict) -> None:
+        for kind, (cache, sql, key) in self.caches.items():
+            keys = payload.get(kind, [])
+            if not keys:
+                continue
+            for k in keys:
+                cache.pop(k, None)
+            bindings = dict(self.row)
+            bindings.update(("k%d" % i, k) for i, k in enumerate(keys))
+            params = ",".join(":k%d" % i for i in range(len(keys)))
+            refreshed = self.connection.execute(
+                "SELECT * FROM (%s) WHERE %s IN (%s)" % (sql, key, params), bindings
+            ).fetchall()
+            cache.update((row[0], row[1:]) for row in refreshed)
+            log.info(
+                "Invalidated %d of %d %s: %s (%d reloaded)", len(keys), len(cache), kind, ", ".join(map(str, keys)), len(refreshed)
+            )
+
+
+# ------------------
+# CLI Work functions
+# ------------------
+
+
+def cli_listen(args: Namespace) -> None:
+    connection = sqlite3.connect(args.dbase)
+    caches = Caches(connection)
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.bind(args.socket)
+        sock.settimeout(args.period)
+        log.info("Listening on %s", args.socket)
+        while True:
+            # Messages queued while nobody listened are picked up too
+            payload = invalidation.drain(connection)
+            if not invalidation.empty(payload):
+                caches.invalidate(payload)
+            try:
+                message = sock.recv(65536)
+            except socket.timeout:
+                continue
+            caches.invalidate(json.loads(message))
+
+
+# ======
+# PARSER
+# ======
+
+
+def add_args(parser: ArgumentParser):
+    parser.add_argument("-d", "--dbase", type=str, default=DEFAULT_DBASE, help="SQLite database full file path")
+    parser.add_argument(
+        "-s", "--socket", type=str, default=invalidation.DEFAULT_SOCKET, help="Unix datagram socket to listen on"
+    )
+    parser.add_argument(
+        "-p", "--period", type=float, default=60.0, help="seconds between pending table polls without notifications"
+    )
+
+
+def cli_main(args: Namespace) -> None:
+    cli_listen(args)
+
+
+def main():
+    """The main entry point specified by pyproject.toml"""
+    execute(
+        main_func=cli_main,
+        add_args_func=add_args,
+        name=__name__,
+        version=__version__,
+        description="Reference tessdb selective cache invalidation listener",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -18,11 +18,16 @@ import sqlite3
 import os
 import os.path
 import datetime
+import csv
+import json
+import contextlib
 
 #--------------
 # other imports
 # -------------
 
+import tabulate
+
 #--------------
 # local imports
 # -------------
@@ -32,11 +37,82 @@ from . import OUT_OF_SERVICE, MANUAL, DEFAULT_AZIMUTH, DEFAULT_ALTITUDE
 from . import TSTAMP_FORMAT, DEFAULT_START_DATE, DEFAULT_END_DATE
 
 from .utils      import paging
+from .utils.progress import Progress
+from .utils.dryrun   import DryRun
+from .utils.remap    import Remapper
+from .utils.archive  import attach_archive, detach_archive, archive_copy, archive_move
+from .utils.intervals import InstrumentResolver
+from .utils.renames  import RenameGraph
+from .utils.scd      import check as scd_check, fix as scd_fix, fix_orphans
+from .utils.selector import parse_selector, read_names, load_selection
+from .utils.coalesce import load_versions, find_runs, add_mappings, collapse_versions
 
 # ----------------
 # Module constants
 # ----------------
 
+# Queries shared between the single subcommands and 'tess report'
+
+INSTRUMENT_UNASSIGNED_SQL = '''
+    SELECT name,tess_id,mac_address,zero_point,filter,azimuth,altitude,site,authorised,registered
+    FROM tess_v
+    WHERE valid_state == :state
+    AND (site == :site1 OR site == :site2)
+    ORDER BY CAST(substr(tess_v.name, 6) as decimal) ASC;
+    '''
+INSTRUMENT_UNASSIGNED_HEADERS = ["TESS","Id","MAC Addr.","Zero Point","Filter","Azimuth","Altitude","Site","Enabled","Registered"]
+
+INSTRUMENT_ANONYMOUS_SQL = '''
+    SELECT name,mac_address,min(valid_since),max(valid_until),min(valid_state)
+    FROM name_to_mac_t
+    GROUP BY name
+    HAVING min(valid_state) = :expired
+    ORDER BY CAST(substr(name, 6) as decimal) ASC;
+    '''
+INSTRUMENT_ANONYMOUS_HEADERS = ["TESS Tag (free)","Previous MAC Addr.","Name valid since","Name valid until","State"]
+
+INSTRUMENT_RENAMINGS_HEADERS = ["When","MAC Addr.","Original TESS Name","Renamed To TESS name"]
+
+# Shared by single and bulk instrument creation
+INSTRUMENT_INSERT_SQL = '''
+    INSERT INTO tess_t (
+        mac_address, 
+        zero_point,
+        filter,
+        azimuth,
+        altitude,
+        registered,
+        valid_since,
+        valid_until,
+        valid_state
+    ) VALUES (
+        :mac,
+        :zp,
+        :filter,
+        :azimuth,
+        :altitude,
+        :registered,
+        :eff_date,
+        :exp_date,
+        :valid_flag
+    )
+    '''
+
+NAME_INSERT_SQL = '''
+    INSERT INTO name_to_mac_t (
+        name,
+        mac_address, 
+        valid_since,
+        valid_until,
+        valid_state
+    ) VALUES (
+        :name,
+        :mac,
+        :eff_date,
+        :exp_date,
+        :valid_flag
+    )
+    '''
 
 # -----------------------
 # Module global variables
@@ -53,295 +129,64 @@ from .utils      import paging
 # ----------------------
 
 def instrument_coalesce(connection, options):
+    row = {}
     if options.name:
-        instrument_coalesce_group_by_name(connection, options)
+        row['name'] = options.name
+        where = "WHERE t.mac_address IN (SELECT mac_address FROM name_to_mac_t WHERE name == :name)"
     elif options.mac:
-        instrument_coalesce_by_mac(connection, options)
-    elif options.all:
-        instrument_coalesce_all(connection, options)
+        row['mac'] = options.mac
+        where = "WHERE t.mac_address == :mac"
+    else:
+        where = ""
+    instrument_coalesce_runs(connection, options, where, row)
 
 
-def instrument_coalesce_by_mac(connection,options):
-    cursor = connection.cursor()
-    row = {'mac': options.mac}
-    cursor.execute(
-        '''
-        SELECT (SELECT name FROM name_to_mac_t WHERE mac_address == src.mac_address), src.mac_address,src.tess_id, dst.tess_id, src.zero_point, src.filter, src.azimuth, src.altitude
-        FROM tess_t AS src
-        CROSS JOIN tess_t AS dst
-        WHERE src.mac_address == dst.mac_address
-        AND src.tess_id       != dst.tess_id
-        AND src.valid_until   == dst.valid_since
-        AND src.zero_point    == dst.zero_point
-        AND src.filter        == dst.filter
-        AND src.azimuth       == dst.azimuth
-        AND src.altitude      == dst.altitude
-        AND src.mac_address   == :mac
-        ORDER BY src.valid_since ASC
-        ''', row)
-    paging(cursor,["TESS","MAC","From Id","To Id","ZP","Filter","Azimuth","Altitude"],size=20)
-    cursor.execute(
-        '''
-        SELECT :mac, count(*) 
-        FROM tess_readings_t
-        WHERE tess_id IN 
-        (
-            SELECT src.tess_id
-            FROM tess_t AS src
-            CROSS JOIN tess_t AS dst
-            WHERE src.mac_address == dst.mac_address
-            AND src.tess_id       != dst.tess_id
-            AND src.valid_until   == dst.valid_since
-            AND src.zero_point    == dst.zero_point
-            AND src.filter        == dst.filter
-            AND src.azimuth       == dst.azimuth
-            AND src.altitude      == dst.altitude
-            AND src.mac_address   == :mac
-            ORDER BY src.valid_since ASC
-        )
-        ''', row)
-    paging(cursor,["MAC","#Readings"])
-    if options.test:
+def instrument_coalesce_runs(connection, options, where, row):
+    '''
+    Coalesces consecutive tess_t versions with identical attributes.
+    Versions are loaded once and runs found in a single pass. All runs are then
+    merged in one transaction through a TEMP old -> new tess_id mapping table
+    (see utils.remap).
+    '''
+    runs = find_runs(load_versions(connection, where, row))
+    if not runs:
+        print("Nothing to coalesce.")
         return
-
-    cursor.execute(
-        '''
-        SELECT MAX(dst.tess_id), MIN(src.valid_since)
-        FROM tess_t AS src
-        CROSS JOIN tess_t AS dst
-        WHERE src.mac_address == dst.mac_address
-        AND src.tess_id       != dst.tess_id
-        AND src.valid_until   == dst.valid_since
-        AND src.zero_point    == dst.zero_point
-        AND src.filter        == dst.filter
-        AND src.azimuth       == dst.azimuth
-        AND src.altitude      == dst.altitude
-        AND src.mac_address   == :mac
-        GROUP BY src.mac_address
-        ORDER BY src.valid_since ASC;
-        ''', row)
-    result = cursor.fetchone()
-    row['target_tess_id'] = result[0]
-    row[ 'target_date']   = result[1]
-    # change all readings frist
-    cursor.execute(
-        '''
-        UPDATE tess_readings_t
-        SET  tess_id = :target_tess_id
-        WHERE tess_id IN
-        (
-            SELECT src.tess_id
-            FROM tess_t AS src
-            CROSS JOIN tess_t AS dst
-            WHERE src.mac_address == dst.mac_address
-            AND src.tess_id       != dst.tess_id
-            AND src.valid_until   == dst.valid_since
-            AND src.zero_point    == dst.zero_point
-            AND src.filter        == dst.filter
-            AND src.azimuth       == dst.azimuth
-            AND src.altitude      == dst.altitude
-            AND src.mac_address   == :mac
-            ORDER BY src.valid_since ASC
-        )
-        ''', row)
-    
-
-    # delete all intermediate tess_ids
-    cursor.execute(
-        '''
-        DELETE FROM tess_t
-        WHERE tess_id IN
-        (
-            SELECT src.tess_id
-            FROM tess_t AS src
-            CROSS JOIN tess_t AS dst
-            WHERE src.mac_address == dst.mac_address
-            AND src.tess_id       != dst.tess_id
-            AND src.valid_until   == dst.valid_since
-            AND src.zero_point    == dst.zero_point
-            AND src.filter        == dst.filter
-            AND src.azimuth       == dst.azimuth
-            AND src.altitude      == dst.altitude
-            AND src.mac_address   == :mac
-            ORDER BY src.valid_since ASC
-        )
-        ''', row)
-    
-    # Fix target tess_id, this must be done last
-    cursor.execute(
-        '''
-        UPDATE tess_t
-        SET  valid_since = :target_date
-        WHERE tess_id   == :target_tess_id
-        ''', row)
-    connection.commit()
-
-
-
-
-
-def instrument_coalesce_group_by_name(connection,options):
-    cursor = connection.cursor()
-    row = {'name': options.name}
-    cursor.execute(
-        '''
-        SELECT :name, src.mac_address, src.tess_id, dst.tess_id, src.zero_point, src.filter, src.azimuth, src.altitude
-        FROM tess_t AS src
-        CROSS JOIN tess_t AS dst
-        WHERE src.mac_address == dst.mac_address
-        AND src.tess_id       != dst.tess_id
-        AND src.valid_until   == dst.valid_since
-        AND src.zero_point    == dst.zero_point
-        AND src.filter        == dst.filter
-        AND src.azimuth       == dst.azimuth
-        AND src.altitude      == dst.altitude
-        AND src.mac_address IN (SELECT mac_address FROM name_to_mac_t WHERE name == :name)
-        ORDER BY src.valid_since ASC
-        ''', row)
-    paging(cursor,["TESS","MAC","From Id","To Id","ZP", "Filter","Azimuth","Altitude"], size=20)
-    cursor.execute(
-        '''
-        SELECT :name, count(*) 
-        FROM tess_readings_t
-        WHERE tess_id IN 
-        (
-            SELECT src.tess_id
-            FROM tess_t AS src
-            CROSS JOIN tess_t AS dst
-            WHERE src.mac_address == dst.mac_address
-            AND src.tess_id       != dst.tess_id
-            AND src.valid_until   == dst.valid_since
-            AND src.zero_point    == dst.zero_point
-            AND src.filter        == dst.filter
-            AND src.azimuth       == dst.azimuth
-            AND src.altitude      == dst.altitude
-            AND src.mac_address IN (SELECT mac_address FROM name_to_mac_t WHERE name == :name)
-            ORDER BY src.valid_since ASC
-        )
-        ''', row)
-    paging(cursor,["Name","#Readings"], size=20)
+    result = [(run.name, run.mac, ', '.join(str(i) for i in run.sources), run.target, run.valid_since, run.valid_until) + run.attributes for run in runs]
+    print(tabulate.tabulate(result, headers=["TESS","MAC","From Ids","To Id","Valid Since","Valid Until","ZP","Filter","Azimuth","Altitude"], tablefmt='grid'))
+    with DryRun(connection, options.test) as dry, Progress(connection, 'coalesce', options.max_time) as progress:
+        remapper = Remapper(connection, 'tess_id')
+        add_mappings(remapper, runs)
+        # change all readings first
+        remapper.apply(progress, collect=dry.collect)
+        # delete all intermediate tess_ids and fix targets, this must be done last
+        versions = collapse_versions(connection, runs)
+    macs = {run.target: run.mac for run in runs}
+    result = [(macs[tess_id], tess_id, start, end, count) for (tess_id,), start, end, count in dry.summary()]
+    print(tabulate.tabulate(result, headers=["MAC","To Id","Start Date","End Date","#Readings"], tablefmt='grid'))
     if options.test:
-        return
-
-    cursor.execute(
-        '''
-        SELECT MAX(dst.tess_id), MIN(src.valid_since)
-        FROM tess_t AS src
-        CROSS JOIN tess_t AS dst
-        WHERE src.mac_address == dst.mac_address
-        AND src.tess_id       != dst.tess_id
-        AND src.valid_until   == dst.valid_since
-        AND src.zero_point    == dst.zero_point
-        AND src.filter        == dst.filter
-        AND src.azimuth       == dst.azimuth
-        AND src.altitude      == dst.altitude
-        AND src.mac_address IN (SELECT mac_address FROM name_to_mac_t WHERE name == :name)
-        GROUP BY src.mac_address
-        ORDER BY src.valid_since ASC;
-        ''', row)
-    result = cursor.fetchone()
-    row['target_tess_id'] = result[0]
-    row[ 'target_date']   = result[1]
-
-    # change all readings first
-    cursor.execute(
-        '''
-        UPDATE tess_readings_t
-        SET  tess_id = :target_tess_id
-        WHERE tess_id IN
-        (
-            SELECT src.tess_id
-            FROM tess_t AS src
-            CROSS JOIN tess_t AS dst
-            WHERE src.mac_address == dst.mac_address
-            AND src.tess_id       != dst.tess_id
-            AND src.valid_until   == dst.valid_since
-            AND src.zero_point    == dst.zero_point
-            AND src.filter        == dst.filter
-            AND src.azimuth       == dst.azimuth
-            AND src.altitude      == dst.altitude
-            AND src.mac_address IN (SELECT mac_address FROM name_to_mac_t WHERE name == :name)
-            ORDER BY src.valid_since ASC
-        )
-        ''', row)
-   
-
-    # delete all intermediate tess_ids
-    cursor.execute(
-        '''
-        DELETE FROM tess_t
-        WHERE tess_id IN
-        (
-            SELECT src.tess_id
-            FROM tess_t AS src
-            CROSS JOIN tess_t AS dst
-            WHERE src.mac_address == dst.mac_address
-            AND src.tess_id       != dst.tess_id
-            AND src.valid_until   == dst.valid_since
-            AND src.zero_point    == dst.zero_point
-            AND src.filter        == dst.filter
-            AND src.azimuth       == dst.azimuth
-            AND src.altitude      == dst.altitude
-            AND src.mac_address IN (SELECT mac_address FROM name_to_mac_t WHERE name == :name)
-            ORDER BY src.valid_since ASC
-        )
-        ''', row)
-
-      # Fix target tess_id, this must be done last
-    cursor.execute(
-        '''
-        UPDATE tess_t
-        SET  valid_since = :target_date
-        WHERE tess_id   = :target_tess_id
-        ''', row)
-
-    connection.commit()
-
-
-
-   
-
-
-def instrument_coalesce_all(connection,options):
-    cursor = connection.cursor()
-    row = {'name': options.name}
-    cursor.execute(
-        '''
-        SELECT src.mac_address,  MIN(src.tess_id), MAX(dst.tess_id), COUNT(*), MIN(src.valid_since), MAX(dst.valid_until), src.zero_point, src.filter, src.azimuth, src.altitude
-        FROM tess_t AS src
-        CROSS JOIN tess_t AS dst
-        WHERE src.mac_address == dst.mac_address
-        AND src.tess_id       != dst.tess_id
-        AND src.valid_until   == dst.valid_since
-        AND src.zero_point    == dst.zero_point
-        AND src.filter        == dst.filter
-        AND src.azimuth       == dst.azimuth
-        AND src.altitude      == dst.altitude
-        GROUP BY src.mac_address
-        ORDER BY src.valid_since ASC;
-        ''', row)
-    paging(cursor,["MAC","From TESS Id","To TESS Id","Count","From Date","To Date","ZP","Filter","Azimuth","Altitude"], size=20)
-    
-    cursor.execute(
-        '''
-        SELECT MAX(dst.tess_id), MIN(src.valid_since)
-        FROM tess_t AS src
-        CROSS JOIN tess_t AS dst
-        WHERE src.mac_address == dst.mac_address
-        AND src.tess_id       != dst.tess_id
-        AND src.valid_until   == dst.valid_since
-        AND src.zero_point    == dst.zero_point
-        AND src.filter        == dst.filter
-        AND src.azimuth       == dst.azimuth
-        AND src.altitude      == dst.altitude
-        GROUP BY src.mac_address
-        ORDER BY src.valid_since ASC;
-        ''', row)
-    
-
-
+        print("Test only. %d readings would be moved and %d tess_t rows deleted in %d runs." % (dry.changes, versions, len(runs)))
+    else:
+        print("Coalesced %d runs: %d readings moved and %d tess_t rows deleted." % (len(runs), dry.changes, versions))
 
 
+def instrument_at(connection, options):
+    '''Name, calibration and location valid for an instrument at a given time'''
+    timestamp = options.timestamp or datetime.datetime.utcnow()
+    tstamp = timestamp.strftime(TSTAMP_FORMAT)
+    resolver = InstrumentResolver(connection)
+    if options.name is not None:
+        name, mac, version = resolver.by_name(options.name, tstamp)
+        if mac is None:
+            raise IndexError("Instrument with name '%s' did not exist at %s." % (options.name, tstamp))
+    else:
+        name, mac, version = resolver.by_mac(options.mac, tstamp)
+        if name is None and version is None:
+            raise IndexError("Instrument with MAC '%s' did not exist at %s." % (options.mac, tstamp))
+    if version is None:
+        version = (None,) * 7
+    result = [(tstamp, name, mac) + tuple(version)]
+    print(tabulate.tabulate(result, headers=["Timestamp (UTC)","TESS","MAC Addr.","Id.","Zero Point","Filter","Azimuth","Altitude","Loc. Id","Site"], tablefmt='grid'))
 
 
 def instrument_assign(connection, options):
@@ -530,107 +375,146 @@ def instrument_name_current_attributes(connection, options):
     paging(cursor,["TESS","Id","MAC Addr.","Zero Point","Filter","Site","Enabled","Registered"], size=100)
 
 
+def instrument_rename_view(rows, headers, options):
+    if options.json:
+        print(json.dumps([row._asdict() for row in rows], indent=2))
+    else:
+        print(tabulate.tabulate(rows, headers=headers, tablefmt='grid'))
+
+
 def instrument_anonymous(connection, options):
-    cursor = connection.cursor()
-    row = {'state': EXPIRED}
-    cursor.execute(
-            '''
-            SELECT name,mac_address,min(valid_since),max(valid_until),min(valid_state)
-            FROM name_to_mac_t
-            GROUP BY name
-            HAVING min(valid_state) = :state
-            ORDER BY CAST(substr(name, 6) as decimal) ASC;
-            ''', row)
-    paging(cursor,["TESS Tag (free)","Previous MAC Addr.","Name valid since","Name valid until","State"])
+    graph = RenameGraph(connection, CURRENT)
+    since = options.since and options.since.strftime(TSTAMP_FORMAT)
+    instrument_rename_view(graph.anonymous(since), INSTRUMENT_ANONYMOUS_HEADERS, options)
+
+
+def instrument_renamings_query(connection, row):
+    '''Renamings in time order, for 'tess report' too'''
+    return RenameGraph(connection, row['state']).summary()
+
 
 def instrument_renamings(connection, options):
-    cursor = connection.cursor()
-    row = {'state': EXPIRED}
+    '''Summary, name and MAC renaming views, all from the same single pass over name_to_mac_t'''
+    graph = RenameGraph(connection, CURRENT)
+    since = options.since and options.since.strftime(TSTAMP_FORMAT)
     if options.summary:
-        cursor.execute(
-            '''
-            SELECT dst.valid_since,src.name,dst.name
-            FROM name_to_mac_t AS src
-            JOIN name_to_mac_t AS dst USING (mac_address)
-            WHERE src.name != dst.name
-            AND   src.valid_state == "Expired"
-            ORDER BY dst.valid_since ASC;
-            ''', row)
-        paging(cursor,["When","Original TESS Name","Renamed To TESS name"], size=100)
-
+        transitions = graph.summary(since)
+        instrument_rename_view(transitions[:options.count], INSTRUMENT_RENAMINGS_HEADERS, options)
+        omitted = max(len(transitions) - options.count, 0) if options.count is not None else 0
+        if not options.json and omitted:
+            print("%d more renamings not listed." % (omitted,))
     elif options.name:
-        cursor.execute(
-            '''
-            SELECT name,mac_address,valid_since,valid_until,valid_state
-            FROM name_to_mac_t
-            WHERE name in (SELECT name FROM name_to_mac_t GROUP BY name HAVING count(*) > 1)
-            ORDER BY CAST(substr(name, 6) as decimal) ASC;
-            ''', row)
-        paging(cursor,["TESS","MAC Addr.","Name valid since","Name valid until","State"], size=100)
+        instrument_rename_view(graph.names(since), ["TESS","MAC Addr.","Name valid since","Name valid until","State"], options)
+        if not options.json and graph.reassigned:
+            print("Names assigned to more than one MAC: %s" % (', '.join(graph.reassigned),))
     else:
-        cursor.execute(
-            '''
-            SELECT name,mac_address,valid_since,valid_until,valid_state
-            FROM name_to_mac_t
-            WHERE mac_address in (SELECT mac_address FROM name_to_mac_t GROUP BY mac_address HAVING count(*) > 1)
-            ORDER BY CAST(substr(name, 6) as decimal) ASC;
-            ''', row)
-        paging(cursor,["TESS","MAC Addr.","Name valid since","Name valid until","State"], size=100)
+        instrument_rename_view(graph.macs(since), ["TESS","MAC Addr.","Name valid since","Name valid until","State"], options)
+
+
+def instrument_check(connection, options):
+    '''
+    Validity interval consistency of tess_t and name_to_mac_t for the whole fleet,
+    one window function pass per table and partition key. Optionally repaired in bulk.
+    '''
+    row = {'current': CURRENT, 'expired': EXPIRED, 'infinite': INFINITE_TIME}
+    # (table, partition key, owner, also check orphan names, last expired version may be made current, close gaps)
+    # A MAC may really have had no name for a while, so its name gaps are only closed on request
+    checks = (
+        ('tess_t',        'mac_address', None,          False, True,  True),
+        ('name_to_mac_t', 'mac_address', None,          True,  False, options.close_gaps),
+        ('name_to_mac_t', 'name',        'mac_address', False, False, False),
+    )
+    issues = list()
+    for table, key, owner, orphans, _, _ in checks:
+        issues.extend(scd_check(connection, table, key, row, orphans, owner))
+    print(tabulate.tabulate(issues, headers=["Table.Key","Key","Issue","Row Id","Valid Since","Valid Until","State"], tablefmt='grid'))
+    summary = dict()
+    for issue in issues:
+        summary[issue.issue] = summary.get(issue.issue, 0) + 1
+    print(tabulate.tabulate(sorted(summary.items()), headers=["Issue","Count"], tablefmt='grid'))
+    if not issues:
+        print("No inconsistencies found.")
+        return
+    if not options.fix:
+        return
+    # Name partitions are only reported, as names are repaired through their MACs
+    result = list()
+    with DryRun(connection, options.test):
+        for table, key, _, orphans, last_current, gaps in checks[:2]:
+            if orphans:
+                result.append((table, 'orphans deleted', fix_orphans(connection)))
+            for repair, count in scd_fix(connection, table, key, row, last_current, gaps).items():
+                result.append((table, repair, count))
+        remaining = sum(len(scd_check(connection, table, key, row, orphans, owner)) for table, key, owner, orphans, _, _ in checks)
+    print(tabulate.tabulate(result, headers=["Table","Repair","Rows"], tablefmt='grid'))
+    if options.test:
+        print("Test only. %d issues would remain. Changes rolled back." % (remaining,))
+    else:
+        print("%d issues remain." % (remaining,))
 
 
 def instrument_unassigned(connection, options):
     cursor = connection.cursor()
     row = {'state': CURRENT, 'site1': UNKNOWN, 'site2': OUT_OF_SERVICE}
-    cursor.execute(
-            '''
-            SELECT name,tess_id,mac_address,zero_point,filter,azimuth,altitude,site,authorised,registered
-            FROM tess_v
-            WHERE valid_state == :state
-            AND (site == :site1 OR site == :site2)
-            ORDER BY CAST(substr(tess_v.name, 6) as decimal) ASC;
-            ''', row)
-    paging(cursor,["TESS","Id","MAC Addr.","Zero Point","Filter","Azimuth","Altitude","Site","Enabled","Registered"], size=100)
+    cursor.execute(INSTRUMENT_UNASSIGNED_SQL, row)
+    paging(cursor, INSTRUMENT_UNASSIGNED_HEADERS, size=100)
 
 
-def instrument_enable(connection, options):
+def instrument_selection(connection, options, row):
+    '''
+    Sets the selection parameters in row and returns the SQL condition selecting
+    current tess_t rows by --name, --mac, --select '<column> <op> <value>' or --from-file
+    '''
+    row['state'] = CURRENT
+    if getattr(options, 'select', None) is not None:
+        column, operator, row['select'] = parse_selector(options.select, {'name': 'name', 'mac': 'mac_address'})
+        return "mac_address IN (SELECT mac_address FROM name_to_mac_t WHERE %s %s :select AND valid_state == :state)" % (column, operator)
+    if getattr(options, 'from_file', None) is not None:
+        names = read_names(options.from_file)
+        table = load_selection(connection, names)
+        cursor = connection.cursor()
+        cursor.execute("SELECT name FROM %s WHERE name NOT IN (SELECT name FROM name_to_mac_t WHERE valid_state == :state)" % (table,), row)
+        missing = [name for name, in cursor]
+        if missing:
+            print("Ignoring unknown instrument names: %s" % (', '.join(missing),))
+        return "mac_address IN (SELECT mac_address FROM name_to_mac_t WHERE name IN (SELECT name FROM %s) AND valid_state == :state)" % (table,)
+    if options.mac is not None:
+        row['mac'] = options.mac
+        return "mac_address == :mac"
+    row['name'] = options.name
+    return "mac_address IN (SELECT mac_address FROM name_to_mac_t WHERE name == :name AND valid_state == :state)"
+
+
+def instrument_authorise(connection, options, authorised):
     cursor = connection.cursor()
-    row = {'name': options.name, 'state': CURRENT}
+    row = {'authorised': authorised}
+    condition = instrument_selection(connection, options, row)
     cursor.execute('''
         UPDATE tess_t 
-        SET authorised = 1 
-        WHERE mac_address IN (SELECT mac_address FROM name_to_mac_t WHERE name == :name AND valid_state == :state)
-        AND valid_state == :state
-        ''',row)
-    
+        SET authorised = :authorised
+        WHERE valid_state == :state
+        AND %s
+        ''' % (condition,), row)
+    if cursor.rowcount == 0:
+        raise IndexError("No instrument matches the selection.")
+    connection.commit()
     cursor.execute(
         '''
         SELECT name,site,authorised
         FROM tess_v
         WHERE valid_state == :state
-        AND name = :name
-        ''',row)
-    paging(cursor,["TESS","Site","Authorised"])
-    connection.commit()    
+        AND %s
+        ORDER BY name
+        ''' % (condition,), row)
+    paging(cursor,["TESS","Site","Authorised"], size=options.page_size)
+
+
+def instrument_enable(connection, options):
+    instrument_authorise(connection, options, 1)
+
 
 def instrument_disable(connection, options):
-    cursor = connection.cursor()
-    row = {'tess': options.name, 'state': CURRENT}
-    cursor.execute('''
-        UPDATE tess_t 
-        SET authorised = 0 
-        WHERE mac_address IN (SELECT mac_address FROM name_to_mac_t WHERE name == :name AND valid_state == :state) 
-        AND valid_state == :state
-        ''',row)
-    
-    cursor.execute(
-        '''
-        SELECT name,site,authorised
-        FROM tess_v
-        WHERE valid_state == :state
-        AND name = :tess
-        ''',row)
-    paging(cursor,["TESS","Site","Authorised"])
-    connection.commit()    
+    instrument_authorise(connection, options, 0)
 
 
 def instrument_create(connection, options):
@@ -670,46 +554,8 @@ def instrument_create(connection, options):
     if result:
         raise IndexError("Other instrument already using friendly name %s" % (row['name'],) )
     # Write into database
-    cursor.execute(
-        '''
-        INSERT INTO tess_t (
-            mac_address, 
-            zero_point,
-            filter,
-            azimuth,
-            altitude,
-            registered,
-            valid_since,
-            valid_until,
-            valid_state
-        ) VALUES (
-            :mac,
-            :zp,
-            :filter,
-            :azimuth,
-            :altitude,
-            :registered,
-            :eff_date,
-            :exp_date,
-            :valid_flag
-        )
-        ''',  row)
-    cursor.execute(
-        '''
-        INSERT INTO name_to_mac_t (
-            name,
-            mac_address, 
-            valid_since,
-            valid_until,
-            valid_state
-        ) VALUES (
-            :name
-            :mac,
-            :eff_date,
-            :exp_date,
-            :valid_flag
-        )
-        ''',  row)
+    cursor.execute(INSTRUMENT_INSERT_SQL, row)
+    cursor.execute(NAME_INSERT_SQL, row)
     connection.commit()
     # Now display it
     cursor.execute(
@@ -729,6 +575,77 @@ def instrument_create(connection, options):
     paging(cursor,["TESS","MAC Addr.","Calibration","Filter","Azimuth","Altitude","Registered","Site"])
     
 
+def instrument_import(connection, options):
+    '''
+    Bulk instrument creation from a CSV file with a name,mac,zp,filter[,azimuth,altitude] header.
+    Rows are validated against the existing current names and MACs loaded once,
+    then all new instruments are inserted in a single transaction.
+    '''
+    cursor = connection.cursor()
+    row = {'valid_flag': CURRENT}
+    cursor.execute("SELECT mac_address FROM tess_t WHERE valid_state == :valid_flag", row)
+    macs = set(mac for mac, in cursor)
+    cursor.execute("SELECT name, mac_address FROM name_to_mac_t WHERE valid_state == :valid_flag", row)
+    names = dict(cursor.fetchall())
+    eff_date = datetime.datetime.utcnow().strftime(TSTAMP_FORMAT)
+
+    created, skipped, conflicts = list(), list(), list()
+    seen_names, seen_macs = dict(), dict()  # name -> (line, mac) and mac -> line in the file
+    with open(options.csv_file, newline='') as fd:
+        for lineno, line in enumerate(csv.DictReader(fd), start=2):
+            name = (line.get('name') or '').strip()
+            mac  = (line.get('mac') or '').strip()
+            try:
+                if not name or not mac:
+                    raise ValueError("missing name or MAC")
+                item = {
+                    'name'      : name,
+                    'mac'       : mac,
+                    'zp'        : float(line['zp']),
+                    'filter'    : line['filter'].strip(),
+                    'azimuth'   : float(line.get('azimuth') or DEFAULT_AZIMUTH),
+                    'altitude'  : float(line.get('altitude') or DEFAULT_ALTITUDE),
+                    'registered': MANUAL,
+                    'valid_flag': CURRENT,
+                    'eff_date'  : eff_date,
+                    'exp_date'  : INFINITE_TIME,
+                }
+            except (KeyError, ValueError, TypeError, AttributeError) as e:
+                conflicts.append((lineno, name, mac, "Invalid row: %s" % (e,)))
+                continue
+            # Rows repeated within the file are told apart from those already in the database
+            if seen_names.get(name, (None, None))[1] == mac:
+                skipped.append((lineno, name, mac, "Duplicate of line %d" % (seen_names[name][0],)))
+            elif name in seen_names:
+                conflicts.append((lineno, name, mac, "Name also given in line %d" % (seen_names[name][0],)))
+            elif mac in seen_macs:
+                conflicts.append((lineno, name, mac, "MAC also given in line %d" % (seen_macs[mac],)))
+            elif names.get(name) == mac:
+                skipped.append((lineno, name, mac, "Already registered"))
+            elif name in names:
+                conflicts.append((lineno, name, mac, "Name already used by %s" % (names[name],)))
+            elif mac in macs:
+                conflicts.append((lineno, name, mac, "MAC already registered"))
+            else:
+                created.append(item)
+            seen_names.setdefault(name, (lineno, mac))
+            seen_macs.setdefault(mac, lineno)
+
+    if created and not options.test:
+        cursor.executemany(INSTRUMENT_INSERT_SQL, created)
+        cursor.executemany(NAME_INSERT_SQL, created)
+        connection.commit()
+    result = [(item['name'], item['mac'], item['zp'], item['filter'], item['azimuth'], item['altitude']) for item in created]
+    if result:
+        print(tabulate.tabulate(result, headers=["TESS","MAC Addr.","Zero Point","Filter","Azimuth","Altitude"], tablefmt='grid'))
+    if skipped or conflicts:
+        print(tabulate.tabulate(sorted(skipped + conflicts), headers=["Line","TESS","MAC Addr.","Reason"], tablefmt='grid'))
+    if options.test:
+        print("Test only. %d instruments would be created, %d skipped, %d conflicting." % (len(created), len(skipped), len(conflicts)))
+    else:
+        print("%d instruments created, %d skipped, %d conflicting." % (len(created), len(skipped), len(conflicts)))
+
+
 def instrument_rename(connection, options):
     cursor = connection.cursor()
     row = {}
@@ -836,14 +753,6 @@ def instrument_delete(connection, options):
                 % (options.mac,) )
         row['name'] = result[0]
 
-    cursor.execute('''
-        SELECT COUNT(*) from tess_readings_t
-        WHERE tess_id IN (SELECT tess_id FROM tess_t WHERE mac_address == :mac)
-        ''', row)
-    result = cursor.fetchone()
-    if result[0] > 0:
-        raise IndexError("Cannot delete instrument. Existing readings with this instrument '%s' are already stored." % (row['mac'],) )
-
     # Find out what's being deleted
     print("About to delete")
     cursor.execute(
@@ -853,28 +762,52 @@ def instrument_delete(connection, options):
         WHERE  mac_address == :mac
         ''', row)
     paging(cursor,["TESS","Id.","MAC Addr.","Zero Point","Filter","Azimuth","Altitude","Site"])
-    
-    # Find out if it has accumulated readings
-    # This may go away if readings are stored in another database (i.e influxdb)
-    cursor.execute(
-        '''
-        SELECT i.mac_address, count(*) AS readings
-        FROM tess_readings_t AS r
-        JOIN tess_t          AS i USING (tess_id)
-        WHERE i.mac_address == :mac
-        ''', row)
-    paging(cursor,["TESS","Acumulated Readings"])
+    if options.archive is not None:
+        instrument_archive(connection, options, row)
+        return
 
-    if not options.test:
-        cursor.execute('''
-            DELETE 
-            FROM tess_readings_t
+    # Stops at the first stored reading instead of counting them all
+    cursor.execute('''
+        SELECT EXISTS (
+            SELECT 1 FROM tess_readings_t
             WHERE tess_id IN (SELECT tess_id FROM tess_t WHERE mac_address == :mac)
-            ''', row)
-        cursor.execute("DELETE FROM name_to_mac_t WHERE mac_address == :mac", row)
-        cursor.execute("DELETE FROM tess_t WHERE mac_address == :mac", row)
-        connection.commit()
-        print("Instrument and readings deleted")
+        )
+        ''', row)
+    if cursor.fetchone()[0]:
+        raise IndexError("Cannot delete instrument. Existing readings with this instrument '%s' are already stored." % (row['mac'],) )
+
+    # The real deletion is performed and rolled back in test mode.
+    with DryRun(connection, options.test):
+        names = cursor.execute("DELETE FROM name_to_mac_t WHERE mac_address == :mac", row).rowcount
+        versions = cursor.execute("DELETE FROM tess_t WHERE mac_address == :mac", row).rowcount
+    if options.test:
+        print("Test only. %d tess_t and %d name_to_mac_t rows would be deleted." % (versions, names))
+    else:
+        print("Instrument deleted: %d tess_t and %d name_to_mac_t rows." % (versions, names))
+
+
+def instrument_archive(connection, options, row):
+    '''Moves the instrument readings, tess_t and name_to_mac_t rows into an archive database'''
+    attach_archive(connection, options.archive, options.test)
+    commit = not options.test
+    try:
+        # Each chunk is committed as it is moved, except in test mode where everything is rolled back
+        with (DryRun(connection, True) if options.test else contextlib.nullcontext()), Progress(connection, 'archive', options.max_time) as progress:
+            archive_copy(connection, 'location_t', "location_id IN (SELECT location_id FROM main.tess_t WHERE mac_address == :mac)", row)
+            result = [
+                ('tess_readings_t', archive_move(connection, progress, 'tess_readings_t', "tess_id IN (SELECT tess_id FROM main.tess_t WHERE mac_address == :mac)", row, commit)),
+                ('name_to_mac_t',   archive_move(connection, progress, 'name_to_mac_t', "mac_address == :mac", row, commit)),
+                ('tess_t',          archive_move(connection, progress, 'tess_t', "mac_address == :mac", row, commit)),
+            ]
+            if commit:
+                connection.commit()
+    finally:
+        detach_archive(connection)
+    print(tabulate.tabulate(result, headers=["Table","Rows archived and deleted"], tablefmt='grid'))
+    if options.test:
+        print("Test only. Changes rolled back.")
+    else:
+        print("Instrument %s archived into %s and deleted." % (row['mac'], options.archive))
 
 
 def instrument_update(connection, options):
@@ -893,114 +826,83 @@ def instrument_raw_update(connection, options):
     '''Raw update lastest instrument calibration constant (with 'Current' state)'''
     cursor = connection.cursor()
     row = {}
-    row['name']       = options.name
-    row['valid_flag'] = CURRENT
-    cursor.execute(
-        '''
-        SELECT name, mac_address
-        FROM tess_v 
-        WHERE name == :name
-        AND valid_state == :valid_flag 
-        ''', row)
-    result = cursor.fetchone()
-    if not result:
-        raise IndexError("Cannot rename. Existing instrument with name %s does not exist."
-         % (options.name,) )
-    row['mac']           = result[1]
-
-    # Change only if passed in the command line
-    if options.zero_point is not None:
-        row['zp'] = options.zero_point
-        cursor.execute(
-        '''
-        UPDATE tess_t SET zero_point = :zp
-        WHERE mac_address == :mac AND valid_state == :valid_flag
-        ''', row)
-
-    if options.filter is not None:
-        row['filter'] = options.filter
-        cursor.execute(
-        '''
-        UPDATE tess_t SET filter = :filter
-        WHERE mac_address == :mac AND valid_state == :valid_flag
-        ''', row)
-
-    if options.azimuth is not None:
-        row['azimuth'] = options.azimuth
-        cursor.execute(
-        '''
-        UPDATE tess_t SET azimuth = :azimuth
-        WHERE mac_address == :mac AND valid_state == :valid_flag
-        ''', row)
-
-    if options.altitude is not None:
-        row['altitude'] = options.altitude
-        cursor.execute(
-        '''
-        UPDATE tess_t SET altitude = :altitude
-        WHERE mac_address == :mac AND valid_state == :valid_flag
-        ''', row)
-
-    if options.registered is not None:
-        row['registered'] = options.registered
-        cursor.execute(
-        '''
-        UPDATE tess_t SET registered = :registered
-        WHERE mac_address == :mac AND valid_state == :valid_flag
-        ''', row)
-
+    condition = instrument_selection(connection, options, row)
+
+    # Change only if passed in the command line, all in a single SET clause
+    columns = {
+        'zero_point': options.zero_point,
+        'filter'    : options.filter,
+        'azimuth'   : options.azimuth,
+        'altitude'  : options.altitude,
+        'registered': options.registered,
+    }
+    assignments = list()
+    for column, value in columns.items():
+        if value is not None:
+            row[column] = value
+            assignments.append("%s = :%s" % (column, column))
+    if not assignments:
+        raise ValueError("Nothing to update.")
+    cursor.execute(
+        '''
+        UPDATE tess_t SET %s
+        WHERE valid_state == :state AND %s
+        ''' % (', '.join(assignments), condition), row)
+    if cursor.rowcount == 0:
+        raise IndexError("Cannot update. No instrument matches the selection.")
     connection.commit()
-    print("Operation complete.")
+    print("Operation complete. %d instruments updated." % (cursor.rowcount,))
     cursor.execute(
         '''
         SELECT name, zero_point, filter, azimuth, altitude, valid_state, valid_since, valid_until, registered, site
         FROM   tess_v
-        WHERE  name == :name AND valid_state == :valid_flag 
-        ''', row)
+        WHERE  valid_state == :state AND %s
+        ORDER BY name
+        ''' % (condition,), row)
     paging(cursor,["TESS","Zero Point","Filter","Azimuth","Altitude","State","Since","Until", "Registered", "Site"])
 
 
-
-
 def instrument_controlled_update(connection, options):
     '''
     Update lastest instrument calibration constant with control change
-    creating a new row with new calibration state and valid interval
+    creating a new row with new calibration state and valid interval.
+    All selected instruments are versioned with two set based statements.
     '''
     cursor = connection.cursor()
     row = {}
-    row['name']       = options.name
-    row['valid_flag'] = CURRENT
+    condition = instrument_selection(connection, options, row)
+    row['eff_date']      = options.start_time
+    row['exp_date']      = INFINITE_TIME
+    row['valid_expired'] = EXPIRED
+    row['zp']            = options.zero_point
+    row['filter']        = options.filter
+    row['azimuth']       = options.azimuth
+    row['altitude']      = options.altitude
+    row['registered']    = options.registered
+    if all(row[column] is None for column in ('zp', 'filter', 'azimuth', 'altitude', 'registered')):
+        raise ValueError("Nothing to update.")
     cursor.execute(
         '''
-        SELECT mac_address, location_id, valid_since, zero_point, filter, azimuth, altitude, authorised, registered 
+        SELECT mac_address, valid_since
         FROM tess_t 
-        WHERE mac_address IN (SELECT mac_address FROM name_to_mac_t WHERE name == :name AND valid_state == :valid_flag)
-        AND valid_state == :valid_flag 
-        ''', row)
-    result = cursor.fetchone()
+        WHERE valid_state == :state AND %s
+        ''' % (condition,), row)
+    result = cursor.fetchall()
     if not result:
-        raise IndexError("Cannot rename. Existing instrument with name %s does not exist." % (options.name,) )
-    if result[2] >= options.start_time:
-        raise ValueError("Cannot set valid_since (%s) column to an equal or earlier date (%s)" % (result[2], options.start_time) )
+        raise IndexError("Cannot update. No instrument matches the selection.")
+    for mac, valid_since in result:
+        if valid_since >= options.start_time:
+            raise ValueError("Cannot set valid_since (%s) column of %s to an equal or earlier date (%s)" % (valid_since, mac, options.start_time) )
 
-    row['mac']           = result[0]
-    row['location']      = result[1]
-    row['eff_date']      = options.start_time
-    row['exp_date']      = INFINITE_TIME
-    row['valid_expired'] = EXPIRED
-    row['zp']            = result[3] if options.zero_point is None else options.zero_point
-    row['filter']        = result[4] if options.filter is None else options.filter
-    row['azimuth']       = result[5] if options.azimuth is None else options.azimuth
-    row['altitude']      = result[6] if options.altitude is None else options.altitude
-    row['authorised']    = result[7]
-    row['registered']    = result[8] if options.registered is None else options.registered
+    # Expire the current versions ...
     cursor.execute(
         '''
         UPDATE tess_t SET valid_until = :eff_date, valid_state = :valid_expired
-        WHERE mac_address == :mac AND valid_state == :valid_flag
-        ''', row)
-
+        WHERE valid_state == :state AND %s
+        RETURNING rowid
+        ''' % (condition,), row)
+    expired = ",".join(str(rowid) for rowid, in cursor.fetchall())
+    # ... and create the new ones from exactly those rows
     cursor.execute(
         '''
         INSERT INTO tess_t (
@@ -1015,43 +917,30 @@ def instrument_controlled_update(connection, options):
             authorised,
             registered,
             location_id
-        ) VALUES (
-            :mac,
-            :zp,
-            :filter,
-            :azimuth,
-            :altitude,
-            :eff_date,
-            :exp_date,
-            :valid_flag,
-            :authorised,
-            :registered,
-            :location
-            )
-        ''',  row)
-    cursor.execute(
-        '''
-        INSERT INTO name_to_mac_t (
-            name,
-            mac_address, 
-            valid_since,
-            valid_until,
-            valid_state
-        ) VALUES (
-            :name
-            :mac,
+        ) 
+        SELECT
+            mac_address,
+            coalesce(:zp, zero_point),
+            coalesce(:filter, filter),
+            coalesce(:azimuth, azimuth),
+            coalesce(:altitude, altitude),
             :eff_date,
             :exp_date,
-            :valid_flag
-        )
-        ''',  row)
+            :state,
+            authorised,
+            coalesce(:registered, registered),
+            location_id
+        FROM tess_t
+        WHERE rowid IN (%s)
+        ''' % (expired,), row)
     connection.commit()
-    print("Operation complete.")
+    print("Operation complete. %d instruments updated." % (cursor.rowcount,))
     
     cursor.execute(
         '''
         SELECT name, zero_point, filter, azimuth, altitude, valid_state, valid_since, valid_until, authorised, registered, site
         FROM   tess_v
-        WHERE  name == :name
-        ''', row)
+        WHERE  %s
+        ORDER BY name, valid_since
+        ''' % (condition,), row)
     paging(cursor,["TESS","Zero Point","Filter","Azimuth","Altitude","State","Since","Until", "Authorised","Registered","Site"])
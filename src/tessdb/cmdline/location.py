@@ -18,15 +18,16 @@ import sqlite3
 import os
 import os.path
 import datetime
+import csv
+import json
 import logging
+import contextlib
 
 #--------------
 # other imports
 # -------------
 
-from timezonefinder import TimezoneFinder
-from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
+import tabulate
 
 #--------------
 # local imports
@@ -37,11 +38,100 @@ from . import OUT_OF_SERVICE, MANUAL, DEFAULT_AZIMUTH, DEFAULT_ALTITUDE
 from . import TSTAMP_FORMAT, DEFAULT_START_DATE, DEFAULT_END_DATE
 
 from .utils import paging
+from .utils.dryrun import DryRun
+from .utils.progress import Progress
+from .utils.archive import attach_archive, detach_archive, archive_move
+from .utils.remap import Remapper
+from .utils.kdtree import SiteTree
+from .utils.geo import duplicates
+from .utils import placediff
+from .utils import search
+from .utils import skymap
+from .utils.geocoding import Geocoder, NominatimBackend, GazetteerBackend
+from .utils.geocoding import MIN_DELAY
+from .utils.geocoding import Place, Timezones, reverse_all
+
+# ----------------
+# Module constants
+# ----------------
+
+# Readings index on location_id, created by 'location usage --index'
+# or temporarily by 'location merge' if missing
+MERGE_INDEX = "idx_location_id"
+
+# Existing sites listed when creating a site close to them
+NEARBY_SITES = 5
+
+# Timezone given to sites when it could not be determined
+DEFAULT_TZONE = "Etc/UTC"
+
+# Sites closer than this many decimal degrees (~11 m) are the same place on import
+COORD_DECIMALS = 4
+
+# Queries shared between the single subcommands and 'tess report'
+
+LOCATION_UNASSIGNED_SQL = '''
+    SELECT l.site,l.longitude,l.latitude,l.elevation,l.contact_name,l.contact_email 
+    FROM location_t        AS l 
+    LEFT OUTER JOIN tess_t AS i USING (location_id)
+    WHERE i.tess_id IS NULL;
+    '''
+LOCATION_UNASSIGNED_HEADERS = ["Name","Longitude","Latitude","Elevation","Contact","Email"]
+
+LOCATION_INSERT_SQL = '''
+    INSERT INTO location_t (
+        site,
+        longitude, 
+        latitude,
+        elevation,
+        zipcode,
+        location,
+        province,
+        country,
+        contact_email,
+        contact_name,
+        organization,
+        timezone
+    ) VALUES (
+        :site,
+        :longitude,
+        :latitude,
+        :elevation,
+        :zipcode,
+        :location,
+        :province,
+        :country,
+        :email,
+        :owner,
+        :org,
+        :tzone
+        )
+    '''
+
+LOCATION_DUPLICATES_HEADERS = ["Cluster","Site","Longitude","Latitude","Nearest Site","Distance (m)"]
+
+LOCATION_SEARCH_HEADERS = ["Name","Id.","Location","Province","Country","Organization","Score"]
+
+LOCATION_DIFF_HEADERS = ["Issue","Site","Registry Site","Id.","Field","tessdb","Registry","Distance (m)"]
 
 # --------------------
 # LOCATION SUBCOMMANDS
 # --------------------
 
+def location_indexed(cursor):
+    '''True if some full (not partial) index on tess_readings_t has location_id as its first column'''
+    cursor.execute(
+        '''
+        SELECT 1
+        FROM pragma_index_list('tess_readings_t') AS l
+        JOIN pragma_index_info(l.name) AS i
+        WHERE l.partial == 0
+        AND   i.seqno == 0
+        AND   i.name == 'location_id'
+        ''')
+    return cursor.fetchone() is not None
+
+
 def location_list_short(connection, options):
     cursor = connection.cursor()
     cursor.execute(
@@ -107,97 +197,265 @@ def location_list(connection, options):
 def location_delete(connection, options):
     row = {'name': options.name}
     cursor = connection.cursor()
-    # Fetch ithis location has been used
+    if options.archive is not None:
+        location_archive(connection, options, row)
+        return
+    # Probe whether this location has been used: stops at the first reading
+    # instead of counting them all, and is immediate with the location index
+    if not location_indexed(cursor):
+        print("WARNING: no location_id index on tess_readings_t, looking for readings of '%s' may take long. Create it with 'location usage --index'." % (options.name,))
     cursor.execute('''
-        SELECT COUNT(*) from tess_readings_t
-        WHERE location_id = (SELECT location_id FROM location_t WHERE site == :name)
+        SELECT EXISTS (
+            SELECT 1 FROM tess_readings_t
+            WHERE location_id = (SELECT location_id FROM location_t WHERE site == :name)
+        )
         ''', row)
     result = cursor.fetchone()
-    if result[0] > 0:
+    if result[0]:
         raise IndexError("Cannot delete. Existing readings with this site '%s' are already stored." % (options.name,) )
-    cursor.execute(
-        '''
-        SELECT l.site,l.location_id,l.longitude,l.latitude,l.elevation
-        FROM location_t AS l
-        WHERE l.site == :name
-        ''', row)
-    paging(cursor,["Name","Id.","Longitude","Latitude","Elevation"], size=100)
-    if not options.test:
-        cursor.execute(
-        '''
-        DELETE
-        FROM location_t
-        WHERE site == :name
+    # The real deletion is performed and rolled back in test mode
+    with DryRun(connection, options.test) as dry:
+        result = dry.execute(
+            '''
+            DELETE
+            FROM location_t
+            WHERE site == :name
+            RETURNING site,location_id,longitude,latitude,elevation
+            ''', row)
+    print(tabulate.tabulate(result, headers=["Name","Id.","Longitude","Latitude","Elevation"], tablefmt='grid'))
+    if options.test:
+        print("Test only. Changes rolled back.")
+
+
+def location_archive(connection, options, row):
+    '''Moves the location readings and location_t row into an archive database'''
+    cursor = connection.cursor()
+    cursor.execute("SELECT location_id FROM location_t WHERE site == :name", row)
+    result = cursor.fetchone()
+    if not result:
+        raise IndexError("Cannot delete. Site with name %s does not exists." % (options.name,) )
+    row['location_id'] = result[0]
+    # Instrument versions would be left pointing to a site no longer in location_t
+    cursor.execute("SELECT COUNT(*) FROM tess_t WHERE location_id == :location_id", row)
+    result = cursor.fetchone()
+    if result[0]:
+        raise IndexError("Cannot archive. %d instrument versions are assigned to site '%s'." % (result[0], options.name) )
+    attach_archive(connection, options.archive, options.test)
+    commit = not options.test
+    try:
+        # Each chunk is committed as it is moved, except in test mode where everything is rolled back
+        with (DryRun(connection, True) if options.test else contextlib.nullcontext()), Progress(connection, 'archive', options.max_time) as progress:
+            result = [
+                ('tess_readings_t', archive_move(connection, progress, 'tess_readings_t', "location_id == :location_id", row, commit)),
+                ('location_t',      archive_move(connection, progress, 'location_t', "location_id == :location_id", row, commit)),
+            ]
+            if commit:
+                connection.commit()
+    finally:
+        detach_archive(connection)
+    print(tabulate.tabulate(result, headers=["Table","Rows archived and deleted"], tablefmt='grid'))
+    if options.test:
+        print("Test only. Changes rolled back.")
+    else:
+        print("Location %s archived into %s and deleted." % (options.name, options.archive))
+
+
+def location_merge(connection, options):
+    '''
+    Merges duplicate sites into the one kept: readings and instruments of the
+    dropped sites are moved to it and the dropped location_t rows deleted.
+    Readings are remapped in chunks of rows found through a location_id index,
+    created for the merge if missing, each chunk committed unless in test mode,
+    so the tessdb writer stays live. Instruments and sites are only changed
+    once all readings are moved, so an interrupted merge can simply be run again.
+    '''
+    cursor = connection.cursor()
+    row = {'keep': options.keep}
+    cursor.execute("SELECT location_id FROM location_t WHERE site == :keep", row)
+    result = cursor.fetchone()
+    if not result:
+        raise IndexError("Cannot merge. Site with name %s does not exists." % (options.keep,) )
+    row['keep_id'] = result[0]
+    drops = list()
+    for site in options.drop:
+        cursor.execute("SELECT location_id FROM location_t WHERE site == ?", (site,))
+        result = cursor.fetchone()
+        if not result:
+            raise IndexError("Cannot merge. Site with name %s does not exists." % (site,) )
+        if result[0] == row['keep_id']:
+            raise ValueError("Cannot merge site %s into itself." % (site,) )
+        drops.append((site, result[0]))
+    drop_ids = ",".join(str(location_id) for site, location_id in drops)
+
+    indexed = location_indexed(cursor)
+    # Test mode leaves the database untouched and falls back to rowid chunks
+    temporary = not indexed and not options.test
+    if temporary:
+        print("Creating temporary index %s ..." % (MERGE_INDEX,))
+        cursor.execute("CREATE INDEX IF NOT EXISTS %s ON tess_readings_t(location_id)" % (MERGE_INDEX,))
+        connection.commit()
+        indexed = True
+    remapper = Remapper(connection, 'location_id')
+    for site, location_id in drops:
+        remapper.add(location_id, row['keep_id'])
+    commit = not options.test
+    try:
+        # Each chunk is committed as it is remapped, except in test mode where everything is rolled back
+        with (DryRun(connection, True) if options.test else contextlib.nullcontext()), Progress(connection, 'merge', options.max_time) as progress:
+            remapper.apply(progress, commit=commit, indexed=indexed)
+            cursor.execute("UPDATE tess_t SET location_id = :keep_id WHERE location_id IN (%s)" % (drop_ids,), row)
+            instruments = cursor.rowcount
+            cursor.execute("DELETE FROM location_t WHERE location_id IN (%s)" % (drop_ids,))
+            if commit:
+                connection.commit()
+    finally:
+        if temporary:
+            cursor.execute("DROP INDEX IF EXISTS %s" % (MERGE_INDEX,))
+            connection.commit()
+    result = [(', '.join(site for site, _ in drops), ', '.join(str(location_id) for _, location_id in drops), options.keep, row['keep_id'], first, last, count) 
+        for _, _, first, last, count in remapper.summary()]
+    print(tabulate.tabulate(result, headers=["Dropped Sites","Ids.","Kept Site","Id.","Start Date","End Date","Readings moved"], tablefmt='grid'))
+    if options.test:
+        print("Test only. %d instrument versions would be moved. Changes rolled back." % (instruments,))
+        return
+    print("%d sites merged into %s, %d instrument versions moved." % (len(drops), options.keep, instruments))
+    if options.vacuum:
+        print("Compacting database ...")
+        connection.execute("VACUUM")
+
+
+def location_usage(connection, options):
+    '''
+    Readings count, first and last date and instruments per site,
+    computed in a single grouped pass over the readings
+    '''
+    cursor = connection.cursor()
+    if options.index:
+        print("Creating index %s ..." % (MERGE_INDEX,))
+        cursor.execute("CREATE INDEX IF NOT EXISTS %s ON tess_readings_t(location_id)" % (MERGE_INDEX,))
+        connection.commit()
+    row = {'state': CURRENT}
+    cursor.execute('''
+        SELECT t.tess_id, coalesce(n.name, t.mac_address)
+        FROM tess_t AS t
+        LEFT JOIN name_to_mac_t AS n ON n.mac_address == t.mac_address AND n.valid_state == :state
         ''', row)
-    connection.commit()
+    instruments = dict(cursor.fetchall())
+    if options.name is not None:
+        row['name'] = options.name
+        condition = "WHERE location_id == (SELECT location_id FROM location_t WHERE site == :name)"
+    else:
+        condition = ""
+    cursor.execute('''
+        SELECT location_id, COUNT(*), MIN(date_id), MAX(date_id), GROUP_CONCAT(DISTINCT tess_id)
+        FROM tess_readings_t
+        %s
+        GROUP BY location_id
+        ''' % (condition,), row)
+    usage = { location_id: (count, first, last, tess_ids) for location_id, count, first, last, tess_ids in cursor }
+    cursor.execute("SELECT location_id, site FROM location_t %s ORDER BY site" % ("WHERE site == :name" if options.name is not None else "",), row)
+    result = list()
+    for location_id, site in cursor.fetchall():
+        count, first, last, tess_ids = usage.get(location_id, (0, None, None, None))
+        if options.unused and count:
+            continue
+        names = sorted(set(instruments.get(int(tess_id), tess_id) for tess_id in tess_ids.split(','))) if tess_ids else []
+        result.append((site, location_id, count, first, last, ", ".join(names)))
+    print(tabulate.tabulate(result, headers=["Name","Id.","Records","First Date","Last Date","Instruments"], tablefmt='grid'))
+
+
+def location_nearest(connection, options):
+    tree = SiteTree.open(connection, options.dbase)
+    result = tree.nearest(options.longitude, options.latitude, k=options.count, within=options.within)
+    result = [(site, location_id, longitude, latitude, round(distance, 1)) for location_id, site, longitude, latitude, distance in result]
+    print(tabulate.tabulate(result, headers=["Name","Id.","Longitude","Latitude","Distance (m)"], tablefmt='grid'))
 
 
+def location_search(connection, options):
+    if options.reindex:
+        search.rebuild(connection)
+    elif not search.exists(connection):
+        raise ValueError("No site search index in this database. Create it with 'location search --reindex'")
+    result = search.search(connection, options.terms, limit=options.limit)
+    if result is None:
+        raise ValueError("No searchable words in: {0}".format(" ".join(options.terms)))
+    print(tabulate.tabulate(result, headers=LOCATION_SEARCH_HEADERS, tablefmt='grid'))
+
+
+def location_skymap(connection, options):
+    row = {}
+    row['start_date'] = int(options.start_date.strftime("%Y%m%d%H%M%S"))
+    row['end_date']   = int(options.end_date.strftime("%Y%m%d%H%M%S"))
+    if options.cell_size <= 0 or options.cell_size > 180:
+        raise ValueError("Cell size must be greater than 0 and at most 180 degrees: {0}".format(options.cell_size))
+    data = skymap.nightly(connection, row, options.dbase, options.archive)
+    cells = skymap.grid(data, options.cell_size)
+    write = skymap.write_geojson if options.format == 'geojson' else skymap.write_csv
+    if options.output is None:
+        write(cells, sys.stdout)
+    else:
+        with open(options.output, 'w', newline='') as fd:
+            write(cells, fd)
+        print(f"{len(cells)} cells from {len(data)} site nights written to {options.output}")
+
+
+def location_diff(connection, options):
+    if options.tolerance <= 0:
+        raise ValueError("Tolerance must be greater than 0 meters: {0}".format(options.tolerance))
+    registry = placediff.read_registry(options.against)
+    sites = placediff.load_sites(connection)
+    differences = placediff.diff(sites, registry, options.tolerance)
+    if options.json:
+        print(json.dumps([d._asdict() for d in differences], indent=2))
+        return
+    print(tabulate.tabulate(differences, headers=LOCATION_DIFF_HEADERS, tablefmt='grid'))
+    counts = {}
+    for d in differences:
+        counts[d.issue] = counts.get(d.issue, 0) + 1
+    summary = ", ".join(f"{n} {issue.lower()}" for issue, n in counts.items()) or "no differences"
+    print(f"Compared {len(sites)} sites against {len(registry)} registry places: {summary}")
 
 
 def location_unassigned(connection, options):
     cursor = connection.cursor()
-    cursor.execute(
-        '''
-        SELECT l.site,l.longitude,l.latitude,l.elevation,l.contact_name,l.contact_email 
-        FROM location_t        AS l 
-        LEFT OUTER JOIN tess_t AS i USING (location_id)
-        WHERE i.name IS NULL;
-        ''')
-    paging(cursor,["Name","Longitude","Latitude","Elevation","Contact","Email"], size=100)
+    cursor.execute(LOCATION_UNASSIGNED_SQL)
+    paging(cursor, LOCATION_UNASSIGNED_HEADERS, size=100)
+
+
+def location_duplicates_query(connection, row):
+    '''Clusters of sites closer than :distance meters to one another, for 'tess report' too'''
+    return duplicates(connection, row['distance'])
 
 
 def location_duplicates(connection, options):
-    cursor = connection.cursor()
     row = {}
     row['distance'] = options.distance
-    row['unknown'] = UNKNOWN
-    cursor.execute(
-        '''
-        SELECT src.site, dst.site, ABS(src.latitude - dst.latitude) AS DLat, ABS(src.longitude - dst.longitude) as DLong
-        FROM location_t AS src
-        JOIN location_t AS dst
-        WHERE  src.site      != dst.site
-        AND    src.longitude != :unknown
-        AND    dst.longitude != :unknown
-        AND    src.latitude  != :unknown
-        AND    src.longitude != :unknown
-        AND DLat  <= (:distance*180.0)/(6371000.0*3.1415926535)
-        AND DLong <= (:distance*180.0)/(6371000.0*3.1415926535)
-        ''', row)
-    paging(cursor,["Site A","Site B","Delta Latitude","Delta Longitude"], size=100)
+    result = location_duplicates_query(connection, row)
+    print(tabulate.tabulate(result, headers=LOCATION_DUPLICATES_HEADERS, tablefmt='grid'))
 
 
-geolocator = Nominatim(user_agent="STARS4ALL project")
-tf         = TimezoneFinder()  
+tf = Timezones()
+
+def location_geocoder(options, min_delay=MIN_DELAY):
+    if options.gazetteer is not None:
+        backend = GazetteerBackend(options.gazetteer)
+    else:
+        backend = NominatimBackend(min_delay=min_delay)
+    return Geocoder(backend, tf, 
+        path=options.geocache, precision=options.precision, ttl=options.ttl)
 
-def location_search_by_coord(row):
-    geocode = RateLimiter(geolocator.geocode, min_delay_seconds=2)
-    location = geolocator.reverse(f"{row['latitude']}, {row['longitude']}", language="en")
-    address = location.raw['address']
-    print(f"################## Geolocating Lat. {row['latitude']} Long. {row['longitude']} ##############")
 
-    print(address)
+def location_search_by_coord(row, geocoder):
+    place = geocoder.reverse(row['latitude'], row['longitude'])
+    print(f"################## Geolocating Lat. {row['latitude']} Long. {row['longitude']} ##############")
+    print(place)
     print("#"*78)
-    for location_type in ('village','town','city','municipality'):
-        try:
-            row['location'] = address[location_type]
-        except KeyError:
-            row['location'] = "Unknown"
-            continue
-        else:
-            break
-    for province_type in ('state','state_district'):
-        try:
-            row['province'] = address[province_type]
-        except KeyError:
-            row['province'] = "Unknown"
-            continue
-        else:
-            break
-    row['state'] = address.get('state_district',UNKNOWN)
-    row['zipcode'] = address.get('postcode',UNKNOWN)
-    row['country'] = address.get('country',UNKNOWN)
-    row['tzone'] = tf.timezone_at(lng=row['longitude'], lat=row['latitude'])
+    row['location'] = place.location
+    row['province'] = place.province
+    row['state']    = place.state
+    row['zipcode']  = place.zipcode
+    row['country']  = place.country
+    row['tzone']    = place.timezone
 
 
 
@@ -215,7 +473,11 @@ def location_create(connection, options):
     row['owner']     = options.owner
     row['org']       = options.org
   
-    location_search_by_coord(row)
+    geocoder = location_geocoder(options)
+    try:
+        location_search_by_coord(row, geocoder)
+    finally:
+        geocoder.close()
 
     # Fetch existing site
     cursor.execute(
@@ -227,36 +489,10 @@ def location_create(connection, options):
     result = cursor.fetchone()
     if result:
         raise IndexError("Cannot create. Existing site with name %s already exists." % (options.site,) )
-    cursor.execute(
-        '''
-        INSERT INTO location_t (
-            site,
-            longitude, 
-            latitude,
-            elevation,
-            zipcode,
-            location,
-            province,
-            country,
-            contact_email,
-            contact_name,
-            organization,
-            timezone
-        ) VALUES (
-            :site,
-            :longitude,
-            :latitude,
-            :elevation,
-            :zipcode,
-            :location,
-            :province,
-            :country,
-            :email,
-            :owner,
-            :org,
-            :tzone
-            )
-        ''',  row)
+    for location_id, site, longitude, latitude, distance in SiteTree.open(connection, options.dbase).nearest(
+        options.longitude, options.latitude, k=NEARBY_SITES, within=options.near):
+        print("WARNING: existing site '%s' (Id. %d) is %.0f meters away at Long. %s Lat. %s" % (site, location_id, distance, longitude, latitude))
+    cursor.execute(LOCATION_INSERT_SQL, row)
     connection.commit()
     # Read just written data
     cursor.execute(
@@ -269,6 +505,146 @@ def location_create(connection, options):
     paging(cursor,["Name","Longitude","Latitude","Elevation","Contact","Email","Organization","ZIP Code","Location","Province","Country","Timezone"], size=5)
 
 
+def location_import_checkpoint(path):
+    '''Places already geocoded by a previous, failed import of the same file'''
+    done = dict()
+    if os.path.exists(path):
+        with open(path) as fd:
+            for line in fd:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue # last line cut by the failure
+                done[(item['latitude'], item['longitude'])] = Place(**item['place'])
+    return done
+
+
+def location_import(connection, options):
+    '''
+    Bulk location creation from a CSV file with a site,longitude,latitude[,elevation,owner,email,org] header.
+    Rows are checked against the existing sites loaded once, the new ones are reverse
+    geocoded concurrently and all of them are inserted in a single transaction.
+    Geocoded places are appended to a <csv>.checkpoint file as they arrive,
+    so a failed import resumes where it stopped. It is removed after a successful import.
+    '''
+    cursor = connection.cursor()
+    cursor.execute("SELECT site, longitude, latitude FROM location_t")
+    sites = dict()
+    coords = dict()
+    for site, longitude, latitude in cursor:
+        sites[site] = (longitude, latitude)
+        if isinstance(longitude, (int, float)) and isinstance(latitude, (int, float)):
+            coords[(round(latitude, COORD_DECIMALS), round(longitude, COORD_DECIMALS))] = site
+
+    created, skipped, conflicts = list(), list(), list()
+    with open(options.csv_file, newline='') as fd:
+        for lineno, line in enumerate(csv.DictReader(fd), start=2):
+            site = (line.get('site') or '').strip()
+            try:
+                if not site:
+                    raise ValueError("missing site name")
+                item = {
+                    'site'      : site,
+                    'longitude' : float(line['longitude']),
+                    'latitude'  : float(line['latitude']),
+                    'elevation' : float(line.get('elevation') or 0.0),
+                    'owner'     : (line.get('owner') or UNKNOWN).strip(),
+                    'email'     : (line.get('email') or UNKNOWN).strip(),
+                    'org'       : (line.get('org') or UNKNOWN).strip(),
+                }
+            except (KeyError, ValueError, TypeError, AttributeError) as e:
+                conflicts.append((lineno, site, "Invalid row: %s" % (e,)))
+                continue
+            coord = (round(item['latitude'], COORD_DECIMALS), round(item['longitude'], COORD_DECIMALS))
+            if site in sites and sites[site] == (item['longitude'], item['latitude']):
+                skipped.append((lineno, site, "Already registered"))
+            elif site in sites:
+                conflicts.append((lineno, site, "Site already exists at %s" % (sites[site],)))
+            elif coord in coords:
+                conflicts.append((lineno, site, "Same coordinates as %s" % (coords[coord],)))
+            else:
+                created.append(item)
+                sites[site] = (item['longitude'], item['latitude'])
+                coords[coord] = site
+
+    checkpoint = options.csv_file + '.checkpoint'
+    places = location_import_checkpoint(checkpoint)
+    pending = [(item['latitude'], item['longitude']) for item in created if (item['latitude'], item['longitude']) not in places]
+    if places:
+        print("Resuming from %s: %d places already geocoded, %d to go." % (checkpoint, len(places), len(pending)))
+    geocoder = location_geocoder(options, min_delay=0)
+    try:
+        with open(checkpoint, 'a') as fd:
+            def done(point, place):
+                places[point] = place
+                fd.write(json.dumps({'latitude': point[0], 'longitude': point[1], 'place': place._asdict()}) + '\n')
+                fd.flush()
+            reverse_all(geocoder, pending, options.rate, options.concurrency, done)
+    finally:
+        geocoder.close()
+
+    for item in created:
+        place = places[(item['latitude'], item['longitude'])]
+        item['location'] = place.location
+        item['province'] = place.province
+        item['zipcode']  = place.zipcode
+        item['country']  = place.country
+        item['tzone']    = place.timezone
+    if created and not options.test:
+        cursor.executemany(LOCATION_INSERT_SQL, created)
+        connection.commit()
+    if not options.test or not places:
+        os.remove(checkpoint)
+    result = [(item['site'], item['longitude'], item['latitude'], item['location'], item['province'], item['country'], item['tzone']) for item in created]
+    if result:
+        print(tabulate.tabulate(result, headers=["Name","Longitude","Latitude","Location","Province","Country","Timezone"], tablefmt='grid'))
+    if skipped or conflicts:
+        print(tabulate.tabulate(sorted(skipped + conflicts), headers=["Line","Name","Reason"], tablefmt='grid'))
+    if options.test:
+        print("Test only. %d locations would be created, %d skipped, %d conflicting." % (len(created), len(skipped), len(conflicts)))
+    else:
+        print("%d locations created, %d skipped, %d conflicting." % (len(created), len(skipped), len(conflicts)))
+
+
+def location_fix_timezones(connection, options):
+    '''
+    Assigns the timezone of their coordinates to sites still carrying a default
+    one (or all sites with --all). Timezones are resolved once per coordinate
+    and the changed ones written with a single executemany.
+    '''
+    row = {'utc': DEFAULT_TZONE, 'unknown': UNKNOWN, 'all': options.all}
+    cursor = connection.cursor()
+    cursor.execute(
+        '''
+        SELECT location_id, site, longitude, latitude, timezone
+        FROM location_t
+        WHERE location_id >= 0
+        AND   typeof(longitude) IN ('real', 'integer')
+        AND   typeof(latitude)  IN ('real', 'integer')
+        AND   (:all OR timezone IS NULL OR timezone IN (:utc, :unknown, ''))
+        ORDER BY site
+        ''', row)
+    changes, result, unresolved = list(), list(), 0
+    for location_id, site, longitude, latitude, timezone in cursor.fetchall():
+        tzone = tf(longitude, latitude)
+        if tzone is None:
+            unresolved += 1
+        elif tzone != timezone:
+            changes.append({'location_id': location_id, 'tzone': tzone})
+            result.append((site, longitude, latitude, timezone, tzone))
+    if changes and not options.test:
+        cursor.executemany("UPDATE location_t SET timezone = :tzone WHERE location_id == :location_id", changes)
+        connection.commit()
+    if result:
+        print(tabulate.tabulate(result, headers=["Name","Longitude","Latitude","Old Timezone","New Timezone"], tablefmt='grid'))
+    if unresolved:
+        print("%d sites without a timezone at their coordinates left unchanged." % (unresolved,))
+    if options.test:
+        print("Test only. %d timezones would be changed." % (len(changes),))
+    else:
+        print("%d timezones changed." % (len(changes),))
+
+
 # Location update is a nightmare if done properly, since we have to generate
 # SQL updates tailored to the attributes being given in the command line
 
@@ -288,82 +664,27 @@ def location_update(connection, options):
     if not result:
         raise IndexError("Cannot update. Site with name %s does not exists." % (options.site,) )
     
-    if options.longitude is not None:
-        row['longitude'] = options.longitude
-        cursor.execute(
-        '''
-        UPDATE location_t SET longitude = :longitude WHERE site == :site
-        ''', row)
-
-    if options.latitude is not None:
-        row['latitude']  = options.latitude
-        cursor.execute(
-        '''
-        UPDATE location_t SET latitude = :latitude WHERE site == :site
-        ''', row)
-        
-    if options.elevation is not None:
-        row['elevation'] = options.elevation
-        cursor.execute(
-        '''
-        UPDATE location_t SET elevation = :elevation WHERE site == :site
-        ''', row)
-
-    if options.zipcode is not None:
-        row['zipcode']   = options.zipcode
-        cursor.execute(
-        '''
-        UPDATE location_t SET zipcode = :zipcode WHERE site == :site
-        ''', row)
-
-    if options.location is not None:
-        row['location']  = options.location
-        cursor.execute(
-        '''
-        UPDATE location_t SET location = :location WHERE site == :site
-        ''', row)
-
-    if options.province is not None:
-        row['province']  = options.province
-        cursor.execute(
-        '''
-        UPDATE location_t SET province = :province WHERE site == :site
-        ''', row)
-
-    if options.country is not None:
-        row['country']  = options.country
-        cursor.execute(
-        '''
-        UPDATE location_t SET country = :country WHERE site == :site
-        ''', row)
-
-    if options.email is not None:
-        row['email']   = options.email
-        cursor.execute(
-        '''
-        UPDATE location_t SET contact_email = :email WHERE site == :site
-        ''', row)
-
-    if options.owner is not None:
-        row['owner']   = options.owner
-        cursor.execute(
-        '''
-        UPDATE location_t SET contact_name = :owner WHERE site == :site
-        ''', row)
-
-    if options.org is not None:
-        row['org']   = options.org
-        cursor.execute(
-        '''
-        UPDATE location_t SET organization = :org WHERE site == :site
-        ''', row)
-
-    if options.tzone is not None:
-        row['tzone']   = options.tzone
-        cursor.execute(
-        '''
-        UPDATE location_t SET timezone = :tzone WHERE site == :site
-        ''', row)
+    # Change only if passed in the command line, all in a single SET clause
+    columns = {
+        'longitude'    : options.longitude,
+        'latitude'     : options.latitude,
+        'elevation'    : options.elevation,
+        'zipcode'      : options.zipcode,
+        'location'     : options.location,
+        'province'     : options.province,
+        'country'      : options.country,
+        'contact_email': options.email,
+        'contact_name' : options.owner,
+        'organization' : options.org,
+        'timezone'     : options.tzone,
+    }
+    assignments = list()
+    for column, value in columns.items():
+        if value is not None:
+            row[column] = value
+            assignments.append("%s = :%s" % (column, column))
+    if assignments:
+        cursor.execute("UPDATE location_t SET %s WHERE site == :site" % (', '.join(assignments),), row)
 
     connection.commit()
     # Read just written data
@@ -23,6 +23,8 @@ import datetime
 # other imports
 # -------------
 
+import tabulate
+
 #--------------
 # local imports
 # -------------
@@ -32,6 +34,49 @@ from . import OUT_OF_SERVICE, MANUAL, DEFAULT_AZIMUTH, DEFAULT_ALTITUDE
 from . import TSTAMP_FORMAT, DEFAULT_START_DATE, DEFAULT_END_DATE
 
 from .utils      import paging
+from .utils.progress import Progress, DATE_RANGE
+from .utils.dryrun   import DryRun
+from .utils.remap    import Remapper
+from .utils.archive  import federated_query, merge_latest, merge_counts
+from .utils.magnitude import ZeroPoints, Recomputer
+
+# ----------------
+# Module constants
+# ----------------
+
+# Queries shared between the single subcommands and 'tess report'
+# Timestamps are composed by joining date_t and time_t: both are small
+# INTEGER PRIMARY KEY tables that stay cached, and bench/readings_timestamp.py
+# shows the joins outrunning join-free composition from date_id/time_id.
+# Queries with a {readings} placeholder can be federated with the
+# archive databases (see utils.archive)
+
+READINGS_UNASSIGNED_SQL = '''
+    SELECT m.name, i.mac_address, l.site, min(d.sql_date), max(d.sql_date), count(*)
+    FROM name_to_mac_t AS m, tess_readings_t AS r
+    JOIN tess_t     AS i USING (tess_id)
+    JOIN date_t     AS d USING (date_id)
+    JOIN location_t AS l USING (location_id)
+    WHERE m.mac_address = i.mac_address 
+    AND r.location_id < 0
+    GROUP BY m.name
+    ORDER BY CAST(substr(m.name, 6) as decimal) ASC;
+    '''
+READINGS_UNASSIGNED_HEADERS = ["TESS","MAC","Location","Earliest Date","Latest Date","Records"]
+
+READINGS_LATEST_SQL = '''
+    SELECT (d.sql_date || 'T' || t.time) AS timestamp, m.name, i.mac_address, l.site, r.frequency, r.magnitude, r.signal_strength
+    FROM name_to_mac_t AS m, {readings} AS r
+    JOIN date_t     as d USING (date_id)
+    JOIN time_t     as t USING (time_id)
+    JOIN location_t as l USING (location_id)
+    JOIN tess_t     as i USING (tess_id)
+    WHERE i.mac_address == m.mac_address
+    ORDER BY r.date_id DESC, r.time_id DESC
+    LIMIT :count
+    '''
+READINGS_LATEST_HEADERS = ["Timestamp (UTC)","TESS","MAC","Location","Frequency","Magnitude","RSS"]
+READINGS_COUNT_HEADERS = ["TESS", "MAC", "TESS Id.", "Location", "Start Date", "End Date", "Records"]
 
 # --------------------
 # READINGS SUBCOMMANDS
@@ -42,30 +87,32 @@ def readings_unassigned(connection, options):
     cursor = connection.cursor()
     row = {}
     row['count'] = options.count
-    cursor.execute(
-        '''
-        SELECT m.name, i.mac_address, l.site, min(d.sql_date), max(d.sql_date), count(*)
-        FROM name_to_mac_t AS m, tess_readings_t AS r
-        JOIN tess_t     AS i USING (tess_id)
-        JOIN date_t     AS d USING (date_id)
-        JOIN location_t AS l USING (location_id)
-        WHERE m.mac_address = i.mac_address 
-        AND r.location_id < 0
-        GROUP BY m.name
-        ORDER BY CAST(substr(m.name, 6) as decimal) ASC;
-        ''' , row)
-    paging(cursor, ["TESS","MAC","Location","Earliest Date","Latest Date","Records"], size=options.count)
+    cursor.execute(READINGS_UNASSIGNED_SQL, row)
+    paging(cursor, READINGS_UNASSIGNED_HEADERS, size=options.count)
+
+
+def readings_query(connection, options, sql, row, headers, size, merge):
+    '''
+    Runs a readings query template on the live database or,
+    with --archive, federated with the archive databases
+    '''
+    if options.archive is None:
+        cursor = connection.cursor()
+        cursor.execute(sql.format(readings='tess_readings_t'), row)
+        paging(cursor, headers, size=size)
+    else:
+        results = federated_query(options.dbase, options.archive, sql, row, row.get('start_date'), row.get('end_date'))
+        print(tabulate.tabulate(merge(results), headers=headers, tablefmt='grid'))
 
 
 def readings_list_name_single(connection, options):
-    cursor = connection.cursor()
     row = {}
     row['name']  = options.name
     row['count'] = options.count
-    cursor.execute(
+    readings_query(connection, options,
         '''
         SELECT (d.sql_date || 'T' || t.time) AS timestamp, :name, i.mac_address, l.site, r.frequency, r.magnitude, r.signal_strength
-        FROM tess_readings_t as r
+        FROM {readings} as r
         JOIN date_t     as d USING (date_id)
         JOIN time_t     as t USING (time_id)
         JOIN location_t as l USING (location_id)
@@ -73,18 +120,16 @@ def readings_list_name_single(connection, options):
         WHERE i.mac_address IN (SELECT mac_address FROM name_to_mac_t WHERE name == :name)
         ORDER BY r.date_id DESC, r.time_id DESC
         LIMIT :count
-        ''' , row)
-    paging(cursor, ["Timestamp (UTC)","TESS","MAC","Location","Frequency","Magnitude","RSS"], size=options.count)
+        ''', row, READINGS_LATEST_HEADERS, options.count, lambda results: merge_latest(results, options.count))
 
 def readings_list_mac_single(connection, options):
-    cursor = connection.cursor()
     row = {}
     row['mac']  = options.mac
     row['count'] = options.count
-    cursor.execute(
+    readings_query(connection, options,
         '''
         SELECT (d.sql_date || 'T' || t.time) AS timestamp, (SELECT name FROM name_to_mac_t WHERE mac_address == :mac AND valid_state = "Current"), i.mac_address, l.site, r.frequency, r.magnitude, r.signal_strength
-        FROM tess_readings_t AS r
+        FROM {readings} AS r
         JOIN date_t     as d USING (date_id)
         JOIN time_t     as t USING (time_id)
         JOIN location_t as l USING (location_id)
@@ -92,26 +137,13 @@ def readings_list_mac_single(connection, options):
         WHERE i.mac_address == :mac
         ORDER BY r.date_id DESC, r.time_id DESC
         LIMIT :count
-        ''' , row)
-    paging(cursor, ["Timestamp (UTC)","TESS","MAC","Location","Frequency","Magnitude","RSS"], size=options.count)
+        ''', row, READINGS_LATEST_HEADERS, options.count, lambda results: merge_latest(results, options.count))
    
 def readings_list_all(connection, options):
-    cursor = connection.cursor()
     row = {}
     row['count'] = options.count
-    cursor.execute(
-        '''
-        SELECT (d.sql_date || 'T' || t.time) AS timestamp, m.name, i.mac_address, l.site, r.frequency, r.magnitude, r.signal_strength
-        FROM name_to_mac_t AS m, tess_readings_t AS r
-        JOIN date_t     as d USING (date_id)
-        JOIN time_t     as t USING (time_id)
-        JOIN location_t as l USING (location_id)
-        JOIN tess_t     as i USING (tess_id)
-        WHERE i.mac_address == m.mac_address
-        ORDER BY r.date_id DESC, r.time_id DESC
-        LIMIT :count
-        ''', row)
-    paging(cursor, ["Timestamp (UTC)","TESS","MAC","Location","Frequency","Magnitude","RSS"], size=options.count)
+    readings_query(connection, options, READINGS_LATEST_SQL, row, READINGS_LATEST_HEADERS, options.count,
+        lambda results: merge_latest(results, options.count))
 
 
 def readings_list(connection, options):
@@ -124,6 +156,41 @@ def readings_list(connection, options):
 
 
 
+def readings_selection(connection, options, row):
+    '''
+    Sets the :name or :mac instrument selection in row. Returns the SQL condition
+    selecting its readings and a {tess_id: (name, mac)} dictionary for reporting
+    '''
+    cursor = connection.cursor()
+    row['state'] = CURRENT
+    if options.mac is not None:
+        row['mac'] = options.mac
+        cursor.execute(
+            '''
+            SELECT tess_id, (SELECT name FROM name_to_mac_t WHERE mac_address == :mac AND valid_state == :state), mac_address
+            FROM tess_t 
+            WHERE mac_address == :mac
+            ''', row)
+        condition = "tess_id IN (SELECT tess_id FROM tess_t WHERE mac_address == :mac)"
+    else:
+        row['name'] = options.name
+        cursor.execute(
+            '''
+            SELECT tess_id, :name, mac_address
+            FROM tess_t 
+            JOIN name_to_mac_t AS m USING (mac_address) 
+            WHERE m.name == :name
+            ''', row)
+        condition = "tess_id IN (SELECT tess_id FROM tess_t JOIN name_to_mac_t AS m USING (mac_address) WHERE m.name == :name)"
+    return condition, { tess_id: (name, mac) for tess_id, name, mac in cursor }
+
+
+def readings_changes(rows, headers, test):
+    print(tabulate.tabulate(rows, headers=headers, tablefmt='grid'))
+    if test:
+        print("Test only. Changes rolled back.")
+
+
 def readings_adjloc(connection, options):
     row = {}
     row['new_site']   = options.new_site
@@ -149,52 +216,16 @@ def readings_adjloc(connection, options):
             % (options.new_site,) )
     row['new_site_id'] = result[0]
 
-    if options.mac is not None:
-        row['mac']        = options.mac
-        # Find out how many rows to change fro infromative purposes
-        cursor.execute(
-            '''
-            SELECT (SELECT name FROM name_to_mac_t WHERE mac_address == :mac AND valid_state = "Current"), :mac, tess_id, :old_site_id, :new_site_id, MIN(date_id), MAX(date_id), COUNT(*) 
-            FROM tess_readings_t
-            WHERE location_id == :old_site_id
-            AND   (date_id*1000000 + time_id) BETWEEN :start_date AND :end_date
-            AND   tess_id IN (SELECT tess_id FROM tess_t WHERE mac_address == :mac)
-            GROUP BY tess_id
-            ''', row)
-        paging(cursor,["TESS","MAC", "TESS Id.", "From Loc. Id", "To Loc. Id", "Start Date", "End Date", "Records to change"], size=5)
-        if not options.test:
-            # And perform the change
-            cursor.execute(
-                '''
-                UPDATE tess_readings_t SET location_id = :new_site_id 
-                WHERE location_id == :old_site_id
-                AND   (date_id*1000000 + time_id) BETWEEN :start_date AND :end_date
-                AND   tess_id IN (SELECT tess_id FROM tess_t WHERE mac_address == :mac)
-                ''', row)
-    else:
-        row['name']       = options.name
-        cursor.execute(
-            '''
-            SELECT :name, i.mac_address , tess_id, :old_site_id, :new_site_id, MIN(date_id), MAX(date_id), COUNT(*) 
-            FROM tess_readings_t AS r
-            JOIN tess_t AS i USING (tess_id) 
-            WHERE r.location_id == :old_site_id
-            AND  (date_id*1000000 + time_id) BETWEEN :start_date AND :end_date
-            AND tess_id IN (SELECT tess_id FROM tess_t JOIN name_to_mac_t AS m USING (mac_address) WHERE m.name == :name)
-            GROUP BY r.tess_id, r.location_id
-            ''', row)
-        paging(cursor,["TESS","MAC", "TESS Id.", "From Loc. Id", "To Loc. Id", "Start Date", "End Date", "Records to change"], size=5)
-        if not options.test:
-            # And perform the change
-            cursor.execute(
-                '''
-                UPDATE tess_readings_t SET location_id = :new_site_id 
-                WHERE location_id == :old_site_id
-                AND   (date_id*1000000 + time_id) BETWEEN :start_date AND :end_date
-                AND   tess_id IN (SELECT tess_id FROM tess_t JOIN name_to_mac_t AS m USING (mac_address) WHERE m.name == :name)
-                ''', row)
-
-    connection.commit()
+    condition, instruments = readings_selection(connection, options, row)
+    remapper = Remapper(connection, 'location_id')
+    remapper.add(row['old_site_id'], row['new_site_id'], row['start_date'], row['end_date'])
+    # The real change is performed and rolled back in test mode
+    with DryRun(connection, options.test) as dry, Progress(connection, 'adjloc', options.max_time) as progress:
+        remapper.apply(progress, condition, row, collect=dry.collect, key='tess_id')
+    result = [instruments[tess_id] + (tess_id, row['old_site_id'], row['new_site_id'], start, end, count) 
+        for (tess_id,), start, end, count in dry.summary()]
+    readings_changes(result, ["TESS","MAC", "TESS Id.", "From Loc. Id", "To Loc. Id", "Start Date", "End Date", "Records changed"], options.test)
+
 
 def readings_adjins(connection, options):
     row = {}
@@ -215,28 +246,17 @@ def readings_adjins(connection, options):
         raise IndexError("Cannot adjust instrument readings. New instrument '%s' does not exist." 
             % (options.new,) )
     row['new_tess_id'] = result[0]
+    cursor.execute("SELECT tess_id FROM tess_t WHERE mac_address == :old_mac ORDER BY tess_id", row)
+    remapper = Remapper(connection, 'tess_id')
+    for old_tess_id, in cursor.fetchall():
+        remapper.add(old_tess_id, row['new_tess_id'], row['start_date'], row['end_date'])
 
-
-    # Find out how many rows to change fro infromative purposes
-    cursor.execute(
-        '''
-        SELECT :old_mac, tess_id, :new_mac, :new_tess_id, MIN(date_id), MAX(date_id), COUNT(*) 
-        FROM tess_readings_t
-        WHERE tess_id IN (SELECT tess_id FROM tess_t WHERE mac_address == :old_mac)
-        AND   (date_id*1000000 + time_id) BETWEEN :start_date AND :end_date
-        GROUP BY tess_id
-        ''', row)
-    paging(cursor,["From MAC", "From TESS Id.", "To MAC", "To TESS Id.", "Start Date", "End Date", "Records to change"], size=5)
-
-    if not options.test:
-        # And perform the change
-        cursor.execute(
-            '''
-            UPDATE tess_readings_t SET tess_id = :new_tess_id 
-            WHERE  tess_id IN (SELECT tess_id FROM tess_t WHERE mac_address == :old_mac)
-            AND (date_id*1000000 + time_id) BETWEEN :start_date AND :end_date
-            ''', row)
-        connection.commit()
+    # The real change is performed and rolled back in test mode.
+    with DryRun(connection, options.test):
+        remapper.apply()
+    result = [(options.old, ', '.join(str(i) for i in old_tess_ids), options.new, new_tess_id, start, end, count) 
+        for old_tess_ids, new_tess_id, start, end, count in remapper.summary()]
+    readings_changes(result, ["From MAC", "From TESS Ids.", "To MAC", "To TESS Id.", "Start Date", "End Date", "Records changed"], options.test)
 
 
 def readings_purge(connection, options):
@@ -251,87 +271,76 @@ def readings_purge(connection, options):
     result = cursor.fetchone()
     if not result:
         raise IndexError("Cannot adjust location readings. Site '%s' does not exist." 
-            % (options.site,) )
+            % (options.location,) )
     row['site_id'] = result[0]
   
-    if options.mac is not None:
-        row['mac']        = options.mac
-        # Find out how many rows to change fro infromative purposes
-        cursor.execute(
-            '''
-            SELECT (SELECT name FROM name_to_mac_t WHERE mac_address == :mac AND valid_state = "Current"), :mac, tess_id, :site, MIN(date_id), MAX(date_id), COUNT(*)
-            FROM tess_readings_t
-            WHERE location_id == :site_id
+    condition, instruments = readings_selection(connection, options, row)
+    # The real deletion is performed and rolled back in test mode
+    with DryRun(connection, options.test) as dry, Progress(connection, 'purge', options.max_time) as progress:
+        where = '''
+            location_id == :site_id
+            AND   %s
             AND   (date_id*1000000 + time_id) BETWEEN :start_date AND :end_date
-            AND   tess_id IN (SELECT tess_id FROM tess_t WHERE mac_address == :mac)
-            GROUP BY tess_id
-            ''', row)
-        paging(cursor,["TESS","MAC", "TESS Id.", "Location", "Start Date", "End Date", "Records to delete"], size=5)
-
-        if not options.test:
-            # And perform the change
-            cursor.execute(
-                '''
-                DELETE FROM tess_readings_t
-                WHERE location_id == :site_id
-                AND   (date_id*1000000 + time_id) BETWEEN :start_date AND :end_date
-                AND   tess_id IN (SELECT tess_id FROM tess_t WHERE mac_address == :mac)
-                ''', row)
-    else:
-        row['name']       = options.name
-        cursor.execute(
+            AND   %s
+            ''' % (DATE_RANGE, condition)
+        progress.execute(
             '''
-            SELECT :name, i.mac_address , tess_id, :site, MIN(date_id), MAX(date_id), COUNT(*) 
-            FROM tess_readings_t AS r
-            JOIN tess_t AS i USING (tess_id) 
-            WHERE r.location_id == :site_id
-            AND  (date_id*1000000 + time_id) BETWEEN :start_date AND :end_date
-            AND tess_id IN (SELECT tess_id FROM tess_t JOIN name_to_mac_t AS m USING (mac_address) WHERE m.name == :name)
-            GROUP BY r.tess_id
-            ''', row)
-        paging(cursor,["TESS","MAC", "TESS Id.", "Location", "Start Date", "End Date", "Records to delete"], size=5)
-        if not options.test:
-            # And perform the change
-            cursor.execute(
-                '''
-                DELETE FROM tess_readings_t
-                WHERE location_id == :site_id
-                AND   (date_id*1000000 + time_id) BETWEEN :start_date AND :end_date
-                AND   tess_id IN (SELECT tess_id FROM tess_t JOIN name_to_mac_t AS m USING (mac_address) WHERE m.name == :name)
-                ''', row)
-    connection.commit()
+            DELETE FROM tess_readings_t
+            WHERE %s
+            AND   rowid BETWEEN :lo AND :hi
+            RETURNING tess_id, date_id
+            ''' % (where,), row, where, collect=dry.collect)
+    result = [instruments[tess_id] + (tess_id, options.location, start, end, count) 
+        for (tess_id,), start, end, count in dry.summary()]
+    readings_changes(result, ["TESS","MAC", "TESS Id.", "Location", "Start Date", "End Date", "Records deleted"], options.test)
+
+
+def readings_recompute(connection, options):
+    row = {}
+    row['start_date'] = int(options.start_date.strftime("%Y%m%d%H%M%S"))
+    row['end_date']   = int(options.end_date.strftime("%Y%m%d%H%M%S"))
+    condition, instruments = readings_selection(connection, options, row)
+    if not instruments:
+        raise IndexError("Cannot recompute magnitudes. Instrument '%s' does not exist." 
+            % (options.name or options.mac,) )
+    zero_points = ZeroPoints(connection, [mac for name, mac in instruments.values()])
+    recomputer = Recomputer(connection, zero_points, condition, row)
+    # The real change is performed and rolled back in test mode
+    with DryRun(connection, options.test), Progress(connection, 'recompute', options.max_time) as progress:
+        recomputer.run(progress)
+    if recomputer.skipped:
+        print("%d readings skipped without a valid zero point or a positive frequency." % (recomputer.skipped,))
+    result = [instruments[tess_id] + (tess_id, zp, first, last, count, dmin, dmax, dmean) 
+        for mac, tess_id, zp, first, last, count, dmin, dmax, dmean in recomputer.summary()]
+    readings_changes(result, ["TESS","MAC", "TESS Id.", "ZP", "Start Date", "End Date", "Records changed", "Min. Delta", "Max. Delta", "Mean Delta"], options.test)
 
 
 def readings_count(connection, options):
     row = {}
     row['start_date'] = int(options.start_date.strftime("%Y%m%d%H%M%S"))
     row['end_date']   = int(options.end_date.strftime("%Y%m%d%H%M%S"))
-    cursor = connection.cursor()
 
     if options.mac is not None:
         row['mac']        = options.mac
-        # Find out how many rows to change fro infromative purposes
-        cursor.execute(
+        readings_query(connection, options,
             '''
             SELECT (SELECT name FROM name_to_mac_t WHERE mac_address == :mac AND valid_state = "Current"), :mac, tess_id, l.site, MIN(date_id), MAX(date_id), COUNT(*)
-            FROM tess_readings_t
+            FROM {readings}
             JOIN location_t AS l USING (location_id)
             JOIN tess_t AS i USING (tess_id)
             WHERE (date_id*1000000 + time_id) BETWEEN :start_date AND :end_date
             AND i.mac_address == :mac
             GROUP BY tess_id,  l.location_id
-            ''', row)
-        paging(cursor,["TESS", "MAC", "TESS Id.", "Location", "Start Date", "End Date", "Records"], size=5)
+            ''', row, READINGS_COUNT_HEADERS, 5, merge_counts)
     else:
         row['name']        = options.name
-        cursor.execute(
+        readings_query(connection, options,
             '''
             SELECT :name, i.mac_address, tess_id, l.site,  MIN(date_id), MAX(date_id), COUNT(*)
-            FROM tess_readings_t
+            FROM {readings}
             JOIN location_t AS l USING (location_id)
             JOIN tess_t     AS i USING (tess_id)
             WHERE (date_id*1000000 + time_id) BETWEEN :start_date AND :end_date
             AND i.mac_address IN (SELECT mac_address FROM name_to_mac_t WHERE name == :name)
             GROUP BY tess_id, l.location_id
-            ''', row)
-        paging(cursor,["TESS", "MAC", "TESS Id.", "Location", "Start Date", "End Date", "Records"], size=5)
+            ''', row, READINGS_COUNT_HEADERS, 5, merge_counts)
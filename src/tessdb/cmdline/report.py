@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+# TESS UTILITY TO PERFORM SOME MAINTENANCE COMMANDS
+
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+import time
+import sqlite3
+import concurrent.futures
+
+#--------------
+# other imports
+# -------------
+
+import tabulate
+
+#--------------
+# local imports
+# -------------
+
+from . import UNKNOWN, EXPIRED, CURRENT, OUT_OF_SERVICE
+
+from .instrument import INSTRUMENT_UNASSIGNED_SQL, INSTRUMENT_UNASSIGNED_HEADERS
+from .instrument import INSTRUMENT_ANONYMOUS_SQL, INSTRUMENT_ANONYMOUS_HEADERS
+from .instrument import instrument_renamings_query, INSTRUMENT_RENAMINGS_HEADERS
+from .location   import LOCATION_UNASSIGNED_SQL, LOCATION_UNASSIGNED_HEADERS
+from .location   import location_duplicates_query, LOCATION_DUPLICATES_HEADERS
+from .readings   import READINGS_UNASSIGNED_SQL, READINGS_UNASSIGNED_HEADERS
+from .readings   import READINGS_LATEST_SQL, READINGS_LATEST_HEADERS
+
+# ----------------
+# Module constants
+# ----------------
+
+# Report catalogue. Dictionary order is the fixed printing order.
+# Each entry is (title, SQL or query function(connection, row), column headers)
+REPORTS = {
+    'instrument_unassigned' : ("Unassigned instruments", INSTRUMENT_UNASSIGNED_SQL, INSTRUMENT_UNASSIGNED_HEADERS),
+    'instrument_anonymous'  : ("Anonymous instrument names", INSTRUMENT_ANONYMOUS_SQL, INSTRUMENT_ANONYMOUS_HEADERS),
+    'instrument_renamings'  : ("Instrument renamings", instrument_renamings_query, INSTRUMENT_RENAMINGS_HEADERS),
+    'location_unassigned'   : ("Unassigned locations", LOCATION_UNASSIGNED_SQL, LOCATION_UNASSIGNED_HEADERS),
+    'location_duplicates'   : ("Duplicated locations", location_duplicates_query, LOCATION_DUPLICATES_HEADERS),
+    'readings_unassigned'   : ("Unassigned readings", READINGS_UNASSIGNED_SQL, READINGS_UNASSIGNED_HEADERS),
+    'readings_latest'       : ("Latest readings", READINGS_LATEST_SQL.format(readings='tess_readings_t'), READINGS_LATEST_HEADERS),
+}
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+def open_readonly(path):
+    '''Opens a private, read-only connection so that queries never block the writer'''
+    return sqlite3.connect("file:{0}?mode=ro".format(path), uri=True)
+
+
+def run_query(path, sql, row, limit):
+    '''Runs a single report query on its own connection. Returns (rows, elapsed time)'''
+    t0 = time.perf_counter()
+    connection = open_readonly(path)
+    try:
+        if callable(sql):
+            result = sql(connection, row)[:limit]
+        else:
+            cursor = connection.cursor()
+            cursor.execute(sql, row)
+            result = cursor.fetchmany(limit)
+    finally:
+        connection.close()
+    return result, time.perf_counter() - t0
+
+# ------------------
+# REPORT SUBCOMMANDS
+# ------------------
+
+def report_run(connection, options):
+    names = list(REPORTS.keys()) if options.reports is None else [n for n in REPORTS if n in options.reports]
+    if options.list:
+        for name in REPORTS:
+            print("{0:<24} {1}".format(name, REPORTS[name][0]))
+        return
+    # A single parameter set is shared by all queries. sqlite3 ignores unused named parameters
+    row = {}
+    row['state']    = CURRENT
+    row['expired']  = EXPIRED
+    row['site1']    = UNKNOWN
+    row['site2']    = OUT_OF_SERVICE
+    row['unknown']  = UNKNOWN
+    row['distance'] = options.distance
+    row['count']    = options.count
+    workers = options.workers or len(names)
+    t0 = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers,1)) as executor:
+        futures = { name: executor.submit(run_query, options.dbase, REPORTS[name][1], row, options.count) for name in names }
+        concurrent.futures.wait(futures.values())
+    wall = time.perf_counter() - t0
+    timings = []
+    for name in names:
+        title, _, headers = REPORTS[name]
+        try:
+            result, elapsed = futures[name].result()
+        except Exception as e:
+            # A failing report must not take the others down with it
+            print("{0} => Error: {1}".format(title, e))
+            timings.append((name, None, "Error"))
+            continue
+        print("{0} ({1:0.3f} s)".format(title, elapsed))
+        print(tabulate.tabulate(result, headers=headers, tablefmt='grid'))
+        timings.append((name, len(result), "{0:0.3f}".format(elapsed)))
+    print(tabulate.tabulate(timings, headers=["Report","Rows","Time (s)"], tablefmt='grid'))
+    print("Wall time {0:0.3f} s with {1} workers".format(wall, workers))
@@ -30,15 +30,26 @@ from . import OUT_OF_SERVICE, MANUAL, DEFAULT_AZIMUTH, DEFAULT_ALTITUDE
 from . import TSTAMP_FORMAT, DEFAULT_START_DATE, DEFAULT_END_DATE
 
 from .utils      import open_database
+from .utils import invalidation
+from .utils import search
+from .utils.geocoding import DEFAULT_CACHE, DEFAULT_PRECISION, DEFAULT_TTL
 
 from .instrument import *
 from .location   import *
 from .readings   import *
+from .report     import *
 
 # ----------------
 # Module constants
 # ----------------
 
+# Subcommands that may change tess_t, name_to_mac_t or location_t. Only their
+# changes are tracked, to invalidate tessdb caches and update the site search index.
+TRACKED = {
+    'instrument': ('create', 'import', 'update', 'enable', 'disable', 'delete', 'rename', 'assign', 'check', 'coalesce'),
+    'location':   ('create', 'import', 'update', 'delete', 'merge', 'rename', 'fix-timezones'),
+}
+
 # -----------------------
 # Module global variables
 # -----------------------
@@ -66,12 +77,36 @@ def filepath(path):
         raise  OSError(f"{path} file does not exists")
     return path
 
+def dirpath(path):
+    exists = os.path.isdir(path)
+    if not exists:
+        raise  OSError(f"{path} directory does not exists")
+    return path
+
+def invalidate_caches(connection, options):
+    '''
+    Sends the MACs, names and location ids changed by this run to tessdb
+    as a single message, so that it only evicts those cache entries.
+    '''
+    try:
+        payload = invalidation.changes(connection)
+        if invalidation.empty(payload):
+            return
+        keys = ", ".join("%d %s" % (len(payload[kind]), kind) for kind in invalidation.KINDS if payload[kind])
+        if invalidation.publish(connection, payload, options.notify):
+            print("tessdb caches invalidated for %s" % (keys,))
+        else:
+            print("WARNING: tessdb not listening at %s. Issue 'service tessdb reload' to invalidate its caches for %s" % (options.notify, keys))
+    except sqlite3.Error as e:
+        print("WARNING: Do not forget to issue 'service tessdb reload' afterwards to invalidate tessdb caches ({0})".format(e))
+
 def createParser():
     # create the top-level parser
     name = os.path.split(os.path.dirname(sys.argv[0]))[-1]
     parser    = argparse.ArgumentParser(prog=name, description="tessdb command line tool")
     parser.add_argument('--version', action='version', version='{0} {1}'.format(name, __version__))
     parser.add_argument('-x', '--exceptions', action='store_true',  help='print exception traceback when exiting.')
+    parser.add_argument('--notify', type=str, default=invalidation.DEFAULT_SOCKET, metavar='<socket>', help='tessdb cache invalidation socket (default: %(default)s)')
     subparser = parser.add_subparsers(dest='command')
 
     # --------------------------
@@ -80,6 +115,21 @@ def createParser():
     parser_instrument = subparser.add_parser('instrument', help='instrument commands')
     parser_location   = subparser.add_parser('location',   help='location commands')
     parser_readings   = subparser.add_parser('readings',   help='readings commands')
+    parser_report     = subparser.add_parser('report',     help='run several reports concurrently')
+
+    # ----------------------------
+    # Options for 'report' command
+    # ----------------------------
+    # Choices:
+    #   tess report [-r <report> ...]
+    #
+    parser_report.set_defaults(subcommand='run')
+    parser_report.add_argument('-r', '--reports', nargs='+', choices=list(REPORTS.keys()), default=None, help='reports to run (default: all)')
+    parser_report.add_argument('-l', '--list', action='store_true', help='list available reports and exit')
+    parser_report.add_argument('-w', '--workers', type=int, default=None, help='concurrent queries (default: one per report)')
+    parser_report.add_argument('-c', '--count', type=int, default=100, help='list up to <count> entries per report')
+    parser_report.add_argument('--distance', type=int, default=100, help='Maximun distance in meters for duplicated locations')
+    parser_report.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
 
     # ------------------------------------------
     # Create second level parsers for 'location'
@@ -98,6 +148,22 @@ def createParser():
     lcp.add_argument('-m', '--email',     type=str,   default='Unknown', help='Contact email')
     lcp.add_argument('-g', '--org',       type=utf8,  default='Unknown', help='Organization')
     lcp.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
+    lcp.add_argument('--near', type=float, default=100.0, metavar='<meters>', help='warn about existing sites within this distance (default: %(default)s)')
+    lcp.add_argument('--gazetteer', type=filepath, default=None, metavar='<file.csv|file.json>', help='offline places file instead of Nominatim')
+    lcp.add_argument('--geocache', type=str, default=DEFAULT_CACHE, metavar='<file.db>', help='reverse geocoding cache (default: %(default)s)')
+    lcp.add_argument('--precision', type=int, default=DEFAULT_PRECISION, help='cache key coordinates decimals (default: %(default)s)')
+    lcp.add_argument('--ttl', type=float, default=DEFAULT_TTL, metavar='<days>', help='cache entries time to live (default: %(default)s)')
+
+    lim = subparser.add_parser('import', help='create locations in bulk from a CSV file')
+    lim.add_argument('csv_file', metavar='<csv>', type=filepath, help='CSV file with site,longitude,latitude[,elevation,owner,email,org] header')
+    lim.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
+    lim.add_argument('-t', '--test', action='store_true',  help='test only, do not create')
+    lim.add_argument('--rate', type=float, default=1.0, metavar='<requests/s>', help='geocoding requests per second (default: %(default)s)')
+    lim.add_argument('--concurrency', type=int, default=4, help='geocoding requests in flight (default: %(default)s)')
+    lim.add_argument('--gazetteer', type=filepath, default=None, metavar='<file.csv|file.json>', help='offline places file instead of Nominatim')
+    lim.add_argument('--geocache', type=str, default=DEFAULT_CACHE, metavar='<file.db>', help='reverse geocoding cache (default: %(default)s)')
+    lim.add_argument('--precision', type=int, default=DEFAULT_PRECISION, help='cache key coordinates decimals (default: %(default)s)')
+    lim.add_argument('--ttl', type=float, default=DEFAULT_TTL, metavar='<days>', help='cache entries time to live (default: %(default)s)')
 
     llp = subparser.add_parser('list', help='list single location or all locations')
     llp.add_argument('-n', '--name',      type=utf8,  help='specific location name')
@@ -125,18 +191,67 @@ def createParser():
     lde.add_argument('name', type=utf8,  help='location name')
     lde.add_argument('-t', '--test', action='store_true',  help='test only, do not delete')
     lde.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
+    lde.add_argument('-a', '--archive', type=str, default=None, metavar='<file.db>', help='move readings and location into this archive database before deleting')
+    lde.add_argument('--max-time', type=float, default=None, metavar='<seconds>', help='abort and roll back if not finished in <seconds>')
+
+    lme = subparser.add_parser('merge', help='merge duplicate sites into a single one')
+    lme.add_argument('keep', type=utf8, help='site to keep')
+    lme.add_argument('drop', type=utf8, nargs='+', help='sites merged into the kept one and deleted')
+    lme.add_argument('-t', '--test', action='store_true',  help='test only, do not merge')
+    lme.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
+    lme.add_argument('--vacuum', action='store_true', help='compact the database afterwards')
+    lme.add_argument('--max-time', type=float, default=None, metavar='<seconds>', help='stop after <seconds>, keeping the readings already moved; run again to finish')
 
     lre = subparser.add_parser('rename', help='rename single location')
     lre.add_argument('old_site',  type=utf8, help='old site name')
     lre.add_argument('new_site',  type=utf8, help='new site name')
     lre.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
 
+    lfz = subparser.add_parser('fix-timezones', help='assign the timezone of their coordinates to sites with a default one')
+    lfz.add_argument('-a', '--all', action='store_true', help='check all sites, not only those with a default timezone')
+    lfz.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
+    lfz.add_argument('-t', '--test', action='store_true',  help='test only, do not change timezones')
+
+    lus = subparser.add_parser('usage', help='readings count, dates and instruments per location')
+    lus.add_argument('-n', '--name', type=utf8, help='specific location name')
+    lus.add_argument('-u', '--unused', action='store_true', help='only locations without readings')
+    lus.add_argument('-i', '--index', action='store_true', help='create the readings location index used by usage, delete and merge')
+    lus.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
+
+    lne = subparser.add_parser('nearest', help='existing sites nearest to given coordinates')
+    lne.add_argument('-o', '--longitude', '--lon', type=float, required=True, help='geographical longitude (degrees)')
+    lne.add_argument('-a', '--latitude', '--lat', type=float, required=True, help='geographical latitude (degrees)')
+    lne.add_argument('-k', '--count', type=int, default=1, help='number of sites (default: %(default)s)')
+    lne.add_argument('-w', '--within', type=float, default=None, metavar='<meters>', help='only sites within this distance')
+    lne.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
+
+    lse = subparser.add_parser('search', help='full text search of sites by name, town, province, country or organization')
+    lse.add_argument('terms', type=utf8, nargs='+', help='words to search, also partial or misspelled')
+    lse.add_argument('-l', '--limit', type=int, default=20, help='maximum number of results (default: %(default)s)')
+    lse.add_argument('--reindex', '--rebuild', action='store_true', help='create or rebuild the search index table in the database first')
+    lse.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
+
+    lsm = subparser.add_parser('skymap', help='grid of median nightly darkest sky magnitudes of the sites in each cell')
+    lsm.add_argument('-c', '--cell-size', type=float, default=1.0, metavar='<degrees>', help='grid cell size (default: %(default)s)')
+    lsm.add_argument('-s', '--start-date', type=mkdate, metavar='<YYYY-MM-DD|YYYY-MM-DDTHH:MM:SS>', default=DEFAULT_START_DATE, help='start date')
+    lsm.add_argument('-e', '--end-date',   type=mkdate, metavar='<YYYY-MM-DD|YYYY-MM-DDTHH:MM:SS>', default=DEFAULT_END_DATE, help='end date')
+    lsm.add_argument('-f', '--format', choices=['csv', 'geojson'], default='csv', help='output format (default: %(default)s)')
+    lsm.add_argument('--output', type=str, default=None, metavar='<file>', help='output file (default: standard output)')
+    lsm.add_argument('-a', '--archive', type=dirpath, default=None, help='also use the archive databases in this directory')
+    lsm.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
+
+    ldi = subparser.add_parser('diff', help='compare sites against an external place registry export')
+    ldi.add_argument('--against', type=filepath, required=True, metavar='<places.json|places.csv>', help='registry export, CSV, JSON array or JSON lines')
+    ldi.add_argument('--tolerance', type=float, default=100, metavar='<meters>', help='coordinates mismatch tolerance (default: %(default)s)')
+    ldi.add_argument('--json', action='store_true', help='JSON output')
+    ldi.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
+
     lkp = subparser.add_parser('unassigned', help='list all unassigned locations')
     lkp.add_argument('-p', '--page-size', type=int, default=10, help='list page size')
     lkp.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
 
-    ldup = subparser.add_parser('duplicates', help='list all duplicated locations')
-    ldup.add_argument('--distance', type=int, default=100, help='Maximun distance in meters')
+    ldup = subparser.add_parser('duplicates', help='list clusters of near duplicate locations')
+    ldup.add_argument('--distance', type=int, default=100, help='Maximun great circle distance in meters')
     ldup.add_argument('-p', '--page-size', type=int, default=10, help='list page size')
     ldup.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
 
@@ -161,6 +276,7 @@ def createParser():
     rliex.add_argument('-m', '--mac',  type=str, help='instrument MAC')
     rli.add_argument('-c', '--count', type=int, default=10, help='list up to <count> entries')
     rli.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
+    rli.add_argument('-a', '--archive', type=dirpath, default=None, help='also query the archive databases in this directory')
 
     rco = subparser.add_parser('count', help='count readings')
     rcoex = rco.add_mutually_exclusive_group(required=True)
@@ -169,6 +285,7 @@ def createParser():
     rco.add_argument('-s', '--start-date', type=mkdate, metavar='<YYYY-MM-DD|YYYY-MM-DDTHH:MM:SS>', default=DEFAULT_START_DATE, help='start date')
     rco.add_argument('-e', '--end-date',   type=mkdate, metavar='<YYYY-MM-DD|YYYY-MM-DDTHH:MM:SS>', default=DEFAULT_END_DATE, help='end date')
     rco.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
+    rco.add_argument('-a', '--archive', type=dirpath, default=None, help='also query the archive databases in this directory')
 
     ral = subparser.add_parser('adjloc', help='adjust readings location for a given TESS')
     ralex = ral.add_mutually_exclusive_group(required=True)
@@ -180,6 +297,7 @@ def createParser():
     ral.add_argument('-s', '--start-date', type=mkdate, metavar='<YYYY-MM-DD|YYYY-MM-DDTHH:MM:SS>', default=DEFAULT_START_DATE, help='start date')
     ral.add_argument('-e', '--end-date',   type=mkdate, metavar='<YYYY-MM-DD|YYYY-MM-DDTHH:MM:SS>', default=DEFAULT_END_DATE, help='end date')
     ral.add_argument('-t', '--test', action='store_true',  help='test only, do not change readings')
+    ral.add_argument('--max-time', type=float, default=None, metavar='<seconds>', help='abort and roll back if not finished in <seconds>')
 
     rpu = subparser.add_parser('purge', help='purge readings for a given TESS')
     rpuex = rpu.add_mutually_exclusive_group(required=True)
@@ -190,6 +308,17 @@ def createParser():
     rpu.add_argument('-s', '--start-date', type=mkdate, metavar='<YYYY-MM-DD|YYYY-MM-DDTHH:MM:SS>', default=DEFAULT_START_DATE, help='start date')
     rpu.add_argument('-e', '--end-date',   type=mkdate, metavar='<YYYY-MM-DD|YYYY-MM-DDTHH:MM:SS>', default=DEFAULT_END_DATE, help='end date')
     rpu.add_argument('-t', '--test', action='store_true',  help='test only, do not change readings')
+    rpu.add_argument('--max-time', type=float, default=None, metavar='<seconds>', help='abort and roll back if not finished in <seconds>')
+
+    rre = subparser.add_parser('recompute', help='recompute readings magnitudes from frequencies and the zero point valid at each reading')
+    rreex = rre.add_mutually_exclusive_group(required=True)
+    rreex.add_argument('-n', '--name', type=str, help='instrument name')
+    rreex.add_argument('-m', '--mac',  type=str, help='instrument MAC')
+    rre.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
+    rre.add_argument('-s', '--start-date', type=mkdate, metavar='<YYYY-MM-DD|YYYY-MM-DDTHH:MM:SS>', default=DEFAULT_START_DATE, help='start date')
+    rre.add_argument('-e', '--end-date',   type=mkdate, metavar='<YYYY-MM-DD|YYYY-MM-DDTHH:MM:SS>', default=DEFAULT_END_DATE, help='end date')
+    rre.add_argument('-t', '--test', action='store_true',  help='test only, do not change readings')
+    rre.add_argument('--max-time', type=float, default=None, metavar='<seconds>', help='abort and roll back if not finished in <seconds>')
 
     rai = subparser.add_parser('adjins', help='assign readings from <old> to <new> TESS instruments')
     rai.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
@@ -224,6 +353,11 @@ def createParser():
     icr.add_argument('-t', '--altitude',   type=float, default=DEFAULT_ALTITUDE, help='Altitude (degrees). 90.0 = Zenith')
     icr.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
 
+    iim = subparser.add_parser('import', help='create instruments in bulk from a CSV file')
+    iim.add_argument('csv_file', metavar='<csv>', type=filepath, help='CSV file with name,mac,zp,filter[,azimuth,altitude] header')
+    iim.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
+    iim.add_argument('-t', '--test', action='store_true',  help='test only, do not create')
+
     ip = subparser.add_parser('list', help='list single instrument or all instruments')
     ipex = ip.add_mutually_exclusive_group(required=False)
     ipex.add_argument('-n', '--name', type=str, help='instrument name')
@@ -239,10 +373,12 @@ def createParser():
     ihiex.add_argument('-m', '--mac',  type=str, help='instrument MAC')
     ihi.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
     
-    iup = subparser.add_parser('update',   help='update single instrument attributes')
+    iup = subparser.add_parser('update',   help='update instrument attributes')
     iupex1 = iup.add_mutually_exclusive_group(required=True)
     iupex1.add_argument('-n', '--name', type=str, help='instrument name')
     iupex1.add_argument('-m', '--mac',  type=str, help='instrument MAC')
+    iupex1.add_argument('--select', type=str, metavar='<selector>', help="instruments selector, i.e. 'name GLOB stars1*'")
+    iupex1.add_argument('--from-file', type=filepath, metavar='<file>', help='file with instrument names, one per line')
     iup.add_argument('-z', '--zero-point', type=float, help='new zero point')
     iup.add_argument('-f', '--filter',     type=str,  help='new filter glass')
     iup.add_argument('-a', '--azimuth',    type=float, help='Azimuth (degrees). 0.0 = North')
@@ -254,17 +390,21 @@ def createParser():
     iupex2.add_argument("-s", "--start-time", type=str, default=now, metavar="YYYYMMDDTHHMMSS", help='update start date')
     iupex2.add_argument('-l', '--latest', action='store_true', default=False, help='Latest entry only (no change control)')
 
-    iaz = subparser.add_parser('enable', help='enable storing single instrument samples')
+    iaz = subparser.add_parser('enable', help='enable storing instrument samples')
     iazex = iaz.add_mutually_exclusive_group(required=True)
     iazex.add_argument('-n', '--name', type=str, help='instrument name')
     iazex.add_argument('-m', '--mac',  type=str, help='instrument MAC')
+    iazex.add_argument('--select', type=str, metavar='<selector>', help="instruments selector, i.e. 'name GLOB stars1*'")
+    iazex.add_argument('--from-file', type=filepath, metavar='<file>', help='file with instrument names, one per line')
     iaz.add_argument('-p', '--page-size', type=int, default=10, help='list page size')
     iaz.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
     
-    iuz = subparser.add_parser('disable', help='disable storing single instrument samples')
+    iuz = subparser.add_parser('disable', help='disable storing instrument samples')
     iuzex = iuz.add_mutually_exclusive_group(required=True)
     iuzex.add_argument('-n', '--name', type=str, help='instrument name')
     iuzex.add_argument('-m', '--mac',  type=str, help='instrument MAC')
+    iuzex.add_argument('--select', type=str, metavar='<selector>', help="instruments selector, i.e. 'name GLOB stars1*'")
+    iuzex.add_argument('--from-file', type=filepath, metavar='<file>', help='file with instrument names, one per line')
     iuz.add_argument('-p', '--page-size', type=int, default=10, help='list page size')
     iuz.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
 
@@ -274,6 +414,15 @@ def createParser():
     ideex.add_argument('-m', '--mac',  type=str, help='instrument MAC')
     ide.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
     ide.add_argument('-t', '--test', action='store_true',  help='test only, do not delete')
+    ide.add_argument('-a', '--archive', type=str, default=None, metavar='<file.db>', help='move readings and instrument rows into this archive database before deleting')
+    ide.add_argument('--max-time', type=float, default=None, metavar='<seconds>', help='abort and roll back if not finished in <seconds>')
+
+    iat = subparser.add_parser('at', help='instrument name, calibration and location valid at a given time')
+    iatex = iat.add_mutually_exclusive_group(required=True)
+    iatex.add_argument('-n', '--name', type=str, help='instrument name')
+    iatex.add_argument('-m', '--mac',  type=str, help='instrument MAC')
+    iat.add_argument('-t', '--timestamp', type=mkdate, default=None, metavar='<YYYY-MM-DD|YYYY-MM-DDTHH:MM:SS>', help='point in time (UTC, default now)')
+    iat.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
 
     ire = subparser.add_parser('rename', help='rename instrument friendly name')
     ire.add_argument('old_name',  type=str, help='old friendly name')
@@ -292,16 +441,26 @@ def createParser():
     ik.add_argument('-p', '--page-size', type=int, default=10, help='list page size')
     ik.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
 
+    ich = subparser.add_parser('check', help='check tess_t and name_to_mac_t validity intervals')
+    ich.add_argument('-f', '--fix', action='store_true', help='repair inconsistencies in bulk')
+    ich.add_argument('--close-gaps', action='store_true', help='with --fix, also close the gaps between the names of a MAC')
+    ich.add_argument('-t', '--test', action='store_true', help='test only, roll back repairs')
+    ich.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
+
     ian = subparser.add_parser('anonymous', help='list anonymous instruments without a friendly name')
     ian.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
+    ian.add_argument('--since', type=mkdate, default=None, metavar='<YYYY-MM-DD|YYYY-MM-DDTHH:MM:SS>', help='only names freed since this date')
+    ian.add_argument('--json', action='store_true', help='JSON output')
 
     ings = subparser.add_parser('renamings', help='list all instrument renamings')
     ingsex = ings.add_mutually_exclusive_group(required=True)
     ingsex.add_argument('-s', '--summary', action='store_true', help='summary')
     ingsex.add_argument('-n', '--name', action='store_true', help='detail by instrument name')
     ingsex.add_argument('-m', '--mac',  action='store_true', help='detali by instrument MAC')
-    ings.add_argument('-c', '--count', type=int, default=10, help='list up to <count> entries')
+    ings.add_argument('-c', '--count', type=int, default=None, help='list up to <count> entries (default all)')
     ings.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
+    ings.add_argument('--since', type=mkdate, default=None, metavar='<YYYY-MM-DD|YYYY-MM-DDTHH:MM:SS>', help='only renamings since this date')
+    ings.add_argument('--json', action='store_true', help='JSON output')
 
     ico = subparser.add_parser('coalesce', help='coalesce redundant instrument ids')
     icoex = ico.add_mutually_exclusive_group(required=True)
@@ -310,6 +469,7 @@ def createParser():
     icoex.add_argument('-a', '--all', action='store_true', help='all instruments')
     ico.add_argument('-d', '--dbase', type=filepath, default=DEFAULT_DBASE, help='SQLite database full file path')
     ico.add_argument('-t', '--test', action='store_true',  help='test only, do not delete')
+    ico.add_argument('--max-time', type=float, default=None, metavar='<seconds>', help='abort and roll back if not finished in <seconds>')
 
     return parser
 
@@ -320,16 +480,19 @@ def main():
     '''
     options = argparse.Namespace()
     exit_code = 0
+    connection = None
+    tracked = False
     try:
-        invalid_cache = False
         options = createParser().parse_args(sys.argv[1:], namespace=options)
         connection = open_database(options)
+        tracked = options.subcommand in TRACKED.get(options.command, ())
+        if tracked:
+            invalidation.track(connection)
+            search.track(connection)
         command = options.command
         subcommand = options.subcommand
-        if subcommand in ["rename","enable","disable","update","delete"]:
-            invalid_cache = True
         # Call the function dynamically
-        func = command + '_' + subcommand
+        func = command + '_' + subcommand.replace('-', '_')
         globals()[func](connection, options)
     except KeyboardInterrupt:
         print('')
@@ -340,7 +503,7 @@ def main():
         print("Error => {0}".format( utf8(str(e)) ))
         exit_code = 1
     finally:
-        if invalid_cache:
-            print("WARNING: Do not forget to issue 'service tessdb reload' afterwards to invalidate tessdb caches")
+        if tracked:
+            invalidate_caches(connection, options)
     sys.exit(exit_code)
 
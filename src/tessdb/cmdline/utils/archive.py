@@ -0,0 +1,208 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import os
+import re
+import glob
+import heapq
+import sqlite3
+import itertools
+import concurrent.futures
+from operator import itemgetter
+from typing import List, Optional, Tuple
+
+# --------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+# Schema name given to the archive attached in each worker connection
+ARCHIVE = "archive"
+
+# Tables copied into an archive database before deleting their rows.
+# The calendar tables are copied whole, so that the readings foreign keys
+# to date_t and time_t also resolve within the archive.
+ARCHIVE_TABLES = ("date_t", "time_t", "location_t", "tess_t", "name_to_mac_t", "tess_readings_t")
+CALENDAR_TABLES = ("date_t", "time_t")
+
+# Dimension tables and keys. Archived instruments and sites are deleted from
+# the live database, so archive shards see the live rows plus the archived
+# ones whose key is no longer live.
+DIMENSIONS = (("location_t", "location_id"), ("tess_t", "tess_id"), ("name_to_mac_t", "mac_address"))
+
+DIMENSION_SQL = """
+    CREATE TEMP VIEW {table} AS
+    SELECT * FROM main.{table}
+    UNION ALL
+    SELECT * FROM {archive}.{table} WHERE {key} NOT IN (SELECT {key} FROM main.{table})
+    """
+
+CREATE_TABLE_RE = re.compile(r'^\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?["`\[]?(\w+)["`\]]?', re.IGNORECASE)
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+# Archive databases are yearly (or any other period) copies of tess.db whose
+# tess_readings_t holds old readings. Readings queries are written as templates
+# with a {readings} placeholder for the readings table. Each archive whose date
+# range overlaps the query is ATTACHed to its own read-only connection to the
+# live database, where TEMP views named as the dimension tables add the archived
+# instruments and sites to the live ones, and all of them are queried in
+# parallel. Partial results are merged in Python.
+
+
+def readonly(path: str) -> sqlite3.Connection:
+    return sqlite3.connect("file:{0}?mode=ro".format(path), uri=True)
+
+
+def archives(directory: str, dbase: str) -> List[Tuple[str, int, int]]:
+    """Returns (path, first date_id, last date_id) of every archive database in directory"""
+    result = list()
+    for path in sorted(glob.glob(os.path.join(directory, "*.db"))):
+        if os.path.abspath(path) == os.path.abspath(dbase):
+            continue
+        connection = readonly(path)
+        try:
+            first, last = connection.execute("SELECT MIN(date_id), MAX(date_id) FROM tess_readings_t").fetchone()
+        except sqlite3.Error:
+            first = None  # Not a readings archive
+        finally:
+            connection.close()
+        if first is not None:
+            result.append((path, first, last))
+    return result
+
+
+def _shard(dbase: str, archive: Optional[str], sql: str, row: dict) -> List[tuple]:
+    connection = readonly(dbase)
+    try:
+        if archive is None:
+            readings = "main.tess_readings_t"
+        else:
+            connection.execute("ATTACH DATABASE ? AS %s" % (ARCHIVE,), ("file:{0}?mode=ro".format(archive),))
+            readings = "%s.tess_readings_t" % (ARCHIVE,)
+            tables = set(name for name, in connection.execute("SELECT name FROM %s.sqlite_master WHERE type == 'table'" % (ARCHIVE,)))
+            for table, key in DIMENSIONS:
+                if table in tables:
+                    connection.execute(DIMENSION_SQL.format(table=table, key=key, archive=ARCHIVE))
+        return connection.execute(sql.format(readings=readings), row).fetchall()
+    finally:
+        connection.close()
+
+
+def federated_query(
+    dbase: str,
+    directory: str,
+    sql: str,
+    row: dict,
+    start_date: Optional[int] = None,
+    end_date: Optional[int] = None,
+) -> List[List[tuple]]:
+    """
+    Runs a readings query template on the live database and on every archive
+    in directory overlapping [start_date, end_date] (YYYYMMDDHHMMSS integers).
+    Returns the list of partial results, live database first.
+    """
+    first = None if start_date is None else start_date // 1000000
+    last = None if end_date is None else end_date // 1000000
+    shards = [None] + [
+        path
+        for path, lo, hi in archives(directory, dbase)
+        if (first is None or hi >= first) and (last is None or lo <= last)
+    ]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [executor.submit(_shard, dbase, shard, sql, row) for shard in shards]
+        return [future.result() for future in futures]
+
+
+def merge_latest(results: List[List[tuple]], count: int) -> List[tuple]:
+    """Merges partial results sorted by descending timestamp (first column)"""
+    return list(itertools.islice(heapq.merge(*results, key=itemgetter(0), reverse=True), count))
+
+
+def merge_counts(results: List[List[tuple]]) -> List[tuple]:
+    """Merges partial (key..., MIN(date_id), MAX(date_id), COUNT(*)) results by key"""
+    merged = dict()
+    for *key, first, last, count in itertools.chain(*results):
+        key = tuple(key)
+        if key in merged:
+            lo, hi, n = merged[key]
+            merged[key] = (min(lo, first), max(hi, last), n + count)
+        else:
+            merged[key] = (first, last, count)
+    return [key + value for key, value in sorted(merged.items(), key=lambda item: str(item[0]))]
+
+
+# Archive before delete. Rows are moved into an attached archive database,
+# which is created with the live database schema if needed. Each rowid chunk
+# is copied and deleted in the same transaction and both row counts must
+# match, so that no row is ever deleted without being archived and the
+# write lock is only held for a chunk at a time. In test mode an in-memory
+# archive stands in for the real one, which is left untouched.
+
+
+def attach_archive(connection: sqlite3.Connection, path: str, test: bool = False) -> None:
+    connection.execute("ATTACH DATABASE ? AS %s" % (ARCHIVE,), (":memory:" if test else path,))
+    cursor = connection.cursor()
+    cursor.execute(
+        "SELECT sql FROM main.sqlite_master WHERE type == 'table' AND name IN (%s)"
+        % (", ".join("?" * len(ARCHIVE_TABLES)),),
+        ARCHIVE_TABLES,
+    )
+    for (sql,) in cursor.fetchall():
+        connection.execute(CREATE_TABLE_RE.sub(r"CREATE TABLE IF NOT EXISTS %s.\1" % (ARCHIVE,), sql, count=1))
+    for table in CALENDAR_TABLES:
+        connection.execute("INSERT OR IGNORE INTO %s.%s SELECT * FROM main.%s" % (ARCHIVE, table, table))
+    connection.commit()  # Only the archive has changed, which is in memory in test mode
+
+
+def detach_archive(connection: sqlite3.Connection) -> None:
+    connection.execute("DETACH DATABASE %s" % (ARCHIVE,))
+
+
+def archive_copy(connection: sqlite3.Connection, table: str, condition: str, row: dict) -> int:
+    """Copies (without deleting) the rows of a small dimension table"""
+    cursor = connection.cursor()
+    cursor.execute(
+        "INSERT OR REPLACE INTO %s.%s SELECT * FROM main.%s WHERE %s" % (ARCHIVE, table, table, condition), row
+    )
+    return cursor.rowcount
+
+
+def archive_move(
+    connection: sqlite3.Connection, progress, table: str, condition: str, row: dict, commit: bool = True
+) -> int:
+    """
+    Moves the rows of table matching condition into the archive in rowid chunks,
+    committing every chunk if commit is True. Returns the number of rows moved.
+    """
+    cursor = connection.cursor()
+    copy_sql = "INSERT OR REPLACE INTO %s.%s SELECT * FROM main.%s WHERE %s AND rowid BETWEEN :lo AND :hi" % (
+        ARCHIVE, table, table, condition,
+    )
+    delete_sql = "DELETE FROM main.%s WHERE %s AND rowid BETWEEN :lo AND :hi" % (table, condition)
+    moved = 0
+    params = dict(row)
+    for lo, hi in progress.chunks(condition, row, "main." + table):
+        params["lo"], params["hi"] = lo, hi
+        copied = cursor.execute(copy_sql, params).rowcount
+        deleted = cursor.execute(delete_sql, params).rowcount
+        if copied != deleted:
+            raise ValueError("%s rowids %d-%d: %d rows archived but %d deleted" % (table, lo, hi, copied, deleted))
+        if commit:
+            connection.commit()
+            progress.committed += deleted
+        moved += deleted
+        progress.update(deleted, hi - lo + 1)
+    return moved
@@ -0,0 +1,102 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import sqlite3
+from collections import namedtuple
+from typing import Iterable, List, Optional
+
+# --------------
+# local imports
+# -------------
+
+from .remap import Remapper
+
+# ----------------
+# Module constants
+# ----------------
+
+# tess_t columns that must be equal for two consecutive versions to be coalesced
+ATTRIBUTES = ("zero_point", "filter", "azimuth", "altitude")
+
+VERSIONS_SQL = """
+    SELECT t.tess_id, t.mac_address, t.valid_since, t.valid_until, {attributes},
+        (SELECT name FROM name_to_mac_t WHERE mac_address == t.mac_address ORDER BY valid_since DESC LIMIT 1)
+    FROM tess_t AS t
+    {where}
+    ORDER BY t.mac_address, t.valid_since
+    """
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+# A run is a maximal sequence of consecutive tess_t versions of the same MAC
+# (each valid_until equal to the next valid_since) with identical attributes.
+# As in SQL, where NULL == NULL is not true, versions with a NULL attribute
+# are never coalesced.
+# The run collapses into its last version, which keeps the valid_since of the first.
+Run = namedtuple("Run", ["name", "mac", "target", "sources", "valid_since", "valid_until", "attributes"])
+
+
+def load_versions(connection: sqlite3.Connection, where: str = "", row: Optional[dict] = None) -> List[tuple]:
+    """tess_t versions ordered by (mac_address, valid_since), optionally restricted by a WHERE clause on t"""
+    sql = VERSIONS_SQL.format(attributes=", ".join("t." + column for column in ATTRIBUTES), where=where)
+    return connection.execute(sql, row or {}).fetchall()
+
+
+def same_attributes(a: tuple, b: tuple) -> bool:
+    return all(x is not None and y is not None and x == y for x, y in zip(a, b))
+
+
+def find_runs(versions: Iterable[tuple]) -> List[Run]:
+    """Single linear pass over versions ordered by (mac_address, valid_since)"""
+    runs = list()
+    current = None  # [name, mac, ids, valid_since, valid_until, attributes]
+    n = len(ATTRIBUTES)
+
+    def close():
+        if current is not None and len(current[2]) > 1:
+            ids = current[2]
+            runs.append(Run(current[0], current[1], ids[-1], ids[:-1], current[3], current[4], current[5]))
+
+    for tess_id, mac, valid_since, valid_until, *rest in versions:
+        attributes, name = tuple(rest[:n]), rest[n]
+        if (
+            current is not None
+            and current[1] == mac
+            and current[4] == valid_since
+            and same_attributes(current[5], attributes)
+        ):
+            current[2].append(tess_id)
+            current[4] = valid_until
+        else:
+            close()
+            current = [name, mac, [tess_id], valid_since, valid_until, attributes]
+    close()
+    return runs
+
+
+def add_mappings(remapper: Remapper, runs: Iterable[Run]) -> None:
+    """Adds the old tess_id -> target tess_id mapping of every version of every run"""
+    for run in runs:
+        for source in run.sources:
+            remapper.add(source, run.target)
+
+
+def collapse_versions(connection: sqlite3.Connection, runs: Iterable[Run]) -> int:
+    """Deletes the coalesced tess_t versions and extends each run target. Returns the versions deleted"""
+    cursor = connection.cursor()
+    cursor.executemany("DELETE FROM tess_t WHERE tess_id == ?", [(source,) for run in runs for source in run.sources])
+    deleted = cursor.rowcount
+    cursor.executemany(
+        "UPDATE tess_t SET valid_since = ? WHERE tess_id == ?",
+        [(run.valid_since, run.target) for run in runs],
+    )
+    return deleted
@@ -0,0 +1,91 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import sqlite3
+from typing import Iterable, List, Tuple
+
+# --------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+SAVEPOINT = "dryrun"
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+
+class DryRun:
+    """
+    Runs the real mutation inside a SAVEPOINT so that --test reports exactly
+    what would change instead of a hand-written COUNT query duplicating the
+    WHERE clause. Affected rows are taken from the statement RETURNING clause
+    and aggregated as count, min and max per key.
+    On exit, the savepoint is rolled back in test mode or on error,
+    otherwise it is released, which commits the transaction.
+
+        with DryRun(connection, options.test) as dry:
+            dry.execute("DELETE ... RETURNING tess_id, date_id", row)
+        for key, lo, hi, count in dry.summary(): ...
+    """
+
+    def __init__(self, connection: sqlite3.Connection, test: bool):
+        self.connection = connection
+        self.test = test
+        self.ranges = dict()
+
+    def __enter__(self) -> "DryRun":
+        self.connection.execute("SAVEPOINT %s" % (SAVEPOINT,))
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if not self.connection.in_transaction:
+            # Already rolled back, i.e. by Progress on time limit
+            return False
+        if exc_type is not None or self.test:
+            self.connection.execute("ROLLBACK TO %s" % (SAVEPOINT,))
+        self.connection.execute("RELEASE %s" % (SAVEPOINT,))
+        return False
+
+    def collect(self, rows: Iterable[tuple]) -> None:
+        """Aggregates (key..., value) rows into count, min and max per key"""
+        ranges = self.ranges
+        for *key, value in rows:
+            key = tuple(key)
+            try:
+                r = ranges[key]
+            except KeyError:
+                ranges[key] = [1, value, value]
+            else:
+                r[0] += 1
+                if value < r[1]:
+                    r[1] = value
+                elif value > r[2]:
+                    r[2] = value
+
+    def execute(self, sql: str, row: dict) -> List[tuple]:
+        """Executes a mutation with a RETURNING clause, collects and returns its rows"""
+        cursor = self.connection.cursor()
+        cursor.execute(sql, row)
+        rows = cursor.fetchall()
+        self.collect(rows)
+        return rows
+
+    @property
+    def changes(self) -> int:
+        return sum(r[0] for r in self.ranges.values())
+
+    def summary(self) -> List[Tuple[tuple, object, object, int]]:
+        """(key, min, max, count) sorted by key"""
+        return [(key, r[1], r[2], r[0]) for key, r in sorted(self.ranges.items())]
@@ -0,0 +1,139 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import math
+import sqlite3
+from collections import namedtuple
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+# --------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+EARTH_RADIUS = 6371000.0  # meters, mean radius
+
+# Real sites with numeric coordinates only: the 'Unknown' (-1) placeholder
+# and 'Unknown' or NULL coordinates are skipped
+SITES_SQL = """
+    SELECT location_id, site, longitude, latitude
+    FROM location_t
+    WHERE location_id >= 0
+    AND   typeof(longitude) IN ('real', 'integer')
+    AND   typeof(latitude)  IN ('real', 'integer')
+    ORDER BY location_id
+    """
+
+Site = namedtuple("Site", ["location_id", "site", "longitude", "latitude"])
+Neighbour = namedtuple("Neighbour", ["i", "j", "distance"])
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+
+def haversine(lon1: float, lat1: float, lon2: float, lat2: float) -> float:
+    """Great circle distance in meters"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def unit_vector(lon: float, lat: float) -> Tuple[float, float, float]:
+    """Point on the unit sphere. Chord lengths between them grow monotonically with distance"""
+    phi, lam = math.radians(lat), math.radians(lon)
+    return (math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi))
+
+
+def chord(distance: float) -> float:
+    """Unit sphere chord length for a great circle distance in meters"""
+    return 2 * math.sin(min(distance / (2 * EARTH_RADIUS), math.pi / 2))
+
+
+def load_sites(connection: sqlite3.Connection) -> List[Site]:
+    return [Site(*row) for row in connection.execute(SITES_SQL)]
+
+
+def near_pairs(points: Sequence[Tuple[float, float]], distance: float) -> Iterator[Neighbour]:
+    """
+    All (i, j) pairs, i < j, of (longitude, latitude) points within distance meters,
+    each reported once. Points are bucketed into a 3D grid over their unit sphere
+    vectors with the chord of distance as cell size, so only the 27 neighbouring
+    cells are compared. This has no longitude shrinkage, pole or antimeridian
+    special cases. Candidates are confirmed with the haversine distance.
+    """
+    size = chord(distance)
+    if size <= 0:
+        return
+    grid: Dict[Tuple[int, int, int], List[int]] = dict()
+    for i, (lon, lat) in enumerate(points):
+        x, y, z = unit_vector(lon, lat)
+        grid.setdefault((int(math.floor(x / size)), int(math.floor(y / size)), int(math.floor(z / size))), list()).append(i)
+    offsets = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)]
+    for (cx, cy, cz), members in grid.items():
+        for dx, dy, dz in offsets:
+            others = grid.get((cx + dx, cy + dy, cz + dz))
+            if others is None:
+                continue
+            for i in members:
+                lon1, lat1 = points[i]
+                for j in others:
+                    if j <= i:
+                        continue
+                    d = haversine(lon1, lat1, *points[j])
+                    if d <= distance:
+                        yield Neighbour(i, j, d)
+
+
+def clusters(n: int, pairs: Iterator[Neighbour]) -> List[List[int]]:
+    """Connected components of the near pairs graph with more than one member, by union-find"""
+    parent = list(range(n))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j, _ in pairs:
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+    groups: Dict[int, List[int]] = dict()
+    for i in range(n):
+        groups.setdefault(find(i), list()).append(i)
+    return [members for root, members in sorted(groups.items()) if len(members) > 1]
+
+
+def duplicates(connection: sqlite3.Connection, distance: float) -> List[tuple]:
+    """
+    Near duplicate sites as (cluster, site, longitude, latitude, nearest site, distance) rows,
+    one per site, grouped by cluster.
+    """
+    sites = load_sites(connection)
+    pairs = list(near_pairs([(s.longitude, s.latitude) for s in sites], distance))
+    nearest: Dict[int, Tuple[float, int]] = dict()
+    for i, j, d in pairs:
+        if d < nearest.get(i, (math.inf,))[0]:
+            nearest[i] = (d, j)
+        if d < nearest.get(j, (math.inf,))[0]:
+            nearest[j] = (d, i)
+    result = list()
+    for k, members in enumerate(clusters(len(sites), iter(pairs)), start=1):
+        for i in members:
+            d, j = nearest[i]
+            s = sites[i]
+            result.append((k, s.site, s.longitude, s.latitude, sites[j].site, round(d, 1)))
+    return result
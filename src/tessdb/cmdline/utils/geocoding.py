@@ -0,0 +1,321 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import os
+import csv
+import json
+import time
+import asyncio
+import sqlite3
+import concurrent.futures
+from collections import namedtuple
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+# --------------
+# local imports
+# -------------
+
+from .geo import haversine
+
+# ----------------
+# Module constants
+# ----------------
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "tessdb", "geocoding.db")
+
+# Coordinates are rounded to PRECISION decimals for the cache key:
+# 3 decimals are ~110 m in latitude, close enough to share a town and timezone.
+DEFAULT_PRECISION = 3
+DEFAULT_TTL = 180  # days
+DEFAULT_MAX_ENTRIES = 100000
+
+# Nominatim usage policy: at most one request per second
+MIN_DELAY = 1.0
+
+# Within this distance in meters a gazetteer entry answers a query
+GAZETTEER_DISTANCE = 5000.0
+
+UNKNOWN = "Unknown"
+
+CACHE_SQL = """
+    CREATE TABLE IF NOT EXISTS geocoding_t (
+        lat_key   INTEGER NOT NULL,
+        lon_key   INTEGER NOT NULL,
+        address   TEXT    NOT NULL,
+        timezone  TEXT,
+        created   REAL    NOT NULL,
+        used      REAL    NOT NULL,
+        PRIMARY KEY (lat_key, lon_key)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS geocoding_used_i ON geocoding_t(used);
+    """
+
+Place = namedtuple("Place", ["location", "province", "state", "zipcode", "country", "timezone", "cached"])
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+
+def address_parts(address: Dict[str, str]) -> Dict[str, str]:
+    """Town, province, state, ZIP code and country from a Nominatim like address dictionary"""
+    parts = dict()
+    parts["location"] = next(
+        (address[k] for k in ("village", "town", "city", "municipality") if k in address), UNKNOWN
+    )
+    parts["province"] = next((address[k] for k in ("state", "state_district") if k in address), UNKNOWN)
+    parts["state"] = address.get("state_district", UNKNOWN)
+    parts["zipcode"] = address.get("postcode", UNKNOWN)
+    parts["country"] = address.get("country", UNKNOWN)
+    return parts
+
+
+class NominatimBackend:
+    """OpenStreetMap Nominatim reverse geocoding, throttled to its usage policy"""
+
+    def __init__(self, user_agent: str = "STARS4ALL project", min_delay: float = MIN_DELAY):
+        from geopy.geocoders import Nominatim
+        from geopy.extra.rate_limiter import RateLimiter
+
+        self.reverse_ = RateLimiter(Nominatim(user_agent=user_agent).reverse, min_delay_seconds=min_delay)
+
+    def reverse(self, latitude: float, longitude: float) -> Dict[str, str]:
+        location = self.reverse_(f"{latitude}, {longitude}", language="en")
+        return location.raw["address"] if location is not None else dict()
+
+
+class GazetteerBackend:
+    """
+    Offline stand-in for testing and air gapped hosts: the nearest place
+    of a CSV or JSON list with latitude, longitude and Nominatim address keys
+    (village, town, city, state, postcode, country...) and an optional timezone.
+    """
+
+    def __init__(self, path: str, distance: float = GAZETTEER_DISTANCE):
+        self.distance = distance
+        with open(path, newline="") as fd:
+            if path.endswith(".json"):
+                places = json.load(fd)
+            else:
+                places = list(csv.DictReader(fd))
+        self.places = [
+            (float(place.pop("latitude")), float(place.pop("longitude")), {k: v for k, v in place.items() if v})
+            for place in places
+        ]
+
+    def reverse(self, latitude: float, longitude: float) -> Dict[str, str]:
+        best = min(
+            self.places, key=lambda place: haversine(longitude, latitude, place[1], place[0]), default=None
+        )
+        if best is None or haversine(longitude, latitude, best[1], best[0]) > self.distance:
+            return dict()
+        return dict(best[2])
+
+
+class Timezones:
+    """
+    IANA timezone of (longitude, latitude) points. TimezoneFinder and its
+    polygons are only loaded on the first lookup, not on every CLI start,
+    and lookups are memoized per coordinate.
+    """
+
+    def __init__(self):
+        self._finder = None
+        self._memo = dict()
+
+    @property
+    def finder(self):
+        if self._finder is None:
+            from timezonefinder import TimezoneFinder
+
+            self._finder = TimezoneFinder()
+        return self._finder
+
+    def __call__(self, longitude: float, latitude: float) -> Optional[str]:
+        key = (longitude, latitude)
+        try:
+            return self._memo[key]
+        except KeyError:
+            tzone = self._memo[key] = self.finder.timezone_at(lng=longitude, lat=latitude)
+            return tzone
+
+
+class Geocoder:
+    """
+    Reverse geocoding with a persistent SQLite cache keyed by coordinates
+    rounded to precision decimals. Entries older than ttl days are fetched
+    again and the least recently used ones are evicted beyond max_entries,
+    down to 90% of it so that eviction runs once per batch of inserts.
+    The timezone is resolved once per cache entry with the tzone(longitude, latitude)
+    callable, unless the backend already provides it. Places the backend
+    does not know are not cached.
+
+        geocoder = Geocoder(NominatimBackend(), tzone=Timezones())
+        place = geocoder.reverse(40.41, -3.70)
+    """
+
+    def __init__(
+        self,
+        backend,
+        tzone: Callable[[float, float], Optional[str]],
+        path: str = DEFAULT_CACHE,
+        precision: int = DEFAULT_PRECISION,
+        ttl: float = DEFAULT_TTL,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.backend = backend
+        self.tzone = tzone
+        self.scale = 10**precision
+        self.ttl = ttl * 86400
+        self.max_entries = max_entries
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(CACHE_SQL)
+        self.evict()
+
+    def evict(self) -> None:
+        """Drops expired entries and, beyond max_entries, the least recently used ones"""
+        now = time.time()
+        self.connection.execute("DELETE FROM geocoding_t WHERE created < ?", (now - self.ttl,))
+        (self.entries,) = self.connection.execute("SELECT COUNT(*) FROM geocoding_t").fetchone()
+        if self.entries > self.max_entries:
+            keep = self.max_entries - self.max_entries // 10
+            self.connection.execute(
+                """
+                DELETE FROM geocoding_t WHERE used <= (
+                    SELECT used FROM geocoding_t ORDER BY used DESC LIMIT 1 OFFSET :keep
+                )
+                """,
+                {"keep": keep},
+            )
+            (self.entries,) = self.connection.execute("SELECT COUNT(*) FROM geocoding_t").fetchone()
+        self.connection.commit()
+
+    def key(self, latitude: float, longitude: float) -> tuple:
+        return (round(latitude * self.scale), round(longitude * self.scale))
+
+    def lookup(self, latitude: float, longitude: float) -> Optional[Place]:
+        """Cached place, None if unknown or expired"""
+        lat_key, lon_key = self.key(latitude, longitude)
+        now = time.time()
+        row = self.connection.execute(
+            "SELECT address, timezone FROM geocoding_t WHERE lat_key == ? AND lon_key == ? AND created >= ?",
+            (lat_key, lon_key, now - self.ttl),
+        ).fetchone()
+        if row is None:
+            return None
+        self.connection.execute(
+            "UPDATE geocoding_t SET used = ? WHERE lat_key == ? AND lon_key == ?", (now, lat_key, lon_key)
+        )
+        self.connection.commit()
+        return Place(timezone=row[1], cached=True, **json.loads(row[0]))
+
+    def store(self, latitude: float, longitude: float, parts: Dict[str, str], timezone: Optional[str]) -> None:
+        lat_key, lon_key = self.key(latitude, longitude)
+        now = time.time()
+        self.connection.execute(
+            "INSERT OR REPLACE INTO geocoding_t (lat_key, lon_key, address, timezone, created, used) VALUES (?,?,?,?,?,?)",
+            (lat_key, lon_key, json.dumps(parts), timezone, now, now),
+        )
+        # Replacements overcount, which at worst brings the next eviction forward
+        self.entries += 1
+        if self.entries > self.max_entries:
+            self.evict()
+        else:
+            self.connection.commit()
+
+    def resolve(self, latitude: float, longitude: float, address: Dict[str, str]) -> Place:
+        """Place from a backend address, cached if the backend knew it"""
+        parts = address_parts(address)
+        timezone = address.get("timezone") or self.tzone(longitude, latitude)
+        if address:
+            self.store(latitude, longitude, parts, timezone)
+        return Place(timezone=timezone, cached=False, **parts)
+
+    def reverse(self, latitude: float, longitude: float) -> Place:
+        place = self.lookup(latitude, longitude)
+        if place is not None:
+            return place
+        return self.resolve(latitude, longitude, self.backend.reverse(latitude, longitude))
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class TokenBucket:
+    """Allows rate acquisitions per second on average, with bursts of up to burst"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def _reverse_all(
+    geocoder: Geocoder,
+    points: Dict[tuple, Tuple[float, float]],
+    rate: float,
+    concurrency: int,
+    done: Callable[[tuple, Place], Any],
+) -> None:
+    loop = asyncio.get_running_loop()
+    bucket = TokenBucket(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(key: tuple, latitude: float, longitude: float) -> None:
+        # Cache and timezone work stays in the event loop thread, only the
+        # blocking network call runs in the pool, at most concurrency at once
+        place = geocoder.lookup(latitude, longitude)
+        if place is None:
+            async with semaphore:
+                await bucket.acquire()
+                address = await loop.run_in_executor(executor, geocoder.backend.reverse, latitude, longitude)
+            place = geocoder.resolve(latitude, longitude, address)
+        done(key, place)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        await asyncio.gather(*(one(key, latitude, longitude) for key, (latitude, longitude) in points.items()))
+
+
+def reverse_all(
+    geocoder: Geocoder,
+    points: Iterable[Tuple[float, float]],
+    rate: float,
+    concurrency: int,
+    done: Callable[[Tuple[float, float], Place], Any],
+) -> None:
+    """
+    Reverse geocodes many (latitude, longitude) points through an asyncio pipeline:
+    cached cells are answered at once, the rest go to the backend with at most
+    concurrency requests in flight and rate requests per second. Points sharing
+    a cache cell are geocoded once. done(point, place) is called as each one completes.
+    """
+    cells = dict()
+    for point in points:
+        cells.setdefault(geocoder.key(*point), list()).append(point)
+
+    def fan_out(key: tuple, place: Place) -> None:
+        for point in cells[key]:
+            done(point, place)
+
+    representatives = {key: members[0] for key, members in cells.items()}
+    asyncio.run(_reverse_all(geocoder, representatives, rate, concurrency, fan_out))
@@ -0,0 +1,140 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import sqlite3
+import itertools
+from bisect import bisect_right
+from collections import namedtuple
+from typing import Any, List, Optional, Sequence
+
+# --------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+# valid_since/valid_until are ISO 8601 strings 'YYYY-MM-DDTHH:MM:SS',
+# so they compare correctly as strings. A version is valid in
+# valid_since <= T < valid_until, as valid_until of an expired version
+# is the valid_since of the next one.
+
+NAMES_SQL = """
+    SELECT name, mac_address, valid_since, valid_until
+    FROM name_to_mac_t
+    """
+
+VERSIONS_SQL = """
+    SELECT t.mac_address, t.valid_since, t.valid_until,
+        t.tess_id, t.zero_point, t.filter, t.azimuth, t.altitude, t.location_id, l.site
+    FROM tess_t AS t
+    LEFT JOIN location_t AS l USING (location_id)
+    """
+
+Version = namedtuple("Version", ["tess_id", "zero_point", "filter", "azimuth", "altitude", "location_id", "site"])
+
+Resolved = namedtuple("Resolved", ["name", "mac", "version"])
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+
+class IntervalIndex:
+    """
+    Slowly changing dimension rows as sorted per-key interval arrays.
+    Point in time lookups are a binary search on the interval starts.
+    """
+
+    def __init__(self):
+        self._rows = dict()  # key -> [(since, until, value)]
+        self._starts = None  # key -> [since]
+
+    def add(self, key: Any, since: str, until: str, value: Any) -> None:
+        self._rows.setdefault(key, list()).append((since, until, value))
+        self._starts = None
+
+    def _freeze(self) -> None:
+        for intervals in self._rows.values():
+            intervals.sort(key=lambda interval: interval[0])
+        self._starts = {key: [interval[0] for interval in intervals] for key, intervals in self._rows.items()}
+
+    def at(self, key: Any, tstamp: str) -> Optional[Any]:
+        """Value valid for key at tstamp, None if there is none"""
+        if self._starts is None:
+            self._freeze()
+        starts = self._starts.get(key)
+        if not starts:
+            return None
+        i = bisect_right(starts, tstamp) - 1
+        if i < 0:
+            return None
+        since, until, value = self._rows[key][i]
+        return value if tstamp < until else None
+
+    def merge(self, key: Any, tstamps: Sequence[str]) -> List[Optional[Any]]:
+        """Values valid for key at each of the ascending tstamps, in a single pass over its intervals"""
+        if self._starts is None:
+            self._freeze()
+        intervals = self._rows.get(key, ())
+        n = len(intervals)
+        i = -1
+        result = list()
+        for tstamp in tstamps:
+            while i + 1 < n and intervals[i + 1][0] <= tstamp:
+                i += 1
+            result.append(intervals[i][2] if i >= 0 and tstamp < intervals[i][1] else None)
+        return result
+
+
+class InstrumentResolver:
+    """
+    Which name, calibration and location were valid for an instrument at a given time,
+    from name_to_mac_t and tess_t loaded once, without per lookup SQL.
+
+        resolver = InstrumentResolver(connection)
+        name, mac, version = resolver.by_name("stars1", "2023-05-01T00:00:00")
+        for name, mac, version in resolver.annotate(macs, tstamps): ...
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.macs = IntervalIndex()  # name -> mac
+        self.names = IntervalIndex()  # mac -> name
+        self.versions = IntervalIndex()  # mac -> Version
+        for name, mac, since, until in connection.execute(NAMES_SQL):
+            self.macs.add(name, since, until, mac)
+            self.names.add(mac, since, until, name)
+        for mac, since, until, *version in connection.execute(VERSIONS_SQL):
+            self.versions.add(mac, since, until, Version(*version))
+
+    def by_mac(self, mac: str, tstamp: str) -> Resolved:
+        return Resolved(self.names.at(mac, tstamp), mac, self.versions.at(mac, tstamp))
+
+    def by_name(self, name: str, tstamp: str) -> Resolved:
+        mac = self.macs.at(name, tstamp)
+        if mac is None:
+            return Resolved(name, None, None)
+        return Resolved(name, mac, self.versions.at(mac, tstamp))
+
+    def annotate(self, macs: Sequence[str], tstamps: Sequence[str]) -> List[Resolved]:
+        """
+        Bulk resolution of (mac, tstamp) pairs, i.e. from exported readings.
+        The pairs are sorted once and the readings of each MAC resolved in a
+        single merge pass over its sorted intervals. Results are in input order.
+        """
+        order = sorted(range(len(macs)), key=lambda i: (macs[i], tstamps[i]))
+        result = [None] * len(order)
+        for mac, group in itertools.groupby(order, key=macs.__getitem__):
+            group = list(group)
+            times = [tstamps[i] for i in group]
+            for i, name, version in zip(group, self.names.merge(mac, times), self.versions.merge(mac, times)):
+                result[i] = Resolved(name, mac, version)
+        return result
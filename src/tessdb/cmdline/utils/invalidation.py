@@ -0,0 +1,182 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import json
+import socket
+import sqlite3
+import datetime
+from typing import Dict, List
+
+# --------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+# Unix datagram socket where the tessdb server (or tess-cache-listener) listens
+DEFAULT_SOCKET = "/var/run/tessdb/invalidations.sock"
+
+PENDING_TABLE = "pending_invalidations"
+CHANGES_TABLE = "invalidation_t"
+GENERATION_TABLE = "cache_generation_t"
+
+MAC = "macs"
+NAME = "names"
+LOCATION = "locations"
+KINDS = (MAC, NAME, LOCATION)
+
+# Changed keys are recorded by TEMP triggers: they only fire for this connection
+# and their rows are rolled back together with the change, so test mode
+# (DryRun) and failed commands leave nothing to invalidate.
+# Location changes also bump a persistent generation counter, so that on disk
+# caches derived from location_t (the site KD-tree) can tell they are stale.
+# Trigger bodies cannot qualify table names: the unqualified one is in main.
+TRACK_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS {changes} (
+        kind TEXT NOT NULL,
+        key  TEXT NOT NULL,
+        PRIMARY KEY (kind, key)
+    ) WITHOUT ROWID;
+
+    CREATE TEMP TRIGGER IF NOT EXISTS tess_insert_i AFTER INSERT ON main.tess_t BEGIN
+        INSERT OR IGNORE INTO {changes} VALUES ('{mac}', NEW.mac_address);
+    END;
+    CREATE TEMP TRIGGER IF NOT EXISTS tess_update_i AFTER UPDATE ON main.tess_t BEGIN
+        INSERT OR IGNORE INTO {changes} VALUES ('{mac}', OLD.mac_address), ('{mac}', NEW.mac_address);
+    END;
+    CREATE TEMP TRIGGER IF NOT EXISTS tess_delete_i AFTER DELETE ON main.tess_t BEGIN
+        INSERT OR IGNORE INTO {changes} VALUES ('{mac}', OLD.mac_address);
+    END;
+
+    CREATE TEMP TRIGGER IF NOT EXISTS name_insert_i AFTER INSERT ON main.name_to_mac_t BEGIN
+        INSERT OR IGNORE INTO {changes} VALUES ('{name}', NEW.name), ('{mac}', NEW.mac_address);
+    END;
+    CREATE TEMP TRIGGER IF NOT EXISTS name_update_i AFTER UPDATE ON main.name_to_mac_t BEGIN
+        INSERT OR IGNORE INTO {changes} VALUES
+            ('{name}', OLD.name), ('{mac}', OLD.mac_address), ('{name}', NEW.name), ('{mac}', NEW.mac_address);
+    END;
+    CREATE TEMP TRIGGER IF NOT EXISTS name_delete_i AFTER DELETE ON main.name_to_mac_t BEGIN
+        INSERT OR IGNORE INTO {changes} VALUES ('{name}', OLD.name), ('{mac}', OLD.mac_address);
+    END;
+
+    CREATE TEMP TRIGGER IF NOT EXISTS location_insert_i AFTER INSERT ON main.location_t BEGIN
+        INSERT OR IGNORE INTO {changes} VALUES ('{location}', NEW.location_id);
+        INSERT INTO {generations} VALUES ('{location}', 1) ON CONFLICT(kind) DO UPDATE SET generation = generation + 1;
+    END;
+    CREATE TEMP TRIGGER IF NOT EXISTS location_update_i AFTER UPDATE ON main.location_t BEGIN
+        INSERT OR IGNORE INTO {changes} VALUES ('{location}', OLD.location_id), ('{location}', NEW.location_id);
+        INSERT INTO {generations} VALUES ('{location}', 1) ON CONFLICT(kind) DO UPDATE SET generation = generation + 1;
+    END;
+    CREATE TEMP TRIGGER IF NOT EXISTS location_delete_i AFTER DELETE ON main.location_t BEGIN
+        INSERT OR IGNORE INTO {changes} VALUES ('{location}', OLD.location_id);
+        INSERT INTO {generations} VALUES ('{location}', 1) ON CONFLICT(kind) DO UPDATE SET generation = generation + 1;
+    END;
+    """
+
+GENERATION_SQL = """
+    CREATE TABLE IF NOT EXISTS {generations} (
+        kind       TEXT    NOT NULL PRIMARY KEY,
+        generation INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """
+
+PENDING_SQL = """
+    CREATE TABLE IF NOT EXISTS {pending} (
+        id      INTEGER PRIMARY KEY AUTOINCREMENT,
+        tstamp  TEXT NOT NULL,
+        payload TEXT NOT NULL
+    )
+    """
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+
+def track(connection: sqlite3.Connection) -> None:
+    """Records the MACs, names and location ids changed through this connection"""
+    connection.execute(GENERATION_SQL.format(generations=GENERATION_TABLE))
+    connection.executescript(
+        TRACK_SQL.format(
+            changes=CHANGES_TABLE, generations=GENERATION_TABLE, mac=MAC, name=NAME, location=LOCATION
+        )
+    )
+
+
+def generation(connection: sqlite3.Connection, kind: str = LOCATION) -> int:
+    """Number of tracked changes ever made to the given kind of keys, 0 if never tracked"""
+    try:
+        row = connection.execute(
+            "SELECT generation FROM main.%s WHERE kind == ?" % (GENERATION_TABLE,), (kind,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return 0  # no such table yet
+    return row[0] if row is not None else 0
+
+
+def changes(connection: sqlite3.Connection) -> Dict[str, list]:
+    """Committed changed keys per kind. Uncommitted changes are rolled back first"""
+    connection.rollback()
+    result = {kind: list() for kind in KINDS}
+    for kind, key in connection.execute("SELECT kind, key FROM temp.%s ORDER BY kind, key" % (CHANGES_TABLE,)):
+        result[kind].append(int(key) if kind == LOCATION else key)
+    return result
+
+
+def empty(payload: Dict[str, list]) -> bool:
+    return not any(payload.get(kind) for kind in KINDS)
+
+
+def merge(payloads: List[Dict[str, list]]) -> Dict[str, list]:
+    result = {kind: set() for kind in KINDS}
+    for payload in payloads:
+        for kind in KINDS:
+            result[kind].update(payload.get(kind, ()))
+    return {kind: sorted(keys) for kind, keys in result.items()}
+
+
+def publish(connection: sqlite3.Connection, payload: Dict[str, list], path: str = DEFAULT_SOCKET) -> bool:
+    """
+    Sends one invalidation message with all the changed keys to the listener
+    at the Unix datagram socket path. If nobody is listening, the keys are
+    merged into the single pending message instead, so that the pending table
+    never grows beyond one row, to be picked up by a listener when it starts.
+    Returns True if a listener was notified.
+    """
+    message = json.dumps(payload, sort_keys=True)
+    connection.execute("DELETE FROM temp.%s" % (CHANGES_TABLE,))
+    connection.commit()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(message.encode("utf-8"), path)
+    except OSError:
+        pending = drain(connection, commit=False)
+        connection.execute(
+            "INSERT INTO %s (tstamp, payload) VALUES (?, ?)" % (PENDING_TABLE,),
+            (
+                datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"),
+                json.dumps(merge([pending, payload]), sort_keys=True),
+            ),
+        )
+        connection.commit()
+        return False
+    return True
+
+
+def drain(connection: sqlite3.Connection, commit: bool = True) -> Dict[str, list]:
+    """Takes all pending invalidation messages, merged into one"""
+    connection.execute(PENDING_SQL.format(pending=PENDING_TABLE))
+    cursor = connection.execute("DELETE FROM %s RETURNING payload" % (PENDING_TABLE,))
+    payloads = [json.loads(payload) for payload, in cursor.fetchall()]
+    if commit:
+        connection.commit()
+    return merge(payloads)
@@ -0,0 +1,218 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import os
+import heapq
+import hashlib
+import sqlite3
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# --------------
+# local imports
+# -------------
+
+from .geo import EARTH_RADIUS, SITES_SQL, chord
+from . import invalidation
+
+# ----------------
+# Module constants
+# ----------------
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "tessdb")
+
+LEAF_SIZE = 16
+
+# Cheap fingerprint of location_t, no sorting nor reading of the rows themselves:
+# inserts and deletes alter it, updates bump the invalidation generation counter
+SIGNATURE_SQL = "SELECT COUNT(*), MAX(rowid) FROM location_t"
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+
+def unit_vectors(longitude: np.ndarray, latitude: np.ndarray) -> np.ndarray:
+    phi, lam = np.radians(latitude), np.radians(longitude)
+    return np.column_stack((np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)))
+
+
+def meters(chord_length: float) -> float:
+    """Great circle distance in meters for a unit sphere chord length"""
+    return 2 * EARTH_RADIUS * float(np.arcsin(min(1.0, chord_length / 2)))
+
+
+class SiteTree:
+    """
+    KD-tree over the unit sphere vectors of all location_t sites, so that
+    chord (and thus great circle) nearest neighbours need no projection.
+    Nodes are stored in flat arrays over a permutation of the points and the
+    whole tree is cached on disk as a .npz file, rebuilt only when the
+    location_t fingerprint changes: its row count, highest rowid or the
+    generation counter that tracked commands bump on every location change.
+
+        tree = SiteTree.open(connection, options.dbase)
+        for location_id, site, longitude, latitude, distance in tree.nearest(lon, lat, k=3, within=500): ...
+    """
+
+    def __init__(self, ids, sites, longitude, latitude, signature: str):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        # Fixed width unicode, so that the cache loads without unpickling objects
+        self.sites = np.array(["" if site is None else site for site in sites], dtype=np.str_)
+        self.longitude = np.asarray(longitude, dtype=np.float64)
+        self.latitude = np.asarray(latitude, dtype=np.float64)
+        self.signature = signature
+        self.points = unit_vectors(self.longitude, self.latitude).reshape(-1, 3)
+        self.perm = np.arange(len(self.ids))
+        lo, hi, dim, split, left, right = [], [], [], [], [], []
+        self.nodes = (lo, hi, dim, split, left, right)
+        if len(self.ids):
+            self._build(0, len(self.ids))
+        self.nodes = tuple(np.asarray(a) for a in self.nodes)
+
+    def _build(self, start: int, stop: int) -> int:
+        lo, hi, dim, split, left, right = self.nodes
+        node = len(lo)
+        lo.append(start)
+        hi.append(stop)
+        dim.append(-1)
+        split.append(0.0)
+        left.append(-1)
+        right.append(-1)
+        if stop - start <= LEAF_SIZE:
+            return node
+        idx = self.perm[start:stop]
+        spread = self.points[idx].max(axis=0) - self.points[idx].min(axis=0)
+        d = int(np.argmax(spread))
+        order = idx[np.argsort(self.points[idx, d], kind="stable")]
+        self.perm[start:stop] = order
+        middle = (start + stop) // 2
+        dim[node] = d
+        split[node] = float(self.points[order[middle - start], d])
+        left[node] = self._build(start, middle)
+        right[node] = self._build(middle, stop)
+        return node
+
+    # -------------
+    # Disk cache
+    # -------------
+
+    @staticmethod
+    def fingerprint(connection: sqlite3.Connection) -> str:
+        row = connection.execute(SIGNATURE_SQL).fetchone() + (invalidation.generation(connection),)
+        return hashlib.sha1(repr(row).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def cache_path(dbase: str, directory: str = DEFAULT_CACHE_DIR) -> str:
+        key = hashlib.sha1(os.path.realpath(dbase).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(directory, "sites-%s.npz" % (key,))
+
+    @classmethod
+    def build(cls, connection: sqlite3.Connection, signature: Optional[str] = None) -> "SiteTree":
+        signature = signature or cls.fingerprint(connection)
+        rows = connection.execute(SITES_SQL).fetchall()
+        ids, sites, longitude, latitude = zip(*rows) if rows else ((), (), (), ())
+        return cls(ids, sites, longitude, latitude, signature)
+
+    @classmethod
+    def open(cls, connection: sqlite3.Connection, dbase: str, directory: str = DEFAULT_CACHE_DIR) -> "SiteTree":
+        """Cached tree for this database, rebuilt and saved if location_t changed"""
+        signature = cls.fingerprint(connection)
+        path = cls.cache_path(dbase, directory)
+        try:
+            # Caches from older versions with pickled site names are rebuilt
+            with np.load(path, allow_pickle=False) as data:
+                if str(data["signature"]) == signature:
+                    return cls._load(data)
+        except (OSError, KeyError, ValueError):
+            pass
+        tree = cls.build(connection, signature)
+        os.makedirs(directory, exist_ok=True)
+        tree.save(path)
+        return tree
+
+    @classmethod
+    def _load(cls, data) -> "SiteTree":
+        tree = cls.__new__(cls)
+        tree.ids = data["ids"]
+        tree.sites = data["sites"]
+        tree.longitude = data["longitude"]
+        tree.latitude = data["latitude"]
+        tree.signature = str(data["signature"])
+        tree.points = data["points"]
+        tree.perm = data["perm"]
+        tree.nodes = tuple(data["node_%d" % i] for i in range(6))
+        return tree
+
+    def save(self, path: str) -> None:
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp,
+            ids=self.ids,
+            sites=self.sites,
+            longitude=self.longitude,
+            latitude=self.latitude,
+            signature=np.array(self.signature),
+            points=self.points,
+            perm=self.perm,
+            **{"node_%d" % i: a for i, a in enumerate(self.nodes)},
+        )
+        os.replace(tmp, path)
+
+    # -------------
+    # Queries
+    # -------------
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def nearest(
+        self, longitude: float, latitude: float, k: int = 1, within: Optional[float] = None
+    ) -> List[Tuple[int, str, float, float, float]]:
+        """
+        Up to k (location_id, site, longitude, latitude, distance in meters) nearest sites,
+        closest first, optionally only those within the given distance in meters.
+        """
+        if not len(self.ids) or k < 1:
+            return []
+        lo, hi, dim, split, left, right = self.nodes
+        q = unit_vectors(np.array([longitude]), np.array([latitude]))[0]
+        bound = chord(within) ** 2 if within is not None else np.inf
+        best = []  # max heap of (-squared chord, point index)
+        stack = [(0, 0.0)]
+        while stack:
+            node, plane = stack.pop()
+            worst = -best[0][0] if len(best) == k else bound
+            if plane > worst:
+                continue
+            d = dim[node]
+            if d < 0:
+                idx = self.perm[lo[node] : hi[node]]
+                dist = ((self.points[idx] - q) ** 2).sum(axis=1)
+                for i, d2 in zip(idx.tolist(), dist.tolist()):
+                    if d2 > bound:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-d2, i))
+                    elif d2 < -best[0][0]:
+                        heapq.heapreplace(best, (-d2, i))
+                continue
+            diff = q[d] - split[node]
+            near, far = (left[node], right[node]) if diff < 0 else (right[node], left[node])
+            # Far side first on the stack so that the near side is searched first
+            stack.append((far, max(plane, diff * diff)))
+            stack.append((near, plane))
+        result = list()
+        for d2, i in sorted((-d2, i) for d2, i in best):
+            result.append(
+                (int(self.ids[i]), str(self.sites[i]), float(self.longitude[i]), float(self.latitude[i]), meters(d2**0.5))
+            )
+        return result
@@ -0,0 +1,203 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import sqlite3
+import datetime
+from typing import List, Tuple
+
+import numpy as np
+
+# --------------
+# local imports
+# -------------
+
+from .. import TSTAMP_FORMAT
+from .progress import DATE_RANGE
+
+# ----------------
+# Module constants
+# ----------------
+
+# Magnitudes are stored rounded as the tessdb server does
+DECIMALS = 2
+
+# Timestamps as (date_id*1000000 + time_id) integers.
+# Readings of different MACs are kept apart in one sorted key space
+# by adding mac_index * MAC_STRIDE to their timestamps.
+MAC_STRIDE = 10**14
+
+VERSIONS_SQL = """
+    SELECT mac_address, tess_id, zero_point, valid_since, valid_until
+    FROM tess_t
+    WHERE mac_address IN ({macs})
+    ORDER BY mac_address, valid_since
+    """
+
+READINGS_WHERE = """
+    {date_range}
+    AND (date_id*1000000 + time_id) BETWEEN :start_date AND :end_date
+    AND {condition}
+    """
+
+READINGS_SQL = """
+    SELECT rowid, tess_id, (date_id*1000000 + time_id), frequency, magnitude
+    FROM tess_readings_t
+    WHERE {where}
+    AND rowid BETWEEN :lo AND :hi
+    """
+
+UPDATE_SQL = "UPDATE tess_readings_t SET magnitude = ? WHERE rowid == ?"
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+
+def tstamp_key(mac: str, tstamp: str) -> int:
+    """
+    A valid_since/valid_until TSTAMP_FORMAT string as a (date_id*1000000 + time_id)
+    integer, as the readings timestamps. Any other format is rejected, since
+    a wrong key would silently select the wrong zero point.
+    """
+    try:
+        t = datetime.datetime.strptime(tstamp, TSTAMP_FORMAT)
+    except (TypeError, ValueError):
+        raise ValueError("%s version validity %r is not in %s format" % (mac, tstamp, TSTAMP_FORMAT))
+    date_id = (t.year * 100 + t.month) * 100 + t.day
+    time_id = (t.hour * 100 + t.minute) * 100 + t.second
+    return date_id * 1000000 + time_id
+
+
+class ZeroPoints:
+    """
+    Zero point history of a set of MACs as sorted NumPy arrays.
+    The version valid at each reading timestamp, not the tess_id the
+    reading was stored with, gives its zero point, so that readings
+    taken after a retroactive calibration get the new one.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, macs: List[str]):
+        macs = sorted(set(macs))
+        params = ",".join("?" * len(macs))
+        rows = connection.execute(VERSIONS_SQL.format(macs=params), macs).fetchall()
+        index = {mac: i for i, mac in enumerate(macs)}
+        self.macs = macs
+        self.mac_index = np.array([index[row[0]] for row in rows], dtype=np.int64)
+        self.tess_id = np.array([row[1] for row in rows], dtype=np.int64)
+        self.zero_point = np.array([row[2] for row in rows], dtype=np.float64)
+        self.since = np.array([tstamp_key(row[0], row[3]) for row in rows], dtype=np.int64)
+        self.until = np.array([tstamp_key(row[0], row[4]) for row in rows], dtype=np.int64)
+        self.keys = self.mac_index * MAC_STRIDE + self.since
+        # tess_id -> mac_index lookup table
+        self.lookup = np.full(int(self.tess_id.max(initial=0)) + 1, -1, dtype=np.int64)
+        self.lookup[self.tess_id] = self.mac_index
+
+    def __len__(self) -> int:
+        return len(self.tess_id)
+
+    def versions(self, tess_id: np.ndarray, tstamp: np.ndarray) -> np.ndarray:
+        """Index of the version valid at each (tess_id, tstamp), -1 if there is none or it has no zero point"""
+        mac_index = self.lookup[tess_id]
+        i = np.searchsorted(self.keys, mac_index * MAC_STRIDE + tstamp, side="right") - 1
+        j = np.maximum(i, 0)
+        valid = (i >= 0) & (mac_index >= 0) & (self.mac_index[j] == mac_index) & (tstamp < self.until[j])
+        valid &= ~np.isnan(self.zero_point[j])
+        return np.where(valid, i, -1)
+
+
+class Recomputer:
+    """
+    Recomputes stored magnitudes as ZP - 2.5*log10(frequency) chunk by chunk:
+    readings are read in rowid chunks into arrays, recomputed vectorized and
+    only those that differ are written back with a single executemany per chunk.
+    Magnitude deltas (new - old) are accumulated per version,
+    readings without a previous magnitude count as a zero delta.
+
+        recomputer = Recomputer(connection, zero_points, condition, row)
+        with Progress(connection, "recompute") as progress:
+            recomputer.run(progress)
+        for mac, tess_id, zp, first, last, count, dmin, dmax, dmean in recomputer.summary(): ...
+    """
+
+    def __init__(self, connection: sqlite3.Connection, zero_points: ZeroPoints, condition: str, row: dict):
+        self.connection = connection
+        self.zero_points = zero_points
+        self.where = READINGS_WHERE.format(date_range=DATE_RANGE, condition=condition)
+        self.sql = READINGS_SQL.format(where=self.where)
+        self.row = row
+        n = len(zero_points)
+        self.count = np.zeros(n, dtype=np.int64)
+        self.first = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+        self.last = np.full(n, -1, dtype=np.int64)
+        self.dsum = np.zeros(n, dtype=np.float64)
+        self.dmin = np.full(n, np.inf, dtype=np.float64)
+        self.dmax = np.full(n, -np.inf, dtype=np.float64)
+        self.skipped = 0  # readings without a valid version or a positive frequency
+
+    def chunk(self, rows: List[tuple]) -> int:
+        """Recomputes one chunk of (rowid, tess_id, tstamp, frequency, magnitude). Returns rows changed"""
+        if not rows:
+            return 0
+        rowid, tess_id, tstamp, frequency, magnitude = zip(*rows)
+        rowid = np.array(rowid, dtype=np.int64)
+        tstamp = np.array(tstamp, dtype=np.int64)
+        frequency = np.array(frequency, dtype=np.float64)  # NULL -> nan
+        magnitude = np.array(magnitude, dtype=np.float64)
+        version = self.zero_points.versions(np.array(tess_id, dtype=np.int64), tstamp)
+        usable = (version >= 0) & (frequency > 0)
+        self.skipped += int(np.count_nonzero(~usable))
+        rowid, tstamp, frequency, magnitude, version = (
+            a[usable] for a in (rowid, tstamp, frequency, magnitude, version)
+        )
+        new = np.round(self.zero_points.zero_point[version] - 2.5 * np.log10(frequency), DECIMALS)
+        changed = ~(new == magnitude)  # also true where magnitude was NULL
+        rowid, tstamp, new, version = rowid[changed], tstamp[changed], new[changed], version[changed]
+        delta = np.where(np.isnan(magnitude[changed]), 0.0, new - magnitude[changed])
+        np.add.at(self.count, version, 1)
+        np.add.at(self.dsum, version, delta)
+        np.minimum.at(self.dmin, version, delta)
+        np.maximum.at(self.dmax, version, delta)
+        np.minimum.at(self.first, version, tstamp)
+        np.maximum.at(self.last, version, tstamp)
+        self.connection.executemany(UPDATE_SQL, zip(new.tolist(), rowid.tolist()))
+        return len(rowid)
+
+    def run(self, progress, table: str = "tess_readings_t") -> int:
+        """Scans the selected readings in progress.chunk_size rowid chunks. Returns rows changed"""
+        cursor = self.connection.cursor()
+        changed = 0
+        params = dict(self.row)
+        for lo, hi in progress.chunks(self.where, self.row, table):
+            params["lo"], params["hi"] = lo, hi
+            cursor.execute(self.sql, params)
+            n = self.chunk(cursor.fetchall())
+            changed += n
+            progress.update(n, hi - lo + 1)
+        return changed
+
+    def summary(self) -> List[Tuple[str, int, float, int, int, int, float, float, float]]:
+        """(mac, tess_id, zero point, first, last, rows changed, min, max, mean delta) per version with changes"""
+        zp = self.zero_points
+        result = list()
+        for i in np.flatnonzero(self.count):
+            result.append(
+                (
+                    zp.macs[zp.mac_index[i]],
+                    int(zp.tess_id[i]),
+                    float(zp.zero_point[i]),
+                    int(self.first[i]),
+                    int(self.last[i]),
+                    int(self.count[i]),
+                    round(float(self.dmin[i]), DECIMALS) + 0.0,
+                    round(float(self.dmax[i]), DECIMALS) + 0.0,
+                    round(float(self.dsum[i] / self.count[i]), DECIMALS + 1) + 0.0,
+                )
+            )
+        return result
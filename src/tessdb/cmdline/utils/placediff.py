@@ -0,0 +1,219 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import csv
+import json
+import math
+import sqlite3
+from collections import namedtuple
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# --------------
+# local imports
+# -------------
+
+from .geo import chord, haversine, unit_vector
+
+# ----------------
+# Module constants
+# ----------------
+
+# Registry export column aliases -> location_t columns
+ALIASES = {
+    "site": ("site", "name", "place", "place_name"),
+    "longitude": ("longitude", "lon", "lng", "long"),
+    "latitude": ("latitude", "lat"),
+    "location": ("location", "town", "city", "municipality", "village"),
+    "province": ("province", "state"),
+    "country": ("country",),
+    "timezone": ("timezone", "tzone", "tz"),
+    "organization": ("organization", "org"),
+}
+
+# Metadata compared when known on both sides
+METADATA = ("location", "province", "country", "timezone", "organization")
+
+UNKNOWNS = ("", "unknown", "none", "null")
+
+SITES_SQL = """
+    SELECT location_id, site, longitude, latitude, location, province, country, timezone, organization
+    FROM location_t
+    WHERE location_id >= 0
+    """
+
+MISSING_REGISTRY = "Missing in registry"
+MISSING_TESSDB = "Missing in tessdb"
+RENAMED = "Different name"
+COORDINATES = "Coordinates"
+METADATA_ISSUE = "Metadata"
+DUPLICATE = "Duplicate in registry"
+
+Difference = namedtuple(
+    "Difference", ["issue", "site", "registry_site", "location_id", "field", "tessdb", "registry", "distance"]
+)
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+
+def _normalize(record: Dict[str, object]) -> Optional[Dict[str, object]]:
+    keys = {k.lower(): v for k, v in record.items()}
+    place = dict()
+    for column, aliases in ALIASES.items():
+        place[column] = next((keys[a] for a in aliases if keys.get(a) not in (None, "")), None)
+    if place["site"] is None:
+        return None
+    place["site"] = str(place["site"]).strip()
+    for column in ("longitude", "latitude"):
+        try:
+            place[column] = float(place[column])
+        except (TypeError, ValueError):
+            place[column] = None
+    return place
+
+
+def read_registry(path: str) -> List[Dict[str, object]]:
+    """
+    Places from a registry export: a CSV file, a JSON array or JSON lines,
+    with flat keys named as in location_t or common aliases (name, lat, lon, town...)
+    """
+    with open(path, newline="") as fd:
+        if path.endswith(".csv"):
+            records = list(csv.DictReader(fd))
+        else:
+            text = fd.read()
+            try:
+                records = json.loads(text)
+            except ValueError:
+                records = [json.loads(line) for line in text.splitlines() if line.strip()]
+    return [place for place in map(_normalize, records) if place is not None]
+
+
+def load_sites(connection: sqlite3.Connection) -> List[Dict[str, object]]:
+    columns = ("location_id", "site") + tuple(ALIASES)[1:]
+    sites = list()
+    for row in connection.execute(SITES_SQL):
+        site = dict(zip(columns, row))
+        for column in ("longitude", "latitude"):
+            if not isinstance(site[column], (int, float)):
+                site[column] = None
+        sites.append(site)
+    return sites
+
+
+def _known(value: object) -> bool:
+    return value is not None and str(value).strip().lower() not in UNKNOWNS
+
+
+def _located(place: Dict[str, object]) -> bool:
+    return place["longitude"] is not None and place["latitude"] is not None
+
+
+def _cell(place: Dict[str, object], size: float) -> Optional[Tuple[int, int, int]]:
+    """3D grid cell of the unit sphere vector, as in geo.near_pairs()"""
+    if not _located(place):
+        return None
+    return tuple(int(math.floor(c / size)) for c in unit_vector(place["longitude"], place["latitude"]))
+
+
+def _distance(a: Dict[str, object], b: Dict[str, object]) -> float:
+    if not _located(a) or not _located(b):
+        return math.inf
+    return haversine(a["longitude"], a["latitude"], b["longitude"], b["latitude"])
+
+
+def _coordinates(place: Dict[str, object]) -> str:
+    return "%s,%s" % (place["longitude"], place["latitude"])
+
+
+def _compare(ours: Dict[str, object], theirs: Dict[str, object], tolerance: float) -> Iterator[Difference]:
+    distance = _distance(ours, theirs)
+    if math.isfinite(distance) and distance > tolerance:
+        yield Difference(
+            COORDINATES,
+            ours["site"],
+            theirs["site"],
+            ours["location_id"],
+            "longitude,latitude",
+            _coordinates(ours),
+            _coordinates(theirs),
+            round(distance, 1),
+        )
+    for field in METADATA:
+        a, b = ours[field], theirs[field]
+        if _known(a) and _known(b) and str(a).strip().casefold() != str(b).strip().casefold():
+            yield Difference(METADATA_ISSUE, ours["site"], theirs["site"], ours["location_id"], field, a, b, None)
+
+
+def diff(sites: List[Dict[str, object]], registry: List[Dict[str, object]], tolerance: float) -> List[Difference]:
+    """
+    Hash join of both sides, linear in their sizes: first on site name,
+    then the unmatched ones on coordinate grid cells within tolerance meters
+    to pair renamed places, then the rest is missing on the other side.
+    Registry names given to several places are reported once each and a
+    site of that name is compared with the closest of them.
+    """
+    differences = list()
+    by_name: Dict[str, List[Dict[str, object]]] = dict()
+    for place in registry:
+        by_name.setdefault(place["site"], list()).append(place)
+    for name, places in by_name.items():
+        if len(places) > 1:
+            differences.append(
+                Difference(DUPLICATE, None, name, None, "site", None, " ".join(map(_coordinates, places)), None)
+            )
+    unmatched = list()
+    for site in sites:
+        places = by_name.get(site["site"])
+        if not places:
+            unmatched.append(site)
+            continue
+        theirs = min(places, key=lambda c: _distance(site, c))
+        places.remove(theirs)
+        differences.extend(_compare(site, theirs, tolerance))
+    remaining = [place for places in by_name.values() for place in places]
+    size = chord(tolerance)
+    cells: Dict[Tuple[int, int, int], List[Dict[str, object]]] = dict()
+    for place in remaining:
+        cell = _cell(place, size)
+        if cell is not None:
+            cells.setdefault(cell, list()).append(place)
+    offsets = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)]
+    paired = set()
+    for site in unmatched:
+        cell = _cell(site, size)
+        candidates = list()
+        if cell is not None:
+            for dx, dy, dz in offsets:
+                candidates.extend(cells.get((cell[0] + dx, cell[1] + dy, cell[2] + dz), ()))
+        candidates = [c for c in candidates if id(c) not in paired and _distance(site, c) <= tolerance]
+        if not candidates:
+            differences.append(
+                Difference(
+                    MISSING_REGISTRY, site["site"], None, site["location_id"], "longitude,latitude", _coordinates(site), None, None
+                )
+            )
+            continue
+        theirs = min(candidates, key=lambda c: _distance(site, c))
+        paired.add(id(theirs))
+        differences.append(
+            Difference(
+                RENAMED, site["site"], theirs["site"], site["location_id"], "site", site["site"], theirs["site"],
+                round(_distance(site, theirs), 1),
+            )
+        )
+        differences.extend(_compare(site, theirs, tolerance))
+    for place in remaining:
+        if id(place) not in paired:
+            differences.append(
+                Difference(MISSING_TESSDB, None, place["site"], None, "longitude,latitude", None, _coordinates(place), None)
+            )
+    return differences
@@ -0,0 +1,199 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import sys
+import time
+import sqlite3
+import datetime
+from typing import Callable, Iterator, Optional, Tuple
+
+# --------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+# Rowids scanned per chunk statement
+CHUNK_SIZE = 200000
+
+# SQLite VM instructions between progress handler calls
+OPCODES = 100000
+
+# Seconds between display refreshes
+PERIOD = 1.0
+
+# Readings filter term on the primary key (date_id, time_id, tess_id) for
+# :start_date and :end_date YYYYMMDDHHMMSS integers. The exact bounds test on
+# (date_id*1000000 + time_id) cannot use the index, this one can.
+DATE_RANGE = "date_id BETWEEN :start_date / 1000000 AND :end_date / 1000000"
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+
+def hms(seconds: float) -> str:
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+class Progress:
+    """
+    Progress report, ETA and time limit for long running mutations.
+
+    Mutations are run in rowid chunks inside a single transaction. Chunks
+    only span the rowids of the rows matching the mutation filter, whose
+    bounds are found through the table indexes. A SQLite
+    progress handler keeps the display alive and enforces the time limit
+    within a chunk. When the time limit is exceeded or Ctrl-C is pressed,
+    the transaction is rolled back and the partial work is reported.
+
+        with Progress(connection, "purge", options.max_time) as progress:
+            progress.execute("DELETE ... WHERE tess_id == :tess_id AND rowid BETWEEN :lo AND :hi", row, "tess_id == :tess_id")
+            connection.commit()
+    """
+
+    def __init__(
+        self,
+        connection: sqlite3.Connection,
+        label: str,
+        max_time: Optional[float] = None,
+        chunk_size: int = CHUNK_SIZE,
+    ):
+        self.connection = connection
+        self.label = label
+        self.max_time = max_time
+        self.chunk_size = chunk_size
+        self.total = 0  # rowids to scan
+        self.scanned = 0  # rowids scanned so far
+        self.changed = 0  # rows changed so far
+        self.committed = 0  # rows changed and already committed chunk by chunk
+        self.aborted = None  # None, "time" or "user"
+
+    def __enter__(self) -> "Progress":
+        self.t0 = time.monotonic()
+        self.last = self.t0
+        self.deadline = None if self.max_time is None else self.t0 + self.max_time
+        self.connection.set_progress_handler(self._handler, OPCODES)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.connection.set_progress_handler(None, 0)
+        if exc_type is None:
+            self._display(time.monotonic(), end="\n")
+            return False
+        self.connection.rollback()
+        if exc_type is KeyboardInterrupt:
+            self.aborted = "user"
+        self._display(time.monotonic(), end="\n")
+        if self.committed:
+            rolled = "%d rows already committed, the rest rolled back." % (self.committed,)
+        else:
+            rolled = "All changes rolled back."
+        print(
+            "%s aborted after %s: %d rows changed in %d of %d rowids scanned. %s"
+            % (self.label, hms(time.monotonic() - self.t0), self.changed, self.scanned, self.total, rolled)
+        )
+        if self.aborted == "time":
+            raise TimeoutError("Time limit of %s seconds exceeded" % (self.max_time,)) from None
+        if self.aborted == "user" and exc_type is not KeyboardInterrupt:
+            raise KeyboardInterrupt() from None
+        return False
+
+    def _handler(self) -> int:
+        try:
+            now = time.monotonic()
+            if self.deadline is not None and now > self.deadline:
+                self.aborted = "time"
+                return 1
+            if now - self.last >= PERIOD:
+                self._display(now)
+            return 0
+        except KeyboardInterrupt:
+            self.aborted = "user"
+            return 1
+
+    def _display(self, now: float, end: str = "") -> None:
+        self.last = now
+        elapsed = max(now - self.t0, 1e-6)
+        rate = self.scanned / elapsed
+        if self.total and rate:
+            eta = hms((self.total - self.scanned) / rate)
+            percent = 100.0 * self.scanned / self.total
+        else:
+            eta = "--:--:--"
+            percent = 0.0
+        sys.stdout.write(
+            "\r%s: %d/%d rows scanned (%.1f%%), %d changed, %.0f rows/s, elapsed %s, ETA %s%s"
+            % (self.label, self.scanned, self.total, percent, self.changed, rate, hms(elapsed), eta, end)
+        )
+        sys.stdout.flush()
+
+    def update(self, changed: int, scanned: int) -> None:
+        self.changed += changed
+        self.scanned += scanned
+        now = time.monotonic()
+        if self.deadline is not None and now > self.deadline:
+            self.aborted = "time"
+            raise TimeoutError()
+        if now - self.last >= PERIOD:
+            self._display(now)
+
+    def chunks(self, where: str, row: dict, table: str = "tess_readings_t") -> Iterator[Tuple[int, int]]:
+        """
+        (lo, hi) rowid chunks covering the rows of table matching where,
+        with its named parameters in row. Their total is added to the scan.
+        """
+        cursor = self.connection.execute("SELECT MIN(rowid), MAX(rowid) FROM %s WHERE %s" % (table, where), row)
+        lo, hi = cursor.fetchone()
+        if lo is None:
+            return
+        self.total += hi - lo + 1
+        for start in range(lo, hi + 1, self.chunk_size):
+            yield start, min(start + self.chunk_size - 1, hi)
+
+    def execute(
+        self,
+        sql: str,
+        row: dict,
+        where: str,
+        table: str = "tess_readings_t",
+        collect: Optional[Callable] = None,
+        commit: bool = False,
+    ) -> int:
+        """
+        Executes a mutation over table in rowid chunks.
+        where is the mutation filter on table, which bounds the chunks.
+        The statement must restrict itself with where and 'rowid BETWEEN :lo AND :hi'.
+        If collect is given, the statement has a RETURNING clause and
+        collect is called with the rows returned by each chunk.
+        If commit is True, each chunk is committed so that the write lock
+        is released between chunks and other writers stay live.
+        Returns the number of rows changed.
+        """
+        cursor = self.connection.cursor()
+        changed = 0
+        params = dict(row)
+        for lo, hi in self.chunks(where, row, table):
+            params["lo"], params["hi"] = lo, hi
+            cursor.execute(sql, params)
+            if collect is None:
+                n = cursor.rowcount
+            else:
+                rows = cursor.fetchall()
+                collect(rows)
+                n = len(rows)
+            changed += n
+            if commit:
+                self.connection.commit()
+                self.committed += n
+            self.update(n, hi - lo + 1)
+        return changed
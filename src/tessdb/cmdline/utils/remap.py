@@ -0,0 +1,259 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import sqlite3
+import itertools
+from typing import Callable, Dict, List, Optional, Tuple
+
+# --------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+MAP_TABLE = "remap_t"
+
+# Open time window bounds, as (date_id*1000000 + time_id)
+MIN_TSTAMP = 0
+MAX_TSTAMP = 99991231235959
+
+REMAP_SQL = """
+    UPDATE {table} AS r
+    SET {column} = m.new_id
+    FROM temp.{map} AS m
+    WHERE r.{column} == m.old_id
+    AND (r.date_id*1000000 + r.time_id) BETWEEN m.since AND m.until
+    {condition}
+    {chunk}
+    {returning}
+    """
+
+# Rows the mappings will change, found through an index on the remapped
+# column, to size the progress of an indexed apply() before it starts.
+TOTAL_SQL = """
+    SELECT COUNT(*)
+    FROM {table} AS r
+    JOIN temp.{map} AS m ON r.{column} == m.old_id
+    WHERE (r.date_id*1000000 + r.time_id) BETWEEN m.since AND m.until
+    {condition}
+    """
+
+# Rows of the readings table that some mapping may change, to bound the chunks.
+# The date_id range lets SQLite use the readings primary key for time windows.
+FILTER_SQL = """
+    {column} IN (SELECT old_id FROM temp.{map})
+    AND date_id BETWEEN {first} AND {last}
+    {condition}
+    """
+
+# Next chunk of rows to change, found through an index on the remapped column.
+# Changed rows no longer match, so each chunk picks up where the previous one ended.
+KEY_CHUNK_SQL = """
+    AND r.rowid IN (
+        SELECT s.rowid FROM {table} AS s
+        JOIN temp.{map} AS n ON s.{column} == n.old_id
+        WHERE (s.date_id*1000000 + s.time_id) BETWEEN n.since AND n.until
+        {condition}
+        LIMIT :size
+    )
+    """
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+
+class Remapper:
+    """
+    Rewrites a foreign key (tess_id or location_id) of the readings table
+    for many (old_id -> new_id, optional time window) pairs at once.
+
+    The pairs are loaded into an indexed TEMP table and applied with a single
+    set based UPDATE ... FROM, chunked by rowid when a Progress is given,
+    so that all corrections share one scan of the rowid span of the
+    readings they may change.
+    Changed rows are tallied per new_id from the UPDATE's own RETURNING rows,
+    which only hold new values, and only added to the summary once their
+    chunk is committed (or the whole apply() is over), so that an aborted
+    run does not report rolled back rows.
+
+        remapper = Remapper(connection, "tess_id")
+        remapper.add(old_id, new_id)
+        remapper.add(other_id, new_id, since=20230101000000)
+        with Progress(connection, "remap") as progress:
+            remapper.apply(progress)
+        for old_ids, new_id, first, last, count in remapper.summary(): ...
+    """
+
+    def __init__(self, connection: sqlite3.Connection, column: str, table: str = "tess_readings_t"):
+        self.connection = connection
+        self.column = column
+        self.table = table
+        self.mappings = list()  # (old_id, new_id, since, until)
+        self.counts = dict()  # new_id -> [count, min date_id, max date_id]
+
+    def __len__(self) -> int:
+        return len(self.mappings)
+
+    def add(self, old_id: int, new_id: int, since: Optional[int] = None, until: Optional[int] = None) -> None:
+        """
+        Adds an old_id -> new_id mapping, restricted to readings within [since, until]
+        (YYYYMMDDHHMMSS integers) if given. Windows for the same old_id must not overlap
+        and mappings must not chain (a -> b, b -> c), as rows already remapped to b
+        by one chunk would be remapped again to c by the next one.
+        """
+        since = MIN_TSTAMP if since is None else since
+        until = MAX_TSTAMP if until is None else until
+        for other_old, other_new, other_since, other_until in self.mappings:
+            if other_new == old_id or other_old == new_id:
+                raise ValueError(
+                    "Chained %s remapping: %s -> %s and %s -> %s" % (self.column, other_old, other_new, old_id, new_id)
+                )
+            if other_old == old_id and since <= other_until and other_since <= until:
+                raise ValueError(
+                    "Overlapping %s remapping windows for %s: %s -> %s and %s -> %s"
+                    % (self.column, old_id, other_new, (other_since, other_until), new_id, (since, until))
+                )
+        self.mappings.append((old_id, new_id, since, until))
+
+    def _count(self, counts: Dict[int, List[int]]) -> None:
+        for new_id, (count, first, last) in counts.items():
+            c = self.counts.setdefault(new_id, [0, first, last])
+            c[0] += count
+            c[1] = min(c[1], first)
+            c[2] = max(c[2], last)
+
+    def load(self) -> None:
+        """Loads the mappings into the TEMP table"""
+        self.connection.execute("DROP TABLE IF EXISTS temp.%s" % (MAP_TABLE,))
+        self.connection.execute(
+            """
+            CREATE TEMP TABLE %s (
+                mapping_id INTEGER PRIMARY KEY,
+                old_id     INTEGER NOT NULL,
+                new_id     INTEGER NOT NULL,
+                since      INTEGER NOT NULL,
+                until      INTEGER NOT NULL
+            )
+            """ % (MAP_TABLE,)
+        )
+        self.connection.execute("CREATE INDEX temp.%s_old_id_i ON %s (old_id)" % (MAP_TABLE, MAP_TABLE))
+        self.connection.executemany(
+            "INSERT INTO temp.%s (mapping_id, old_id, new_id, since, until) VALUES (?,?,?,?,?)" % (MAP_TABLE,),
+            [(i,) + mapping for i, mapping in enumerate(self.mappings)],
+        )
+
+    def drop(self) -> None:
+        self.connection.execute("DROP TABLE IF EXISTS temp.%s" % (MAP_TABLE,))
+
+    def apply(
+        self,
+        progress=None,
+        condition: str = "",
+        row: Optional[dict] = None,
+        collect: Optional[Callable] = None,
+        commit: bool = False,
+        key: Optional[str] = None,
+        indexed: bool = False,
+    ) -> int:
+        """
+        Loads and applies all mappings. condition is an extra SQL condition on
+        the readings with its named parameters in row. If collect is given,
+        it receives the (key, date_id) of the updated readings as in DryRun.collect(),
+        key being the remapped column unless given.
+        Without progress, the whole table is updated with a single statement.
+        With progress, the table is updated in rowid chunks or, if indexed,
+        in chunks of progress.chunk_size rows found through an index on the
+        remapped column, which only visit the rows that change.
+        With progress and commit, each chunk is committed as in Progress.execute().
+        Returns the number of rows changed.
+        """
+        if not self.mappings:
+            return 0
+        self.load()
+        fields = dict(
+            table=self.table,
+            column=self.column,
+            map=MAP_TABLE,
+            condition="AND " + condition if condition else "",
+        )
+        if progress is None:
+            fields["chunk"] = ""
+        elif indexed:
+            fields["chunk"] = KEY_CHUNK_SQL.format(**fields)
+        else:
+            fields["chunk"] = "AND r.rowid BETWEEN :lo AND :hi"
+        sql = REMAP_SQL.format(returning="RETURNING %s, %s, date_id" % (self.column, key or self.column), **fields)
+        row = row or {}
+        params = dict(row)
+        if progress is None:
+            chunks = [None]
+        elif indexed:
+            params["size"] = progress.chunk_size
+            progress.total += self.connection.execute(TOTAL_SQL.format(**fields), params).fetchone()[0]
+            chunks = itertools.repeat(None)
+        else:
+            where = FILTER_SQL.format(
+                column=self.column,
+                map=MAP_TABLE,
+                first=min(since for _, _, since, _ in self.mappings) // 1000000,
+                last=max(until for _, _, _, until in self.mappings) // 1000000,
+                condition="AND " + condition if condition else "",
+            )
+            chunks = progress.chunks(where, row, self.table)
+        cursor = self.connection.cursor()
+        changed = 0
+        pending = dict()  # new_id -> [count, min date_id, max date_id] of the chunks not yet committed
+        for chunk in chunks:
+            if chunk is not None:
+                params["lo"], params["hi"] = chunk
+            rows = cursor.execute(sql, params).fetchall()
+            n = len(rows)
+            if indexed and n == 0:
+                break
+            for new_id, _, date_id in rows:
+                c = pending.get(new_id)
+                if c is None:
+                    pending[new_id] = [1, date_id, date_id]
+                else:
+                    c[0] += 1
+                    c[1] = min(c[1], date_id)
+                    c[2] = max(c[2], date_id)
+            if collect is not None:
+                collect([(k, date_id) for _, k, date_id in rows])
+            changed += n
+            if progress is not None:
+                if commit:
+                    self.connection.commit()
+                    progress.committed += n
+                    self._count(pending)
+                    pending = dict()
+                progress.update(n, n if indexed else chunk[1] - chunk[0] + 1)
+        self._count(pending)
+        self.drop()
+        return changed
+
+    def summary(self) -> List[Tuple[Tuple[int, ...], int, Optional[int], Optional[int], int]]:
+        """
+        (old_ids, new_id, first date_id, last date_id, rows changed) per new_id, in mapping order.
+        RETURNING only sees the new values, so rows are tallied per new_id and not per mapping.
+        """
+        targets = dict()
+        for old_id, new_id, _, _ in self.mappings:
+            old_ids = targets.setdefault(new_id, list())
+            if old_id not in old_ids:
+                old_ids.append(old_id)
+        result = list()
+        for new_id, old_ids in targets.items():
+            count, first, last = self.counts.get(new_id, (0, None, None))
+            result.append((tuple(old_ids), new_id, first, last, count))
+        return result
@@ -0,0 +1,104 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import sqlite3
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+# --------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+NAMES_SQL = """
+    SELECT name, mac_address, valid_since, valid_until, valid_state
+    FROM name_to_mac_t
+    ORDER BY mac_address, valid_since
+    """
+
+Assignment = namedtuple("Assignment", ["name", "mac", "valid_since", "valid_until", "valid_state"])
+Transition = namedtuple("Transition", ["when", "mac", "old_name", "new_name"])
+FreeTag = namedtuple("FreeTag", ["name", "mac", "valid_since", "valid_until", "valid_state"])
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+
+def name_key(name: str) -> tuple:
+    """Natural order for 'starsNNN' names, as CAST(substr(name, 6) as decimal) in SQL"""
+    try:
+        return (0, int(name[5:]), name)
+    except ValueError:
+        return (1, 0, name)
+
+
+class RenameGraph:
+    """
+    name <-> MAC assignment chains built from name_to_mac_t sorted once.
+
+        by_mac:      MAC  -> assignments ordered by valid_since
+        by_name:     name -> assignments ordered by valid_since
+        transitions: consecutive renamings of the same MAC, in time order
+        free_tags:   names no longer assigned to any MAC
+        reassigned:  names that have been assigned to more than one MAC
+    """
+
+    def __init__(self, connection: sqlite3.Connection, current: str):
+        self.by_mac = dict()
+        self.by_name = dict()
+        self.transitions = list()
+        previous = None
+        for row in connection.execute(NAMES_SQL):
+            assignment = Assignment(*row)
+            self.by_mac.setdefault(assignment.mac, list()).append(assignment)
+            self.by_name.setdefault(assignment.name, list()).append(assignment)
+            if previous is not None and previous.mac == assignment.mac and previous.name != assignment.name:
+                self.transitions.append(Transition(assignment.valid_since, assignment.mac, previous.name, assignment.name))
+            previous = assignment
+        for assignments in self.by_name.values():
+            assignments.sort(key=lambda a: a.valid_since)
+        self.transitions.sort()
+        self.free_tags = list()
+        for name, assignments in self.by_name.items():
+            if all(a.valid_state != current for a in assignments):
+                last = assignments[-1]
+                self.free_tags.append(FreeTag(name, last.mac, assignments[0].valid_since, last.valid_until, last.valid_state))
+        self.free_tags.sort(key=lambda tag: name_key(tag.name))
+        self.reassigned = sorted(
+            (name for name, assignments in self.by_name.items() if len(set(a.mac for a in assignments)) > 1),
+            key=name_key,
+        )
+
+    def summary(self, since: Optional[str] = None) -> List[Transition]:
+        return [t for t in self.transitions if since is None or t.when >= since]
+
+    def names(self, since: Optional[str] = None) -> List[Assignment]:
+        """Assignment history of names with more than one assignment changing since the given date"""
+        return self._history(self.by_name, since, key=name_key)
+
+    def macs(self, since: Optional[str] = None) -> List[Assignment]:
+        """Assignment history of MACs with more than one assignment changing since the given date"""
+        return self._history(self.by_mac, since)
+
+    def anonymous(self, since: Optional[str] = None) -> List[FreeTag]:
+        """Names freed since the given date"""
+        return [tag for tag in self.free_tags if since is None or tag.valid_until >= since]
+
+    def _history(self, chains: Dict[str, List[Assignment]], since: Optional[str], key=None) -> List[Assignment]:
+        result = list()
+        for k in sorted(chains, key=key):
+            assignments = chains[k]
+            if len(assignments) > 1 and (since is None or assignments[-1].valid_since >= since):
+                result.extend(assignments)
+        return result
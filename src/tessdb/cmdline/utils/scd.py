@@ -0,0 +1,172 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import sqlite3
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+# --------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+# tess_t and name_to_mac_t are slowly changing dimensions: per key, versions
+# ordered by valid_since must chain (valid_until == next valid_since),
+# only the last one may be 'Current' and only a 'Current' one may end at
+# INFINITE_TIME. Each table is checked in a single sorted window function pass.
+# A key may pass from one owner to another (i.e. a name freed by a MAC and
+# later given to another one), so gaps are only checked within one owner.
+
+OVERLAP = "Overlap"
+GAP = "Gap"
+CURRENTS = "Several current"
+CURRENT_NOT_LAST = "Current not last"
+EXPIRED_INFINITE = "Expired ends at infinite"
+ORPHAN = "Orphan name"
+
+CHECK_SQL = """
+    SELECT * FROM (
+        SELECT {key} AS key, rowid AS id, valid_since, valid_until, valid_state,
+            LAG(valid_until)  OVER w AS prev_until,
+            LEAD(valid_since) OVER w AS next_since,
+            LAG({owner}) OVER w IS {owner} AS same_owner,
+            SUM(valid_state == :current) OVER (PARTITION BY {key}) AS currents,
+            {orphan} AS orphan
+        FROM {table}
+        WINDOW w AS (PARTITION BY {key} ORDER BY valid_since, rowid)
+    )
+    WHERE prev_until != valid_since
+    OR    currents > 1
+    OR    (valid_state == :current AND next_since IS NOT NULL)
+    OR    (valid_state == :expired AND valid_until == :infinite)
+    OR    orphan
+    ORDER BY key, valid_since
+    """
+
+ORPHAN_SQL = "NOT EXISTS (SELECT 1 FROM tess_t AS t WHERE t.mac_address == {table}.mac_address)"
+
+# Repairs, all set based over the same window. Chaining ends each version
+# where the next one starts: always when they overlap and, when asked to,
+# also across a gap, stretching the version over it.
+CHAIN_FIX_SQL = """
+    UPDATE {table} SET valid_until = w.next_since
+    FROM (
+        SELECT rowid AS id, LEAD(valid_since) OVER (PARTITION BY {key} ORDER BY valid_since, rowid) AS next_since
+        FROM {table}
+    ) AS w
+    WHERE {table}.rowid == w.id
+    AND w.next_since IS NOT NULL
+    AND {table}.valid_until {mismatch} w.next_since
+    """
+
+STATE_FIX_SQL = """
+    UPDATE {table} SET valid_state = :expired
+    FROM (
+        SELECT rowid AS id, LEAD(valid_since) OVER (PARTITION BY {key} ORDER BY valid_since, rowid) AS next_since
+        FROM {table}
+    ) AS w
+    WHERE {table}.rowid == w.id
+    AND w.next_since IS NOT NULL
+    AND {table}.valid_state == :current
+    """
+
+LAST_FIX_SQL = """
+    UPDATE {table} SET valid_state = :current
+    FROM (
+        SELECT rowid AS id, LEAD(valid_since) OVER (PARTITION BY {key} ORDER BY valid_since, rowid) AS next_since
+        FROM {table}
+    ) AS w
+    WHERE {table}.rowid == w.id
+    AND w.next_since IS NULL
+    AND {table}.valid_state == :expired
+    AND {table}.valid_until == :infinite
+    """
+
+ORPHAN_FIX_SQL = "DELETE FROM name_to_mac_t WHERE " + ORPHAN_SQL.format(table="name_to_mac_t")
+
+Issue = namedtuple("Issue", ["table", "key", "issue", "id", "valid_since", "valid_until", "valid_state"])
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+
+def check(
+    connection: sqlite3.Connection,
+    table: str,
+    key: str,
+    row: dict,
+    orphans: bool = False,
+    owner: Optional[str] = None,
+) -> List[Issue]:
+    """
+    Single pass consistency check of a SCD table partitioned by key.
+    row holds the :current, :expired and :infinite parameters.
+    If owner is given, a change of owner column between consecutive
+    versions is not reported as a gap.
+    """
+    orphan = ORPHAN_SQL.format(table=table) if orphans else "0"
+    sql = CHECK_SQL.format(table=table, key=key, orphan=orphan, owner=owner or key)
+    issues = list()
+    reported = set()  # keys already reported with several current rows
+    for key_value, id, since, until, state, prev_until, next_since, same_owner, currents, orphan in connection.execute(sql, row):
+        kinds = list()
+        if prev_until is not None and prev_until > since:
+            kinds.append(OVERLAP)
+        elif prev_until is not None and prev_until < since and same_owner:
+            kinds.append(GAP)
+        if currents > 1 and key_value not in reported:
+            reported.add(key_value)
+            kinds.append(CURRENTS)
+        if state == row["current"] and next_since is not None:
+            kinds.append(CURRENT_NOT_LAST)
+        if state == row["expired"] and until == row["infinite"]:
+            kinds.append(EXPIRED_INFINITE)
+        if orphan:
+            kinds.append(ORPHAN)
+        for kind in kinds:
+            issues.append(Issue("%s.%s" % (table, key), key_value, kind, id, since, until, state))
+    return issues
+
+
+def fix(
+    connection: sqlite3.Connection,
+    table: str,
+    key: str,
+    row: dict,
+    last_current: bool = False,
+    gaps: bool = True,
+) -> Dict[str, int]:
+    """
+    Bulk repairs: chains each version to the next one (fixes overlaps, expired
+    versions ending at infinite that have a successor and, if gaps, gaps),
+    expires 'Current' versions that are not the last one and, if last_current,
+    makes current a last expired version ending at infinite.
+    Returns rows changed per repair.
+    """
+    cursor = connection.cursor()
+    changes = dict()
+    cursor.execute(CHAIN_FIX_SQL.format(table=table, key=key, mismatch="!=" if gaps else ">"), row)
+    changes["chained"] = cursor.rowcount
+    cursor.execute(STATE_FIX_SQL.format(table=table, key=key), row)
+    changes["expired"] = cursor.rowcount
+    if last_current:
+        cursor.execute(LAST_FIX_SQL.format(table=table, key=key), row)
+        changes["made current"] = cursor.rowcount
+    return changes
+
+
+def fix_orphans(connection: sqlite3.Connection) -> int:
+    cursor = connection.cursor()
+    cursor.execute(ORPHAN_FIX_SQL)
+    return cursor.rowcount
@@ -0,0 +1,221 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import re
+import hashlib
+import sqlite3
+import unicodedata
+from collections import namedtuple
+from typing import List, Optional, Sequence, Tuple
+
+# --------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+FTS_TABLE = "location_fts"
+
+# Indexed location_t columns and their bm25() weights: a hit in the site name
+# counts more than one in the town, and much more than one in the country
+COLUMNS = ("site", "location", "province", "country", "organization")
+WEIGHTS = (10.0, 5.0, 2.0, 1.0, 2.0)
+
+FTS_SQL = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS main.{fts} USING fts5(
+        {columns},
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """
+
+# Documents are keyed by rowid == location_id. The 'Unknown' (-1) placeholder is not indexed
+REBUILD_SQL = """
+    DELETE FROM main.{fts};
+    INSERT INTO main.{fts} (rowid, {columns})
+    SELECT location_id, {columns} FROM main.location_t WHERE location_id >= 0;
+    """
+
+# The index keeps its own copy of the indexed columns, so it is stale exactly
+# when its documents differ from the location_t rows they were made from
+LAST_SQL = """
+    SELECT (SELECT MAX(location_id) FROM main.location_t WHERE location_id >= 0), (SELECT MAX(rowid) FROM main.{fts})
+    """
+ROWS_SQL = "SELECT location_id, {columns} FROM main.location_t WHERE location_id >= 0 ORDER BY location_id"
+DOCUMENTS_SQL = "SELECT rowid, {columns} FROM main.{fts} ORDER BY rowid"
+
+# Like the invalidation triggers, these are TEMP triggers: they only fire for
+# the CLI connection (create, import, update, rename, merge, delete...), keep
+# the index in the same transaction as the change and are rolled back with it.
+TRACK_SQL = """
+    CREATE TEMP TRIGGER IF NOT EXISTS location_insert_s AFTER INSERT ON main.location_t
+    WHEN NEW.location_id >= 0 BEGIN
+        INSERT INTO {fts} (rowid, {columns}) VALUES (NEW.location_id, {new});
+    END;
+    CREATE TEMP TRIGGER IF NOT EXISTS location_update_s AFTER UPDATE ON main.location_t BEGIN
+        DELETE FROM {fts} WHERE rowid = OLD.location_id;
+        INSERT INTO {fts} (rowid, {columns}) SELECT NEW.location_id, {new} WHERE NEW.location_id >= 0;
+    END;
+    CREATE TEMP TRIGGER IF NOT EXISTS location_delete_s AFTER DELETE ON main.location_t BEGIN
+        DELETE FROM {fts} WHERE rowid = OLD.location_id;
+    END;
+    """
+
+SEARCH_SQL = """
+    SELECT l.site, l.location_id, l.location, l.province, l.country, l.organization, bm25({fts}, {weights}) AS rank
+    FROM {fts} AS f
+    JOIN location_t AS l ON l.location_id = f.rowid
+    WHERE {fts} MATCH :query
+    ORDER BY rank
+    LIMIT :limit
+    """
+
+VOCABULARY_SQL = "SELECT term FROM temp.{fts}_vocab"
+
+Hit = namedtuple("Hit", ["site", "location_id", "location", "province", "country", "organization", "rank"])
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+
+def _format(sql: str) -> str:
+    return sql.format(
+        fts=FTS_TABLE,
+        columns=", ".join(COLUMNS),
+        new=", ".join("NEW." + c for c in COLUMNS),
+        weights=", ".join(map(str, WEIGHTS)),
+    )
+
+
+def exists(connection: sqlite3.Connection) -> bool:
+    return (
+        connection.execute(
+            "SELECT COUNT(*) FROM main.sqlite_master WHERE type == 'table' AND name == ?", (FTS_TABLE,)
+        ).fetchone()[0]
+        > 0
+    )
+
+
+def track(connection: sqlite3.Connection) -> None:
+    """Keeps the full text index up to date with this connection's location_t changes, if it exists"""
+    if exists(connection):
+        connection.executescript(_format(TRACK_SQL))
+
+
+def rebuild(connection: sqlite3.Connection) -> None:
+    """Creates the index table in the database, or fills it again from location_t"""
+    connection.execute(_format(FTS_SQL))
+    connection.executescript("BEGIN;" + _format(REBUILD_SQL) + "COMMIT;")
+    track(connection)
+
+
+def signature(connection: sqlite3.Connection, sql: str) -> Tuple[int, str]:
+    """Number and content hash of the rows of sql"""
+    digest = hashlib.sha1()
+    count = 0
+    for count, row in enumerate(connection.execute(_format(sql)), start=1):
+        digest.update(repr(row).encode("utf-8"))
+    return count, digest.hexdigest()
+
+
+def stale(connection: sqlite3.Connection) -> bool:
+    """
+    True if location_t was changed behind the index back (i.e. not through this CLI).
+    The highest ids tell new sites cheaply; deletions, renames and other
+    edits need comparing the content of both.
+    """
+    last_row, last_document = connection.execute(_format(LAST_SQL)).fetchone()
+    if last_row != last_document:
+        return True
+    return signature(connection, ROWS_SQL) != signature(connection, DOCUMENTS_SQL)
+
+
+def refresh(connection: sqlite3.Connection) -> bool:
+    """Rebuilds an existing but stale index. Returns True if rebuilt"""
+    if stale(connection):
+        rebuild(connection)
+        return True
+    return False
+
+
+def fold(text: str) -> str:
+    """Lower case and without diacritics, as the unicode61 tokenizer sees it"""
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def tokens(terms: Sequence[str]) -> List[str]:
+    return re.findall(r"\w+", fold(" ".join(terms)))
+
+
+def edit_distance(a: str, b: str, bound: int, prefix: bool = False) -> int:
+    """
+    Levenshtein distance from a to b (or to its closest prefix),
+    or bound + 1 as soon as it is known to exceed bound
+    """
+    if len(a) - len(b) > bound or (not prefix and len(b) - len(a) > bound):
+        return bound + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i]
+        for j, cb in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > bound:
+            return bound + 1
+        previous = current
+    return min(previous) if prefix else previous[-1]
+
+
+def _quote(term: str) -> str:
+    return '"%s"' % term.replace('"', '""')
+
+
+def _match(connection: sqlite3.Connection, query: str, limit: int) -> List[Hit]:
+    cursor = connection.execute(_format(SEARCH_SQL), {"query": query, "limit": limit})
+    return [Hit(*row[:-1], round(-row[-1], 3)) for row in cursor]
+
+
+def _similar(connection: sqlite3.Connection, token: str) -> List[str]:
+    bound = 1 if len(token) <= 5 else 2
+    connection.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS temp.%s_vocab USING fts5vocab(main, %s, row)" % (FTS_TABLE, FTS_TABLE)
+    )
+    return [
+        term
+        for term, in connection.execute(_format(VOCABULARY_SQL))
+        if edit_distance(token, term, bound, prefix=True) <= bound
+    ]
+
+
+def search(connection: sqlite3.Connection, terms: Sequence[str], limit: int = 20) -> Optional[List[Hit]]:
+    """
+    Best ranked sites matching all the terms as word prefixes. If none does,
+    each term is replaced by the indexed words within a small edit distance
+    of it (so 'granda' still finds 'Granada'), first requiring all the terms
+    and then any of them. Returns None if there are no searchable terms.
+    The index must have been created with rebuild() beforehand.
+    """
+    words = tokens(terms)
+    if not words:
+        return None
+    refresh(connection)
+    hits = _match(connection, " AND ".join(_quote(w) + "*" for w in words), limit)
+    if hits:
+        return hits
+    groups = list()
+    for word in words:
+        similar = _similar(connection, word)
+        if similar:
+            groups.append("(" + " OR ".join(_quote(t) for t in similar) + ")")
+    if not groups:
+        return []
+    return _match(connection, " AND ".join(groups), limit) or _match(connection, " OR ".join(groups), limit)
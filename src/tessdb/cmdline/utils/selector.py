@@ -0,0 +1,68 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import re
+import sqlite3
+from typing import Dict, List, Tuple
+
+# --------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+# Selector syntax: <column> <operator> <value>, i.e. "name GLOB stars1*"
+# The value is always passed as a bound parameter, never pasted into SQL.
+SELECTOR_RE = re.compile(r"^\s*(\w+)\s*(GLOB|LIKE|==|=|!=|<>)\s*(.+?)\s*$", re.IGNORECASE)
+
+SELECTION_TABLE = "selection_t"
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+
+def parse_selector(selector: str, columns: Dict[str, str]) -> Tuple[str, str, str]:
+    """
+    Parses a selector into (SQL column, SQL operator, value).
+    columns maps the user visible column names to SQL column names.
+    """
+    matchobj = SELECTOR_RE.match(selector)
+    if not matchobj:
+        raise ValueError("Invalid selector '%s'. Expected '<column> GLOB|LIKE|=|!= <value>'" % (selector,))
+    column, operator, value = matchobj.groups()
+    if column.lower() not in columns:
+        raise ValueError("Invalid selector column '%s'. Choose one of %s" % (column, ", ".join(sorted(columns))))
+    operator = operator.upper()
+    operator = {"=": "==", "<>": "!="}.get(operator, operator)
+    if len(value) > 1 and value[0] == value[-1] and value[0] in "'\"":
+        value = value[1:-1]
+    return columns[column.lower()], operator, value
+
+
+def read_names(path: str) -> List[str]:
+    """One name per line. Blank lines and '#' comments are ignored"""
+    names = list()
+    with open(path) as fd:
+        for line in fd:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                names.append(line)
+    return names
+
+
+def load_selection(connection: sqlite3.Connection, names: List[str]) -> str:
+    """Loads names into an indexed TEMP table and returns its qualified name for IN (SELECT ...)"""
+    connection.execute("DROP TABLE IF EXISTS temp.%s" % (SELECTION_TABLE,))
+    connection.execute("CREATE TEMP TABLE %s (name TEXT PRIMARY KEY) WITHOUT ROWID" % (SELECTION_TABLE,))
+    connection.executemany("INSERT OR IGNORE INTO temp.%s (name) VALUES (?)" % (SELECTION_TABLE,), [(name,) for name in names])
+    return "temp.%s" % (SELECTION_TABLE,)
@@ -0,0 +1,165 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import csv
+import json
+import sqlite3
+from typing import List, Optional, TextIO
+
+import numpy as np
+
+# --------------
+# local imports
+# -------------
+
+from .archive import federated_query
+
+# ----------------
+# Module constants
+# ----------------
+
+# Darkest (highest) magnitude per site and night, in a single grouped pass.
+# Nights run from local solar noon to noon: Julian days already start at
+# UTC noon, so the longitude only shifts them by 1 day per 360 degrees.
+# The date_id range lets SQLite use the readings primary key.
+# Site coordinates come along, as archived sites are no longer in the live location_t.
+NIGHTLY_SQL = """
+    SELECT r.location_id,
+        CAST(julianday(d.sql_date)
+            + ((r.time_id / 10000) * 3600 + (r.time_id / 100 % 100) * 60 + r.time_id % 100) / 86400.0
+            + l.longitude / 360.0 AS INTEGER) AS night,
+        MAX(r.magnitude), l.longitude, l.latitude
+    FROM {readings} AS r
+    JOIN date_t AS d ON d.date_id = r.date_id
+    JOIN location_t AS l ON l.location_id = r.location_id
+    WHERE r.date_id BETWEEN :start_day AND :end_day
+    AND (r.date_id*1000000 + r.time_id) BETWEEN :start_date AND :end_date
+    AND r.location_id >= 0
+    AND r.magnitude > 0
+    AND typeof(l.longitude) IN ('real', 'integer')
+    AND typeof(l.latitude)  IN ('real', 'integer')
+    GROUP BY r.location_id, night
+    """
+
+DTYPE = [
+    ("location_id", np.int64),
+    ("night", np.int64),
+    ("magnitude", np.float64),
+    ("longitude", np.float64),
+    ("latitude", np.float64),
+]
+
+CSV_HEADERS = (
+    "longitude_min",
+    "latitude_min",
+    "longitude_max",
+    "latitude_max",
+    "sites",
+    "nights",
+    "magnitude_mean",
+    "magnitude_min",
+    "magnitude_max",
+)
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+
+def nightly(
+    connection: sqlite3.Connection, row: dict, dbase: Optional[str] = None, archive: Optional[str] = None
+) -> np.ndarray:
+    """
+    (location_id, night, darkest magnitude, longitude, latitude) rows as a structured array,
+    also from the archive databases if given. A night split between
+    the live database and an archive keeps its darkest magnitude.
+    """
+    row = dict(row, start_day=row["start_date"] // 1000000, end_day=row["end_date"] // 1000000)
+    if archive is None:
+        rows = connection.execute(NIGHTLY_SQL.format(readings="tess_readings_t"), row).fetchall()
+    else:
+        rows = [r for shard in federated_query(dbase, archive, NIGHTLY_SQL, row, row["start_date"], row["end_date"]) for r in shard]
+    data = np.array(rows, dtype=DTYPE)
+    if archive is not None and len(data):
+        data = np.sort(data, order=["location_id", "night", "magnitude"])
+        last = np.ones(len(data), dtype=bool)
+        last[:-1] = (data["location_id"][1:] != data["location_id"][:-1]) | (data["night"][1:] != data["night"][:-1])
+        data = data[last]
+    return data
+
+
+def site_medians(data: np.ndarray):
+    """Per site location ids, coordinates, medians of their nightly darkest magnitudes and number of nights"""
+    data = np.sort(data, order=["location_id", "magnitude"])
+    ids, start, count = np.unique(data["location_id"], return_index=True, return_counts=True)
+    mag = data["magnitude"]
+    median = (mag[start + (count - 1) // 2] + mag[start + count // 2]) / 2
+    return ids, data["longitude"][start], data["latitude"][start], median, count
+
+
+def grid(data: np.ndarray, cell_size: float) -> List[tuple]:
+    """
+    Site medians binned into cell_size degree cells, one row per non empty cell
+    as in CSV_HEADERS, from south west to north east.
+    """
+    ids, longitude, latitude, median, nights = site_medians(data)
+    rows = int(np.ceil(180 / cell_size))
+    cols = int(np.ceil(360 / cell_size))
+    i = np.clip(np.floor((latitude + 90) / cell_size).astype(np.int64), 0, rows - 1)
+    j = np.clip(np.floor(((longitude + 180) % 360) / cell_size).astype(np.int64), 0, cols - 1)
+    cells, inverse = np.unique(i * cols + j, return_inverse=True)
+    n = len(cells)
+    count = np.bincount(inverse, minlength=n)
+    mean = np.bincount(inverse, weights=median, minlength=n) / np.maximum(count, 1)
+    total_nights = np.bincount(inverse, weights=nights, minlength=n).astype(np.int64)
+    low = np.full(n, np.inf)
+    high = np.full(n, -np.inf)
+    np.minimum.at(low, inverse, median)
+    np.maximum.at(high, inverse, median)
+    result = list()
+    for k, cell in enumerate(cells.tolist()):
+        ci, cj = divmod(cell, cols)
+        lon_min, lat_min = cj * cell_size - 180, ci * cell_size - 90
+        result.append(
+            (
+                round(lon_min, 6),
+                round(lat_min, 6),
+                round(min(lon_min + cell_size, 180), 6),
+                round(min(lat_min + cell_size, 90), 6),
+                int(count[k]),
+                int(total_nights[k]),
+                round(float(mean[k]), 2),
+                round(float(low[k]), 2),
+                round(float(high[k]), 2),
+            )
+        )
+    return result
+
+
+def write_csv(cells: List[tuple], fd: TextIO) -> None:
+    writer = csv.writer(fd)
+    writer.writerow(CSV_HEADERS)
+    writer.writerows(cells)
+
+
+def write_geojson(cells: List[tuple], fd: TextIO) -> None:
+    features = list()
+    for cell in cells:
+        lon_min, lat_min, lon_max, lat_max = cell[:4]
+        ring = [[lon_min, lat_min], [lon_max, lat_min], [lon_max, lat_max], [lon_min, lat_max], [lon_min, lat_min]]
+        features.append(
+            {
+                "type": "Feature",
+                "geometry": {"type": "Polygon", "coordinates": [ring]},
+                "properties": dict(zip(CSV_HEADERS[4:], cell[4:])),
+            }
+        )
+    json.dump({"type": "FeatureCollection", "features": features}, fd)
+    fd.write("\n")
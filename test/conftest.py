@@ -0,0 +1,60 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+# --------------------
+# System wide imports
+# -------------------
+
+import sqlite3
+
+import pytest
+
+# ----------------
+# Module constants
+# ----------------
+
+# Just the tessdb tables and columns the command line utilities touch
+SCHEMA = """
+    CREATE TABLE date_t (date_id INTEGER PRIMARY KEY, sql_date TEXT);
+    CREATE TABLE time_t (time_id INTEGER PRIMARY KEY, time TEXT);
+    CREATE TABLE location_t (
+        location_id INTEGER PRIMARY KEY AUTOINCREMENT, site TEXT, longitude REAL, latitude REAL, elevation REAL,
+        zipcode TEXT, location TEXT, province TEXT, state TEXT, country TEXT, timezone TEXT DEFAULT 'Etc/UTC',
+        contact_name TEXT, contact_email TEXT, organization TEXT
+    );
+    CREATE TABLE tess_t (
+        tess_id INTEGER PRIMARY KEY AUTOINCREMENT, mac_address TEXT, zero_point REAL, filter TEXT,
+        azimuth REAL, altitude REAL, valid_since TEXT, valid_until TEXT, valid_state TEXT,
+        authorised INTEGER DEFAULT 0, registered TEXT DEFAULT 'Unknown', location_id INTEGER DEFAULT -1
+    );
+    CREATE TABLE name_to_mac_t (name TEXT, mac_address TEXT, valid_since TEXT, valid_until TEXT, valid_state TEXT);
+    CREATE TABLE tess_readings_t (
+        date_id INTEGER, time_id INTEGER, tess_id INTEGER, location_id INTEGER, sequence_number INTEGER,
+        frequency REAL, magnitude REAL, ambient_temperature REAL, sky_temperature REAL, signal_strength INTEGER,
+        PRIMARY KEY (date_id, time_id, tess_id)
+    );
+    """
+
+# -----------------------
+# Module global functions
+# -----------------------
+
+
+def add_readings(connection, tess_id, location_id, dates, time_id=120000):
+    """One reading per date_id, in date order so that rowids follow dates"""
+    connection.executemany(
+        "INSERT INTO tess_readings_t (date_id, time_id, tess_id, location_id, frequency) VALUES (?,?,?,?,?)",
+        [(date_id, time_id, tess_id, location_id, 10.0) for date_id in dates],
+    )
+    connection.commit()
+
+
+@pytest.fixture
+def connection():
+    connection = sqlite3.connect(":memory:")
+    connection.executescript(SCHEMA)
+    yield connection
+    connection.close()
@@ -0,0 +1,111 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import sqlite3
+
+from tessdb.cmdline.utils.archive import attach_archive, detach_archive, archive_move, federated_query, merge_counts
+from tessdb.cmdline.utils.archive import merge_latest
+from tessdb.cmdline.utils.progress import Progress
+
+from conftest import SCHEMA, add_readings
+
+COUNT_SQL = """
+    SELECT i.mac_address, l.site, MIN(date_id), MAX(date_id), COUNT(*)
+    FROM {readings}
+    JOIN location_t AS l USING (location_id)
+    JOIN tess_t AS i USING (tess_id)
+    GROUP BY i.mac_address, l.site
+    """
+
+LATEST_SQL = """
+    SELECT (date_id*1000000 + time_id), i.mac_address
+    FROM {readings}
+    JOIN tess_t AS i USING (tess_id)
+    ORDER BY date_id DESC, time_id DESC
+    LIMIT :count
+    """
+
+
+def live(tmp_path):
+    path = str(tmp_path / "tess.db")
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    connection.execute("INSERT INTO date_t VALUES (20200101, '2020-01-01')")
+    connection.execute("INSERT INTO location_t (location_id, site) VALUES (1, 'Madrid')")
+    connection.execute("INSERT INTO tess_t (tess_id, mac_address, location_id) VALUES (1, 'AA:00', 1)")
+    connection.execute("INSERT INTO tess_t (tess_id, mac_address, location_id) VALUES (2, 'BB:00', 1)")
+    connection.commit()
+    add_readings(connection, 1, 1, range(20200101, 20200105))
+    add_readings(connection, 2, 1, range(20200101, 20200103))
+    return path, connection
+
+
+def archive_instrument(connection, path, test=False):
+    attach_archive(connection, path, test)
+    with Progress(connection, "archive") as progress:
+        archive_move(connection, progress, "tess_readings_t", "tess_id == 2", {}, commit=not test)
+        archive_move(connection, progress, "tess_t", "tess_id == 2", {}, commit=not test)
+    if test:
+        connection.rollback()
+    detach_archive(connection)
+
+
+def test_test_mode_leaves_no_archive(tmp_path):
+    path, connection = live(tmp_path)
+    archive_instrument(connection, str(tmp_path / "archive.db"), test=True)
+    assert not (tmp_path / "archive.db").exists()
+    assert connection.execute("SELECT COUNT(*) FROM tess_readings_t").fetchone()[0] == 6
+
+
+def test_archived_instruments_are_still_found(tmp_path):
+    path, connection = live(tmp_path)
+    directory = tmp_path / "archive"
+    directory.mkdir()
+    archive_instrument(connection, str(directory / "2020.db"))
+    assert connection.execute("SELECT COUNT(*) FROM tess_t").fetchone()[0] == 1
+    archive = sqlite3.connect(str(directory / "2020.db"))
+    assert archive.execute("SELECT COUNT(*) FROM date_t").fetchone()[0] == 1
+    results = federated_query(path, str(directory), COUNT_SQL, {})
+    assert merge_counts(results) == [
+        ("AA:00", "Madrid", 20200101, 20200104, 4),
+        ("BB:00", "Madrid", 20200101, 20200102, 2),
+    ]
+
+
+def shard(directory, name, tess_id, dates):
+    """An archive holding older readings of an instrument still live"""
+    connection = sqlite3.connect(str(directory / name))
+    connection.executescript(SCHEMA)
+    add_readings(connection, tess_id, 1, dates, time_id=0)
+    connection.close()
+
+
+def test_federation(tmp_path):
+    path, connection = live(tmp_path)
+    directory = tmp_path / "archive"
+    directory.mkdir()
+    shard(directory, "2019.db", 1, range(20191230, 20191232))
+    results = federated_query(path, str(directory), COUNT_SQL, {})
+    assert len(results) == 2
+    assert merge_counts(results) == [
+        ("AA:00", "Madrid", 20191230, 20200104, 6),
+        ("BB:00", "Madrid", 20200101, 20200102, 2),
+    ]
+    results = federated_query(path, str(directory), LATEST_SQL, {"count": 10})
+    latest = merge_latest(results, 7)
+    assert [tstamp for tstamp, _ in latest] == sorted((tstamp for tstamp, _ in latest), reverse=True)
+    assert latest[-1] == (20191231000000, "AA:00")
+    assert merge_latest(results, 2) == [(20200104120000, "AA:00"), (20200103120000, "AA:00")]
+
+
+def test_federation_skips_shards_out_of_range(tmp_path):
+    path, connection = live(tmp_path)
+    directory = tmp_path / "archive"
+    directory.mkdir()
+    shard(directory, "2019.db", 1, range(20191230, 20191232))
+    results = federated_query(path, str(directory), COUNT_SQL, {}, start_date=20200101000000)
+    assert len(results) == 1
+    assert merge_counts(results)[0] == ("AA:00", "Madrid", 20200101, 20200104, 4)
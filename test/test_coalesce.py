@@ -0,0 +1,84 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import pytest
+
+from tessdb.cmdline.utils.coalesce import collapse_versions, find_runs, load_versions
+
+INFINITE = "2999-12-31T23:59:59"
+
+
+def add_versions(connection, mac, versions):
+    """Consecutive versions from (valid_since, zero_point, filter) tuples, the last one current"""
+    bounds = [since for since, _, _ in versions[1:]] + [INFINITE]
+    connection.executemany(
+        """
+        INSERT INTO tess_t (mac_address, zero_point, filter, azimuth, altitude, valid_since, valid_until, valid_state)
+        VALUES (?,?,?,0.0,90.0,?,?,?)
+        """,
+        [
+            (mac, zp, filter, since, until, "Current" if until == INFINITE else "Expired")
+            for (since, zp, filter), until in zip(versions, bounds)
+        ],
+    )
+
+
+@pytest.fixture
+def versions(connection):
+    connection.execute("INSERT INTO name_to_mac_t VALUES ('stars1', 'AA:00', '2020-01-01T00:00:00', ?, 'Current')", (INFINITE,))
+    add_versions(
+        connection,
+        "AA:00",
+        [
+            ("2020-01-01T00:00:00", 20.5, "UV/IR-740"),  # 1
+            ("2020-02-01T00:00:00", 20.5, "UV/IR-740"),  # 2
+            ("2020-03-01T00:00:00", 20.5, "UV/IR-740"),  # 3
+            ("2020-04-01T00:00:00", 20.4, "UV/IR-740"),  # 4
+            ("2020-05-01T00:00:00", 20.4, "UV/IR-740"),  # 5
+        ],
+    )
+    add_versions(
+        connection,
+        "BB:00",
+        [
+            ("2020-01-01T00:00:00", None, "UV/IR-740"),  # 6
+            ("2020-02-01T00:00:00", None, "UV/IR-740"),  # 7
+            ("2020-03-01T00:00:00", 20.1, None),  # 8
+            ("2020-04-01T00:00:00", 20.1, None),  # 9
+        ],
+    )
+    return connection
+
+
+def test_runs(versions):
+    runs = find_runs(load_versions(versions))
+    assert [(run.mac, run.target, run.sources, run.valid_since, run.valid_until) for run in runs] == [
+        ("AA:00", 3, [1, 2], "2020-01-01T00:00:00", "2020-04-01T00:00:00"),
+        ("AA:00", 5, [4], "2020-04-01T00:00:00", INFINITE),
+    ]
+    assert runs[0].name == "stars1"
+
+
+def test_null_attributes_are_not_coalesced(versions):
+    assert find_runs(load_versions(versions, "WHERE t.mac_address == :mac", {"mac": "BB:00"})) == []
+
+
+def test_gap_breaks_run(versions):
+    versions.execute("UPDATE tess_t SET valid_until = '2020-01-15T00:00:00' WHERE tess_id == 1")
+    runs = find_runs(load_versions(versions, "WHERE t.mac_address == :mac", {"mac": "AA:00"}))
+    assert [(run.target, run.sources) for run in runs] == [(3, [2]), (5, [4])]
+
+
+def test_collapse(versions):
+    runs = find_runs(load_versions(versions))
+    assert collapse_versions(versions, runs) == 3
+    assert versions.execute(
+        "SELECT tess_id, valid_since, valid_until FROM tess_t WHERE mac_address == 'AA:00' ORDER BY valid_since"
+    ).fetchall() == [
+        (3, "2020-01-01T00:00:00", "2020-04-01T00:00:00"),
+        (5, "2020-04-01T00:00:00", INFINITE),
+    ]
+    assert find_runs(load_versions(versions)) == []
@@ -0,0 +1,53 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import pytest
+
+from tessdb.cmdline.utils.dryrun import DryRun
+
+from conftest import add_readings
+
+DELETE_SQL = "DELETE FROM tess_readings_t WHERE location_id == :location_id RETURNING tess_id, date_id"
+
+
+def count(connection):
+    return connection.execute("SELECT COUNT(*) FROM tess_readings_t").fetchone()[0]
+
+
+@pytest.fixture
+def readings(connection):
+    add_readings(connection, 1, 10, range(20200101, 20200106))
+    add_readings(connection, 2, 10, range(20200103, 20200105))
+    add_readings(connection, 3, 20, range(20200101, 20200103))
+    return connection
+
+
+def test_summary(readings):
+    with DryRun(readings, True) as dry:
+        rows = dry.execute(DELETE_SQL, {"location_id": 10})
+    assert len(rows) == dry.changes == 7
+    assert dry.summary() == [((1,), 20200101, 20200105, 5), ((2,), 20200103, 20200104, 2)]
+
+
+def test_rolled_back_in_test_mode(readings):
+    with DryRun(readings, True) as dry:
+        dry.execute(DELETE_SQL, {"location_id": 10})
+    assert count(readings) == 9
+
+
+def test_released_otherwise(readings):
+    with DryRun(readings, False) as dry:
+        dry.execute(DELETE_SQL, {"location_id": 10})
+    assert not readings.in_transaction
+    assert count(readings) == 2
+
+
+def test_rolled_back_on_error(readings):
+    with pytest.raises(IndexError):
+        with DryRun(readings, False) as dry:
+            dry.execute(DELETE_SQL, {"location_id": 10})
+            raise IndexError()
+    assert count(readings) == 9
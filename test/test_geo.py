@@ -0,0 +1,79 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import math
+import random
+
+from tessdb.cmdline.utils.geo import chord, clusters, duplicates, haversine, near_pairs, unit_vector
+
+
+def pairs(points, distance):
+    return sorted((i, j) for i, j, _ in near_pairs(points, distance))
+
+
+def brute_force(points, distance):
+    return sorted(
+        (i, j)
+        for i in range(len(points))
+        for j in range(i + 1, len(points))
+        if haversine(*points[i], *points[j]) <= distance
+    )
+
+
+def test_haversine():
+    assert haversine(0, 0, 0, 0) == 0
+    assert math.isclose(haversine(0, 0, 0, 1), 111195, rel_tol=1e-4)
+    assert math.isclose(haversine(179.5, 0, -179.5, 0), haversine(0, 0, 1, 0))
+
+
+def test_grid_cell_boundary():
+    # Two points 400 m apart on either side of the y == size cell boundary
+    size = chord(1000)
+    boundary = math.degrees(math.asin(size))
+    step = math.degrees(200 / 6371000.0)
+    points = [(boundary - step, 0.0), (boundary + step, 0.0)]
+    cells = [math.floor(unit_vector(*p)[1] / size) for p in points]
+    assert cells == [0, 1]
+    assert pairs(points, 1000) == [(0, 1)]
+
+
+def test_antimeridian_and_poles():
+    points = [(179.9995, 10.0), (-179.9995, 10.0), (0.0, 89.9995), (180.0, 89.9995), (90.0, -10.0)]
+    assert pairs(points, 200) == [(0, 1), (2, 3)]
+
+
+def test_agrees_with_brute_force():
+    random.seed(3)
+    centres = [(random.uniform(-180, 180), random.uniform(-89, 89)) for _ in range(20)]
+    points = [(lon + random.gauss(0, 0.01), lat + random.gauss(0, 0.01)) for lon, lat in centres for _ in range(10)]
+    points = [((lon + 180) % 360 - 180, lat) for lon, lat in points]
+    for distance in (100, 1000, 5000):
+        assert pairs(points, distance) == brute_force(points, distance)
+
+
+def test_transitive_clusters():
+    step = math.degrees(80 / 6371000.0)
+    points = [(0.0, 0.0), (step, 0.0), (2 * step, 0.0), (10.0, 10.0), (20.0, 20.0), (20.0, 20.0 + step)]
+    assert pairs(points, 100) == [(0, 1), (1, 2), (4, 5)]
+    assert clusters(len(points), near_pairs(points, 100)) == [[0, 1, 2], [4, 5]]
+
+
+def test_duplicates(connection):
+    step = math.degrees(50 / 6371000.0)
+    connection.executemany(
+        "INSERT INTO location_t (location_id, site, longitude, latitude) VALUES (?,?,?,?)",
+        [
+            (-1, "Unknown", "Unknown", "Unknown"),
+            (1, "Madrid", -3.7, 40.4),
+            (2, "Madrid bis", -3.7 + step, 40.4),
+            (3, "Barcelona", 2.17, 41.38),
+            (4, "Nowhere", None, None),
+        ],
+    )
+    assert duplicates(connection, 100) == [
+        (1, "Madrid", -3.7, 40.4, "Madrid bis", 38.1),
+        (1, "Madrid bis", -3.7 + step, 40.4, "Madrid", 38.1),
+    ]
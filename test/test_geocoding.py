@@ -0,0 +1,92 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import asyncio
+
+import pytest
+
+from tessdb.cmdline.utils import geocoding
+from tessdb.cmdline.utils.geocoding import Geocoder, Timezones, TokenBucket, reverse_all
+
+ADDRESS = {"town": "Madrid", "state": "Comunidad de Madrid", "country": "Spain"}
+
+
+class FakeBackend:
+    def __init__(self):
+        self.calls = list()
+
+    def reverse(self, latitude, longitude):
+        self.calls.append((latitude, longitude))
+        return dict(ADDRESS)
+
+
+def utc(longitude, latitude):
+    return "Etc/UTC"
+
+
+def test_eviction(tmp_path):
+    geocoder = Geocoder(FakeBackend(), tzone=utc, path=str(tmp_path / "geo.db"), max_entries=10)
+    for i in range(11):
+        geocoder.reverse(40.0 + i, -3.0)
+    # Over max_entries, the least recently used ones go down to 90%
+    assert geocoder.entries == 9
+    assert geocoder.lookup(40.0, -3.0) is None
+    assert geocoder.lookup(50.0, -3.0).cached
+    assert geocoder.connection.execute(
+        "SELECT name FROM sqlite_master WHERE type == 'index' AND tbl_name == 'geocoding_t' AND name NOT LIKE 'sqlite_%'"
+    ).fetchall() == [("geocoding_used_i",)]
+    geocoder.close()
+
+
+def test_token_bucket(monkeypatch):
+    clock = [0.0]
+
+    async def sleep(delay):
+        clock[0] += delay
+
+    monkeypatch.setattr(geocoding.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(geocoding.asyncio, "sleep", sleep)
+    bucket = TokenBucket(rate=2.0, burst=3)
+
+    async def acquire(n):
+        times = list()
+        for _ in range(n):
+            await bucket.acquire()
+            times.append(clock[0])
+        return times
+
+    # The burst is served at once, then one every 1/rate seconds
+    assert asyncio.run(acquire(5)) == pytest.approx([0.0, 0.0, 0.0, 0.5, 1.0])
+
+
+def test_reverse_all_shares_cells(tmp_path):
+    backend = FakeBackend()
+    geocoder = Geocoder(backend, tzone=utc, path=str(tmp_path / "geo.db"))
+    geocoder.reverse(41.0, -3.0)
+    points = [(40.0, -3.0), (40.0001, -3.0001), (41.0, -3.0), (42.0, -3.0)]
+    places = dict()
+    reverse_all(geocoder, points, rate=1000.0, concurrency=2, done=places.__setitem__)
+    assert sorted(places) == sorted(points)
+    # Cached cell answered locally, points sharing a cell geocoded once
+    assert sorted(backend.calls[1:]) == [(40.0, -3.0), (42.0, -3.0)]
+    assert places[(41.0, -3.0)].cached and not places[(40.0001, -3.0001)].cached
+    geocoder.close()
+
+
+class StubFinder:
+    def __init__(self):
+        self.calls = 0
+
+    def timezone_at(self, lng, lat):
+        self.calls += 1
+        return "Europe/Madrid" if -10 < lng < 5 else None
+
+
+def test_timezones_memoized():
+    timezones = Timezones()
+    timezones._finder = finder = StubFinder()
+    assert [timezones(-3.7, 40.4), timezones(-3.7, 40.4), timezones(100.0, 0.0)] == ["Europe/Madrid", "Europe/Madrid", None]
+    assert finder.calls == 2
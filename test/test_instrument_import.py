@@ -0,0 +1,67 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+from argparse import Namespace
+
+import pytest
+
+from tessdb.cmdline.instrument import instrument_import
+
+INFINITE = "2999-12-31T23:59:59"
+
+CSV = """name,mac,zp,filter
+stars1,AA:00,20.5,UV/IR-740
+stars2,BB:00,20.4,UV/IR-740
+stars2,BB:00,20.4,UV/IR-740
+stars3,BB:00,20.3,UV/IR-740
+stars2,CC:00,20.3,UV/IR-740
+stars4,DD:00,not a number,UV/IR-740
+stars5,EE:00,20.1,UV/IR-740
+stars5,EE:00,20.1,UV/IR-740
+"""
+
+
+@pytest.fixture
+def registered(connection):
+    connection.execute(
+        "INSERT INTO tess_t (mac_address, zero_point, filter, valid_since, valid_until, valid_state) VALUES (?,?,?,?,?,?)",
+        ("AA:00", 20.5, "UV/IR-740", "2020-01-01T00:00:00", INFINITE, "Current"),
+    )
+    connection.execute(
+        "INSERT INTO name_to_mac_t VALUES ('stars1', 'AA:00', '2020-01-01T00:00:00', ?, 'Current')", (INFINITE,)
+    )
+    connection.commit()
+    return connection
+
+
+def run(connection, tmp_path, test=False):
+    path = tmp_path / "instruments.csv"
+    path.write_text(CSV)
+    instrument_import(connection, Namespace(csv_file=str(path), test=test))
+
+
+def test_import(registered, tmp_path, capsys):
+    run(registered, tmp_path)
+    out = capsys.readouterr().out
+    assert registered.execute("SELECT name, mac_address FROM name_to_mac_t ORDER BY name").fetchall() == [
+        ("stars1", "AA:00"),
+        ("stars2", "BB:00"),
+        ("stars5", "EE:00"),
+    ]
+    assert registered.execute("SELECT COUNT(*) FROM tess_t").fetchone()[0] == 3
+    assert "Already registered" in out
+    assert "Duplicate of line 3" in out
+    assert "Duplicate of line 8" in out
+    assert "MAC also given in line 3" in out
+    assert "Name also given in line 3" in out
+    assert "Invalid row" in out
+    assert "2 instruments created, 3 skipped, 3 conflicting." in out
+
+
+def test_import_test_mode(registered, tmp_path, capsys):
+    run(registered, tmp_path, test=True)
+    assert registered.execute("SELECT COUNT(*) FROM tess_t").fetchone()[0] == 1
+    assert "Test only. 2 instruments would be created" in capsys.readouterr().out
@@ -0,0 +1,85 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import random
+
+from tessdb.cmdline.utils.intervals import IntervalIndex, InstrumentResolver
+
+INFINITE = "2999-12-31T23:59:59"
+
+
+def test_interval_index():
+    index = IntervalIndex()
+    index.add("a", "2020-02-01T00:00:00", INFINITE, 2)
+    index.add("a", "2020-01-01T00:00:00", "2020-02-01T00:00:00", 1)
+    index.add("b", "2020-01-15T00:00:00", "2020-01-20T00:00:00", 3)
+    assert index.at("a", "2019-12-31T23:59:59") is None
+    assert index.at("a", "2020-01-01T00:00:00") == 1
+    assert index.at("a", "2020-02-01T00:00:00") == 2  # valid_until is exclusive
+    assert index.at("b", "2020-01-20T00:00:00") is None  # gap after the last interval
+    assert index.at("c", "2020-01-20T00:00:00") is None
+
+
+def test_merge_agrees_with_at():
+    index = IntervalIndex()
+    index.add("a", "2020-01-01T00:00:00", "2020-02-01T00:00:00", 1)
+    index.add("a", "2020-02-01T00:00:00", "2020-02-10T00:00:00", 2)
+    index.add("a", "2020-03-01T00:00:00", INFINITE, 3)
+    random.seed(1)
+    tstamps = sorted("2020-%02d-%02dT00:00:00" % (random.randint(1, 4), random.randint(1, 28)) for _ in range(200))
+    tstamps += ["2020-01-01T00:00:00", "2020-02-10T00:00:00", "2020-03-01T00:00:00"]
+    tstamps.sort()
+    assert index.merge("a", tstamps) == [index.at("a", t) for t in tstamps]
+    assert index.merge("z", tstamps[:2]) == [None, None]
+
+
+def load_resolver(connection):
+    connection.executescript(
+        """
+        INSERT INTO location_t (location_id, site) VALUES (1, 'Madrid');
+        INSERT INTO name_to_mac_t VALUES ('stars1', 'AA:00', '2020-01-01T00:00:00', '2020-03-01T00:00:00', 'Expired');
+        INSERT INTO name_to_mac_t VALUES ('stars9', 'AA:00', '2020-03-01T00:00:00', '2999-12-31T23:59:59', 'Current');
+        INSERT INTO name_to_mac_t VALUES ('stars1', 'BB:00', '2020-03-01T00:00:00', '2999-12-31T23:59:59', 'Current');
+        INSERT INTO tess_t (tess_id, mac_address, zero_point, valid_since, valid_until, location_id)
+            VALUES (1, 'AA:00', 20.5, '2020-01-01T00:00:00', '2020-02-01T00:00:00', 1);
+        INSERT INTO tess_t (tess_id, mac_address, zero_point, valid_since, valid_until, location_id)
+            VALUES (2, 'AA:00', 20.4, '2020-02-01T00:00:00', '2999-12-31T23:59:59', -1);
+        """
+    )
+    return InstrumentResolver(connection)
+
+
+def test_resolver_follows_renamings_and_versions(connection):
+    resolver = load_resolver(connection)
+    name, mac, version = resolver.by_name("stars1", "2020-01-10T00:00:00")
+    assert (name, mac, version.tess_id, version.site) == ("stars1", "AA:00", 1, "Madrid")
+    name, mac, version = resolver.by_mac("AA:00", "2020-03-10T00:00:00")
+    assert (name, mac, version.tess_id, version.zero_point, version.site) == ("stars9", "AA:00", 2, 20.4, None)
+    assert resolver.by_name("stars1", "2020-03-10T00:00:00") == ("stars1", "BB:00", None)
+    assert resolver.by_name("stars1", "2019-01-01T00:00:00") == ("stars1", None, None)
+
+
+def test_annotate(connection):
+    resolver = load_resolver(connection)
+    pairs = [
+        ("AA:00", "2020-03-10T00:00:00"),
+        ("BB:00", "2020-03-10T00:00:00"),
+        ("AA:00", "2020-01-10T00:00:00"),
+        ("CC:00", "2020-01-10T00:00:00"),
+        ("AA:00", "2020-02-01T00:00:00"),
+        ("AA:00", "2019-12-31T00:00:00"),
+    ]
+    macs, tstamps = zip(*pairs)
+    annotated = resolver.annotate(macs, tstamps)
+    assert annotated == [resolver.by_mac(mac, tstamp) for mac, tstamp in pairs]
+    assert [(r.name, r.version and r.version.tess_id) for r in annotated] == [
+        ("stars9", 2),
+        ("stars1", None),
+        ("stars1", 1),
+        (None, None),
+        ("stars1", 2),
+        (None, None),
+    ]
@@ -0,0 +1,47 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import json
+import socket
+
+from tessdb.cmdline.utils import invalidation
+
+
+def change_site(connection, location_id):
+    connection.execute("INSERT INTO location_t (location_id, site) VALUES (?, ?)", (location_id, "site%d" % location_id))
+    connection.commit()
+
+
+def pending(connection):
+    return connection.execute("SELECT payload FROM %s" % (invalidation.PENDING_TABLE,)).fetchall()
+
+
+def test_tracked_changes(connection):
+    invalidation.track(connection)
+    change_site(connection, 1)
+    connection.execute("INSERT INTO tess_t (mac_address) VALUES ('AA:00')")  # rolled back
+    assert invalidation.changes(connection) == {"macs": [], "names": [], "locations": [1]}
+
+
+def test_sent_to_listener(connection, tmp_path):
+    path = str(tmp_path / "invalidations.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.bind(path)
+        invalidation.track(connection)
+        change_site(connection, 1)
+        assert invalidation.publish(connection, invalidation.changes(connection), path)
+        assert json.loads(sock.recv(65536)) == {"macs": [], "names": [], "locations": [1]}
+    assert invalidation.drain(connection) == {"macs": [], "names": [], "locations": []}
+
+
+def test_pending_when_nobody_listens(connection, tmp_path):
+    path = str(tmp_path / "nobody.sock")
+    invalidation.track(connection)
+    for location_id in (2, 1, 2):
+        assert not invalidation.publish(connection, {"locations": [location_id], "macs": ["AA:00"]}, path)
+    assert len(pending(connection)) == 1
+    assert invalidation.drain(connection) == {"macs": ["AA:00"], "names": [], "locations": [1, 2]}
+    assert pending(connection) == []
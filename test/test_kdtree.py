@@ -0,0 +1,74 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import math
+import random
+
+import numpy as np
+import pytest
+
+from tessdb.cmdline.utils import invalidation
+from tessdb.cmdline.utils.kdtree import SiteTree
+from tessdb.cmdline.utils.geo import EARTH_RADIUS
+
+
+def haversine(lon1, lat1, lon2, lat2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi, dlam = phi2 - phi1, math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlam / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+@pytest.fixture
+def sites(connection):
+    rng = random.Random(1)
+    rows = [(i, "site%d" % i, rng.uniform(-180, 180), rng.uniform(-60, 70)) for i in range(1, 301)]
+    rows.append((301, None, 0.0, 0.0))
+    connection.executemany("INSERT INTO location_t (location_id, site, longitude, latitude) VALUES (?,?,?,?)", rows)
+    connection.execute("INSERT INTO location_t (location_id, site) VALUES (-1, 'Unknown')")
+    connection.commit()
+    return rows
+
+
+def test_nearest_matches_brute_force(connection, sites):
+    tree = SiteTree.build(connection)
+    assert len(tree) == len(sites)
+    for lon, lat in ((-3.7, 40.4), (179.9, 0.0), (0.0, 89.0)):
+        expected = sorted(sites, key=lambda s: haversine(lon, lat, s[2], s[3]))[:5]
+        result = tree.nearest(lon, lat, k=5)
+        assert [r[0] for r in result] == [s[0] for s in expected]
+        for r, s in zip(result, expected):
+            assert r[4] == pytest.approx(haversine(lon, lat, s[2], s[3]), rel=1e-6)
+
+
+def test_within(connection, sites):
+    tree = SiteTree.build(connection)
+    assert tree.nearest(0.0, 0.0, k=3, within=1.0)[0][:2] == (301, "")
+    assert all(r[4] <= 500000 for r in tree.nearest(10.0, 10.0, k=50, within=500000))
+
+
+def test_cache(connection, sites, tmp_path):
+    tree = SiteTree.open(connection, "tess.db", str(tmp_path))
+    path = SiteTree.cache_path("tess.db", str(tmp_path))
+    with np.load(path, allow_pickle=False) as data:
+        assert data["sites"].dtype.kind == "U"
+    cached = SiteTree.open(connection, "tess.db", str(tmp_path))
+    assert cached.nearest(-3.7, 40.4, k=3) == tree.nearest(-3.7, 40.4, k=3)
+    connection.execute("INSERT INTO location_t (location_id, site, longitude, latitude) VALUES (302, 'new', -3.7, 40.4)")
+    assert SiteTree.open(connection, "tess.db", str(tmp_path)).nearest(-3.7, 40.4)[0][0] == 302
+    # Updates are only seen through the generation counter of tracked changes
+    invalidation.track(connection)
+    connection.execute("UPDATE location_t SET longitude = 0.0, latitude = 0.0 WHERE location_id == 302")
+    connection.execute("UPDATE location_t SET longitude = -3.7, latitude = 40.4 WHERE location_id == 7")
+    assert invalidation.generation(connection) == 2
+    assert SiteTree.open(connection, "tess.db", str(tmp_path)).nearest(-3.7, 40.4)[0][0] == 7
+
+
+def test_empty(connection, tmp_path):
+    tree = SiteTree.open(connection, "tess.db", str(tmp_path))
+    assert len(tree) == 0
+    assert tree.nearest(0.0, 0.0) == []
+    assert len(SiteTree.open(connection, "tess.db", str(tmp_path))) == 0
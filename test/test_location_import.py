@@ -0,0 +1,86 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import os
+from argparse import Namespace
+
+import pytest
+
+from tessdb.cmdline import location
+from tessdb.cmdline.utils.geocoding import Geocoder
+
+CSV = """site,longitude,latitude
+Madrid,-3.70,40.41
+Barcelona,2.17,41.38
+Sevilla,-5.98,37.39
+"""
+
+
+class FakeBackend:
+    """Knows every place, fails at the given latitude"""
+
+    def __init__(self, fail_at=None):
+        self.fail_at = fail_at
+        self.calls = list()
+
+    def reverse(self, latitude, longitude):
+        if latitude == self.fail_at:
+            raise ConnectionError("geocoding service down")
+        self.calls.append(latitude)
+        return {"town": "Town %s" % (latitude,), "country": "Spain"}
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = tmp_path / "sites.csv"
+    path.write_text(CSV)
+    return str(path)
+
+
+def run(connection, csv_file, backend, monkeypatch, tmp_path, test=False):
+    geocoder = Geocoder(backend, tzone=lambda lon, lat: "Europe/Madrid", path=str(tmp_path / "geo.db"))
+    monkeypatch.setattr(location, "location_geocoder", lambda options, min_delay: geocoder)
+    options = Namespace(csv_file=csv_file, test=test, rate=1000.0, concurrency=1)
+    location.location_import(connection, options)
+
+
+def test_resume_after_partial_run(connection, csv_file, monkeypatch, tmp_path, capsys):
+    checkpoint = csv_file + ".checkpoint"
+    with pytest.raises(ConnectionError):
+        run(connection, csv_file, FakeBackend(fail_at=41.38), monkeypatch, tmp_path)
+    assert connection.execute("SELECT COUNT(*) FROM location_t").fetchone()[0] == 0
+    with open(checkpoint) as fd:
+        assert len(fd.readlines()) == 1
+    with open(checkpoint, "a") as fd:
+        fd.write('{"latitude": 37.39, "longit')  # cut by the failure
+    # A fresh cache, so only the checkpoint avoids geocoding Madrid again
+    os.remove(tmp_path / "geo.db")
+    backend = FakeBackend()
+    run(connection, csv_file, backend, monkeypatch, tmp_path)
+    out = capsys.readouterr().out
+    assert "Resuming from %s: 1 places already geocoded, 2 to go." % (checkpoint,) in out
+    assert sorted(backend.calls) == [37.39, 41.38]
+    assert connection.execute("SELECT site, location FROM location_t ORDER BY site").fetchall() == [
+        ("Barcelona", "Town 41.38"),
+        ("Madrid", "Town 40.41"),
+        ("Sevilla", "Town 37.39"),
+    ]
+    assert not os.path.exists(checkpoint)
+
+
+def test_checkpoint_cleanup(connection, csv_file, monkeypatch, tmp_path, capsys):
+    checkpoint = csv_file + ".checkpoint"
+    # A test run keeps the geocoded places for the real one
+    run(connection, csv_file, FakeBackend(), monkeypatch, tmp_path, test=True)
+    assert os.path.exists(checkpoint)
+    assert connection.execute("SELECT COUNT(*) FROM location_t").fetchone()[0] == 0
+    run(connection, csv_file, FakeBackend(), monkeypatch, tmp_path)
+    assert not os.path.exists(checkpoint)
+    assert "3 locations created" in capsys.readouterr().out
+    # Nothing left to geocode: a test run leaves no empty checkpoint behind
+    run(connection, csv_file, FakeBackend(), monkeypatch, tmp_path, test=True)
+    assert not os.path.exists(checkpoint)
+    assert "Test only. 0 locations would be created, 3 skipped" in capsys.readouterr().out
@@ -0,0 +1,32 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import pytest
+
+from tessdb.cmdline.location import location_indexed
+
+
+@pytest.mark.parametrize(
+    "index, indexed",
+    [
+        (None, False),
+        ("CREATE INDEX i ON tess_readings_t(location_id)", True),
+        ('CREATE INDEX "my index" ON tess_readings_t ( "location_id" )', True),
+        ("CREATE INDEX i ON tess_readings_t(location_id, date_id, time_id)", True),
+        ("CREATE INDEX i ON tess_readings_t(date_id, location_id)", False),
+        ("CREATE INDEX i ON tess_readings_t(location_id) WHERE location_id > 0", False),
+    ],
+)
+def test_location_indexed(connection, index, indexed):
+    if index is not None:
+        connection.execute(index)
+    assert location_indexed(connection.cursor()) is indexed
+
+
+def test_column_merely_named_alike(connection):
+    connection.execute("ALTER TABLE tess_readings_t ADD COLUMN old_location_id INTEGER")
+    connection.execute("CREATE INDEX i ON tess_readings_t(old_location_id)")
+    assert location_indexed(connection.cursor()) is False
@@ -0,0 +1,72 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+from argparse import Namespace
+
+import pytest
+
+from tessdb.cmdline import location
+from tessdb.cmdline.utils.geocoding import Timezones
+
+
+class StubFinder:
+    def __init__(self):
+        self.calls = list()
+
+    def timezone_at(self, lng, lat):
+        self.calls.append((lng, lat))
+        return "Europe/Madrid" if -10 < lng < 5 else None
+
+
+@pytest.fixture
+def sites(connection, monkeypatch):
+    connection.executemany(
+        "INSERT INTO location_t (location_id, site, longitude, latitude, timezone) VALUES (?,?,?,?,?)",
+        [
+            (-1, "Unknown", "Unknown", "Unknown", "Unknown"),
+            (1, "Madrid", -3.7, 40.4, "Etc/UTC"),
+            (2, "Madrid bis", -3.7, 40.4, None),
+            (3, "Barcelona", 2.17, 41.38, "Europe/Madrid"),
+            (4, "Ceuta", -5.3, 35.9, "Africa/Ceuta"),
+            (5, "Ocean", 100.0, 0.0, "Etc/UTC"),
+            (6, "Nowhere", "Unknown", "Unknown", "Unknown"),
+        ],
+    )
+    connection.commit()
+    timezones = Timezones()
+    timezones._finder = finder = StubFinder()
+    monkeypatch.setattr(location, "tf", timezones)
+    return connection, finder
+
+
+def timezones(connection):
+    return connection.execute("SELECT site, timezone FROM location_t WHERE location_id > 0 ORDER BY location_id").fetchall()
+
+
+def test_fix_defaults(sites, capsys):
+    connection, finder = sites
+    location.location_fix_timezones(connection, Namespace(all=False, test=False))
+    out = capsys.readouterr().out
+    assert timezones(connection) == [
+        ("Madrid", "Europe/Madrid"),
+        ("Madrid bis", "Europe/Madrid"),
+        ("Barcelona", "Europe/Madrid"),
+        ("Ceuta", "Africa/Ceuta"),
+        ("Ocean", "Etc/UTC"),
+        ("Nowhere", "Unknown"),
+    ]
+    # Shared coordinates are resolved once, explicit timezones are not looked up
+    assert sorted(finder.calls) == [(-3.7, 40.4), (100.0, 0.0)]
+    assert "1 sites without a timezone at their coordinates left unchanged." in out
+    assert "2 timezones changed." in out
+
+
+def test_fix_all_test_mode(sites, capsys):
+    connection, _ = sites
+    before = timezones(connection)
+    location.location_fix_timezones(connection, Namespace(all=True, test=True))
+    assert timezones(connection) == before
+    assert "Test only. 3 timezones would be changed." in capsys.readouterr().out
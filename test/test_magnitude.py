@@ -0,0 +1,81 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import numpy as np
+import pytest
+
+from tessdb.cmdline.utils.magnitude import Recomputer, ZeroPoints, tstamp_key
+from tessdb.cmdline.utils.progress import Progress
+
+INFINITE = "2999-12-31T23:59:59"
+
+
+@pytest.fixture
+def calibrated(connection):
+    connection.executemany(
+        "INSERT INTO tess_t (tess_id, mac_address, zero_point, valid_since, valid_until, valid_state) VALUES (?,?,?,?,?,?)",
+        [
+            (1, "AA:00", 20.0, "2020-01-01T00:00:00", "2020-01-05T12:00:00", "Expired"),
+            (2, "AA:00", 20.5, "2020-01-05T12:00:00", "2020-01-08T00:00:00", "Expired"),
+            (3, "AA:00", 21.0, "2020-01-08T00:00:00", INFINITE, "Current"),
+            (4, "BB:00", 19.0, "2020-01-01T00:00:00", INFINITE, "Current"),
+        ],
+    )
+    # Readings stored with the first tess_id, as before a retroactive calibration
+    connection.executemany(
+        "INSERT INTO tess_readings_t (date_id, time_id, tess_id, location_id, frequency, magnitude) VALUES (?,?,?,?,?,?)",
+        [
+            (20200102, 120000, 1, 1, 10.0, 17.5),
+            (20200105, 115959, 1, 1, 10.0, 17.5),  # last second of version 1
+            (20200105, 120000, 1, 1, 10.0, 17.5),  # first second of version 2
+            (20200109, 0, 1, 1, 100.0, None),
+            (20200109, 0, 4, 1, 0.0, None),  # no positive frequency
+            (20200110, 0, 4, 1, 10.0, 16.5),  # already right
+        ],
+    )
+    connection.commit()
+    return connection
+
+
+def test_tstamp_key():
+    assert tstamp_key("AA:00", "2020-01-05T12:00:00") == 20200105120000
+    assert tstamp_key("AA:00", INFINITE) == 29991231235959
+    for bad in ("2020-01-05 12:00:00", "2020-01-05T12:00:00.5", None):
+        with pytest.raises(ValueError):
+            tstamp_key("AA:00", bad)
+
+
+def test_versions_at_boundaries(calibrated):
+    zero_points = ZeroPoints(calibrated, ["BB:00", "AA:00"])
+    tess_id = np.array([1, 1, 1, 3, 1, 4])
+    tstamp = np.array([20200105115959, 20200105120000, 20200108000000, 20200101000000, 20191231000000, 20200101000000])
+    version = zero_points.versions(tess_id, tstamp)
+    assert zero_points.tess_id[version[:3]].tolist() == [1, 2, 3]
+    assert zero_points.tess_id[version[3]] == 1  # a later tess_id still gets the version valid at the time
+    assert version[4] == -1  # before the first version
+    assert zero_points.tess_id[version[5]] == 4
+
+
+def test_rejects_malformed_validity(calibrated):
+    calibrated.execute("UPDATE tess_t SET valid_since = '2020-01-05 12:00:00' WHERE tess_id == 2")
+    with pytest.raises(ValueError):
+        ZeroPoints(calibrated, ["AA:00"])
+
+
+def test_recompute(calibrated):
+    zero_points = ZeroPoints(calibrated, ["AA:00", "BB:00"])
+    row = {"start_date": 20200101000000, "end_date": 20201231000000}
+    recomputer = Recomputer(calibrated, zero_points, "1", row)
+    with Progress(calibrated, "recompute", chunk_size=2) as progress:
+        assert recomputer.run(progress) == 2
+    assert recomputer.skipped == 1
+    assert [m for m, in calibrated.execute("SELECT magnitude FROM tess_readings_t ORDER BY rowid")] == [
+        17.5, 17.5, 18.0, 16.0, None, 16.5,
+    ]
+    assert recomputer.summary() == [
+        ("AA:00", 2, 20.5, 20200105120000, 20200105120000, 1, 0.5, 0.5, 0.5),
+        ("AA:00", 3, 21.0, 20200109000000, 20200109000000, 1, 0.0, 0.0, 0.0),
+    ]
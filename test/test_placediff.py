@@ -0,0 +1,91 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import json
+
+import pytest
+
+from tessdb.cmdline.utils import placediff
+
+
+@pytest.fixture
+def sites(connection):
+    connection.executemany(
+        "INSERT INTO location_t (location_id, site, longitude, latitude, location, country) VALUES (?,?,?,?,?,?)",
+        [
+            (-1, "Unknown", "Unknown", "Unknown", "Unknown", "Unknown"),
+            (1, "Madrid", -3.7038, 40.4168, "Madrid", "Spain"),
+            (2, "Observatorio", -3.6883, 40.4076, "Madrid", "Spain"),
+            (3, "Barcelona", 2.1734, 41.3851, "Barcelona", "Spain"),
+            (4, "Granada", -3.5986, 37.1773, "Granada", "Spain"),
+        ],
+    )
+    return placediff.load_sites(connection)
+
+
+def place(site, longitude, latitude, **metadata):
+    return placediff._normalize(dict(metadata, name=site, lon=longitude, lat=latitude))
+
+
+def issues(differences):
+    return set((d.issue, d.site, d.registry_site, d.field) for d in differences)
+
+
+def test_load_sites(sites):
+    assert [site["location_id"] for site in sites] == [1, 2, 3, 4]
+
+
+def test_read_registry(tmp_path):
+    path = tmp_path / "places.jsonl"
+    path.write_text("\n".join(json.dumps(p) for p in ({"Name": "Madrid", "lat": "40.4", "lng": "-3.7"}, {"lat": 1})))
+    assert placediff.read_registry(str(path)) == [
+        dict(place("Madrid", -3.7, 40.4), location=None, province=None, country=None, timezone=None, organization=None)
+    ]
+
+
+def test_matches(sites):
+    registry = [
+        place("Madrid", -3.7038, 40.4168, town="Madrid"),
+        place("Observatorio Real", -3.6884, 40.4077),
+        place("Barcelona", 2.1934, 41.3851, country="España"),
+        place("Sevilla", -5.9845, 37.3891),
+    ]
+    assert issues(placediff.diff(sites, registry, 100)) == {
+        (placediff.COORDINATES, "Barcelona", "Barcelona", "longitude,latitude"),
+        (placediff.RENAMED, "Observatorio", "Observatorio Real", "site"),
+        (placediff.METADATA_ISSUE, "Barcelona", "Barcelona", "country"),
+        (placediff.MISSING_TESSDB, None, "Sevilla", "longitude,latitude"),
+        (placediff.MISSING_REGISTRY, "Granada", None, "longitude,latitude"),
+    }
+
+
+def test_duplicate_registry_names(sites):
+    registry = [
+        place("Madrid", -3.7038, 40.4168),
+        place("Madrid", -3.6883, 40.4076),
+        place("Barcelona", 2.1734, 41.3851),
+        place("Granada", -3.5986, 37.1773),
+    ]
+    differences = placediff.diff(sites, registry, 100)
+    assert issues(differences) == {
+        (placediff.DUPLICATE, None, "Madrid", "site"),
+        (placediff.RENAMED, "Observatorio", "Madrid", "site"),
+    }
+    duplicate = next(d for d in differences if d.issue == placediff.DUPLICATE)
+    assert duplicate.registry == "-3.7038,40.4168 -3.6883,40.4076"
+
+
+def test_duplicate_not_dropped(sites):
+    registry = [
+        place("Granada", -3.5986, 37.1773),
+        place("Granada", 2.1734, 41.3851),
+        place("Madrid", -3.7038, 40.4168),
+        place("Observatorio", -3.6883, 40.4076),
+    ]
+    assert issues(placediff.diff(sites, registry, 100)) == {
+        (placediff.DUPLICATE, None, "Granada", "site"),
+        (placediff.RENAMED, "Barcelona", "Granada", "site"),
+    }
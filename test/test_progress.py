@@ -0,0 +1,57 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import pytest
+
+from tessdb.cmdline.utils.progress import Progress, DATE_RANGE
+
+from conftest import add_readings
+
+
+def count(connection):
+    return connection.execute("SELECT COUNT(*) FROM tess_readings_t").fetchone()[0]
+
+
+def test_chunks_span_only_matching_rows(connection):
+    add_readings(connection, 1, 10, range(20200101, 20200111))
+    row = {"start_date": 20200103000000, "end_date": 20200106235959}
+    with Progress(connection, "test", chunk_size=3) as progress:
+        chunks = list(progress.chunks(DATE_RANGE, row))
+    assert chunks == [(3, 5), (6, 6)]
+    assert progress.total == 4
+
+
+def test_no_matching_rows(connection):
+    add_readings(connection, 1, 10, range(20200101, 20200111))
+    with Progress(connection, "test") as progress:
+        assert list(progress.chunks("tess_id == 2", {})) == []
+        assert progress.execute("DELETE FROM tess_readings_t WHERE tess_id == 2", {}, "tess_id == 2") == 0
+    assert progress.total == 0
+
+
+def test_execute_collects_and_commits_chunks(connection):
+    add_readings(connection, 1, 10, range(20200101, 20200111))
+    add_readings(connection, 2, 10, range(20200101, 20200111), time_id=130000)
+    collected = list()
+    with Progress(connection, "test", chunk_size=4) as progress:
+        deleted = progress.execute(
+            "DELETE FROM tess_readings_t WHERE tess_id == :tess_id AND rowid BETWEEN :lo AND :hi RETURNING tess_id, date_id",
+            {"tess_id": 2},
+            "tess_id == :tess_id",
+            collect=collected.extend,
+            commit=True,
+        )
+    assert deleted == 10 == len(collected) == progress.committed == progress.changed
+    assert count(connection) == 10
+
+
+def test_time_limit_rolls_back(connection):
+    add_readings(connection, 1, 10, range(20200101, 20200111))
+    with pytest.raises(TimeoutError):
+        with Progress(connection, "test", max_time=-1, chunk_size=4) as progress:
+            progress.execute("DELETE FROM tess_readings_t WHERE rowid BETWEEN :lo AND :hi", {}, "1")
+    assert progress.aborted == "time"
+    assert count(connection) == 10
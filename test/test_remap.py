@@ -0,0 +1,111 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import pytest
+
+from tessdb.cmdline.utils.remap import Remapper
+from tessdb.cmdline.utils.progress import Progress
+
+from conftest import add_readings
+
+DAYS = list(range(20200101, 20200111))
+
+
+def location_ids(connection, tess_id):
+    return [
+        location_id
+        for location_id, in connection.execute(
+            "SELECT location_id FROM tess_readings_t WHERE tess_id == ? ORDER BY date_id", (tess_id,)
+        )
+    ]
+
+
+def test_counts_per_target(connection):
+    add_readings(connection, 1, 10, DAYS)
+    add_readings(connection, 2, 20, DAYS[2:6])
+    add_readings(connection, 3, 30, DAYS)
+    add_readings(connection, 4, 40, DAYS[:1])
+    remapper = Remapper(connection, "location_id")
+    remapper.add(10, 99)
+    remapper.add(20, 99)
+    remapper.add(40, 98)
+    remapper.add(50, 97)
+    assert remapper.apply() == 15
+    assert remapper.summary() == [
+        ((10, 20), 99, 20200101, 20200110, 14),
+        ((40,), 98, 20200101, 20200101, 1),
+        ((50,), 97, None, None, 0),
+    ]
+    assert location_ids(connection, 3) == [30] * 10
+
+
+def test_chained_mappings(connection):
+    remapper = Remapper(connection, "location_id")
+    remapper.add(10, 20)
+    with pytest.raises(ValueError):
+        remapper.add(20, 30)
+    with pytest.raises(ValueError):
+        remapper.add(5, 10)
+    remapper.add(5, 20)
+
+
+def test_time_window(connection):
+    add_readings(connection, 1, 10, DAYS)
+    remapper = Remapper(connection, "location_id")
+    remapper.add(10, 11, since=20200103000000, until=20200105235959)
+    assert remapper.apply() == 3
+    assert location_ids(connection, 1) == [10, 10, 11, 11, 11, 10, 10, 10, 10, 10]
+
+
+def test_overlapping_windows(connection):
+    remapper = Remapper(connection, "tess_id")
+    remapper.add(1, 2, until=20200105000000)
+    with pytest.raises(ValueError):
+        remapper.add(1, 3, since=20200104000000)
+
+
+def test_collects_the_given_key(connection):
+    add_readings(connection, 1, 10, DAYS[:3])
+    add_readings(connection, 2, 10, DAYS[:2])
+    collected = list()
+    remapper = Remapper(connection, "location_id")
+    remapper.add(10, 11)
+    with Progress(connection, "test", chunk_size=2) as progress:
+        remapper.apply(progress, "tess_id == :tess_id", {"tess_id": 2}, collect=collected.extend, key="tess_id")
+    assert sorted(collected) == [(2, 20200101), (2, 20200102)]
+    assert location_ids(connection, 1) == [10, 10, 10]
+
+
+def test_aborted_run_only_reports_committed_chunks(connection):
+    add_readings(connection, 1, 10, DAYS)
+
+    def collect(rows):
+        if rows and rows[0][1] >= 20200105:
+            raise KeyboardInterrupt()
+
+    remapper = Remapper(connection, "location_id")
+    remapper.add(10, 11)
+    with pytest.raises(KeyboardInterrupt):
+        with Progress(connection, "test", chunk_size=4) as progress:
+            remapper.apply(progress, collect=collect, commit=True)
+    assert location_ids(connection, 1) == [11] * 4 + [10] * 6
+    assert remapper.summary()[0][-1] == 4
+    assert progress.committed == 4
+
+
+def test_indexed_chunks(connection):
+    add_readings(connection, 1, 10, DAYS)
+    add_readings(connection, 2, 20, DAYS, time_id=130000)
+    add_readings(connection, 3, 30, DAYS, time_id=140000)
+    connection.execute("CREATE INDEX location_i ON tess_readings_t(location_id)")
+    remapper = Remapper(connection, "location_id")
+    remapper.add(10, 30)
+    remapper.add(20, 30, until=20200105235959)
+    with Progress(connection, "test", chunk_size=4) as progress:
+        assert remapper.apply(progress, commit=True, indexed=True) == 15
+    assert progress.total == progress.scanned == progress.committed == 15
+    assert remapper.summary() == [((10, 20), 30, 20200101, 20200110, 15)]
+    assert location_ids(connection, 2) == [30] * 5 + [20] * 5
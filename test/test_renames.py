@@ -0,0 +1,46 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import pytest
+
+from tessdb.cmdline.utils.renames import RenameGraph, name_key
+
+INFINITE = "2999-12-31T23:59:59"
+
+
+@pytest.fixture
+def graph(connection):
+    connection.executemany(
+        "INSERT INTO name_to_mac_t VALUES (?,?,?,?,?)",
+        [
+            ("stars10", "AA:00", "2020-01-01T00:00:00", "2020-02-01T00:00:00", "Expired"),
+            ("stars11", "AA:00", "2020-02-01T00:00:00", INFINITE, "Current"),
+            ("stars2", "BB:00", "2020-01-01T00:00:00", "2020-03-01T00:00:00", "Expired"),
+            ("stars10", "CC:00", "2020-04-01T00:00:00", INFINITE, "Current"),
+            ("stars3", "DD:00", "2020-01-01T00:00:00", INFINITE, "Current"),
+        ],
+    )
+    return RenameGraph(connection, "Current")
+
+
+def test_name_key():
+    assert sorted(["stars10", "stars9", "other", "stars100"], key=name_key) == ["stars9", "stars10", "stars100", "other"]
+
+
+def test_transitions(graph):
+    assert graph.summary() == [("2020-02-01T00:00:00", "AA:00", "stars10", "stars11")]
+    assert graph.summary("2020-03-01T00:00:00") == []
+
+
+def test_free_and_reassigned_names(graph):
+    assert [tag.name for tag in graph.anonymous()] == ["stars2"]
+    assert graph.reassigned == ["stars10"]
+
+
+def test_histories(graph):
+    assert [(a.name, a.mac) for a in graph.names()] == [("stars10", "AA:00"), ("stars10", "CC:00")]
+    assert [(a.name, a.mac) for a in graph.macs()] == [("stars10", "AA:00"), ("stars11", "AA:00")]
+    assert graph.macs("2020-03-01T00:00:00") == []
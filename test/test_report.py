@@ -0,0 +1,56 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import sqlite3
+from argparse import Namespace
+
+import pytest
+
+from conftest import SCHEMA
+
+from tessdb.cmdline import report
+
+INFINITE = "2999-12-31T23:59:59"
+
+
+@pytest.fixture
+def dbase(tmp_path):
+    path = str(tmp_path / "tess.db")
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    connection.executemany(
+        "INSERT INTO name_to_mac_t VALUES (?,?,?,?,?)",
+        [
+            ("stars9", "AA:00", "2020-01-01T00:00:00", "2020-02-01T00:00:00", "Expired"),
+            ("stars10", "AA:00", "2020-02-01T00:00:00", INFINITE, "Current"),
+        ],
+    )
+    connection.commit()
+    connection.close()
+    return path
+
+
+def options(dbase, *names):
+    return Namespace(dbase=dbase, reports=list(names), list=False, workers=None, count=10, distance=100)
+
+
+def broken_query(connection, row):
+    raise ValueError("broken report")
+
+
+def test_renamings(dbase, capsys):
+    report.report_run(None, options(dbase, "instrument_renamings"))
+    out = capsys.readouterr().out
+    assert "2020-02-01T00:00:00 | AA:00       | stars9               | stars10" in out
+
+
+def test_failing_report(dbase, capsys, monkeypatch):
+    reports = dict(report.REPORTS, broken=("Broken", broken_query, ["Nothing"]))
+    monkeypatch.setattr(report, "REPORTS", reports)
+    report.report_run(None, options(dbase, "broken", "instrument_renamings"))
+    out = capsys.readouterr().out
+    assert "Broken => Error: broken report" in out
+    assert "Instrument renamings (" in out
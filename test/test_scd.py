@@ -0,0 +1,99 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import pytest
+
+from tessdb.cmdline.utils.scd import check, fix, fix_orphans, OVERLAP, GAP, CURRENTS, CURRENT_NOT_LAST, ORPHAN
+
+INFINITE = "2999-12-31T23:59:59"
+ROW = {"current": "Current", "expired": "Expired", "infinite": INFINITE}
+
+
+def names(connection, *rows):
+    connection.executemany("INSERT INTO name_to_mac_t VALUES (?,?,?,?,?)", rows)
+
+
+def versions(connection, *rows):
+    connection.executemany(
+        "INSERT INTO tess_t (mac_address, valid_since, valid_until, valid_state) VALUES (?,?,?,?)", rows
+    )
+
+
+def kinds(issues):
+    return sorted((issue.key, issue.issue) for issue in issues)
+
+
+@pytest.fixture
+def versioned(connection):
+    versions(
+        connection,
+        ("AA:00", "2020-01-01T00:00:00", "2020-02-01T00:00:00", "Expired"),
+        ("AA:00", "2020-03-01T00:00:00", "2020-04-01T00:00:00", "Current"),  # gap, current not last
+        ("AA:00", "2020-03-15T00:00:00", INFINITE, "Current"),  # overlap, several current
+        ("BB:00", "2020-01-01T00:00:00", INFINITE, "Current"),
+    )
+    return connection
+
+
+def test_check(versioned):
+    assert kinds(check(versioned, "tess_t", "mac_address", ROW)) == sorted(
+        [("AA:00", CURRENTS), ("AA:00", CURRENT_NOT_LAST), ("AA:00", GAP), ("AA:00", OVERLAP)]
+    )
+
+
+def test_fix(versioned):
+    assert fix(versioned, "tess_t", "mac_address", ROW) == {"chained": 2, "expired": 1}
+    assert check(versioned, "tess_t", "mac_address", ROW) == []
+
+
+def test_name_given_to_another_mac_is_not_a_gap(connection):
+    names(
+        connection,
+        ("stars1", "AA:00", "2020-01-01T00:00:00", "2020-02-01T00:00:00", "Expired"),
+        ("stars1", "BB:00", "2020-06-01T00:00:00", INFINITE, "Current"),
+        ("stars2", "CC:00", "2020-01-01T00:00:00", "2020-02-01T00:00:00", "Expired"),
+        ("stars2", "CC:00", "2020-06-01T00:00:00", INFINITE, "Current"),
+    )
+    assert kinds(check(connection, "name_to_mac_t", "name", ROW, owner="mac_address")) == [("stars2", GAP)]
+    assert kinds(check(connection, "name_to_mac_t", "name", ROW)) == [("stars1", GAP), ("stars2", GAP)]
+
+
+def test_name_held_by_two_macs_is_an_overlap(connection):
+    names(
+        connection,
+        ("stars1", "AA:00", "2020-01-01T00:00:00", "2020-03-01T00:00:00", "Expired"),
+        ("stars1", "BB:00", "2020-02-01T00:00:00", INFINITE, "Current"),
+    )
+    assert kinds(check(connection, "name_to_mac_t", "name", ROW, owner="mac_address")) == [("stars1", OVERLAP)]
+
+
+def test_orphans(connection):
+    versions(connection, ("AA:00", "2020-01-01T00:00:00", INFINITE, "Current"))
+    names(
+        connection,
+        ("stars1", "AA:00", "2020-01-01T00:00:00", INFINITE, "Current"),
+        ("stars2", "BB:00", "2020-01-01T00:00:00", INFINITE, "Current"),
+    )
+    assert kinds(check(connection, "name_to_mac_t", "mac_address", ROW, orphans=True)) == [("BB:00", ORPHAN)]
+    assert fix_orphans(connection) == 1
+
+
+def test_legitimate_name_gap_is_kept(connection):
+    names(
+        connection,
+        ("stars1", "AA:00", "2020-01-01T00:00:00", "2020-02-01T00:00:00", "Expired"),  # anonymous until June
+        ("stars7", "AA:00", "2020-06-01T00:00:00", "2020-08-01T00:00:00", "Current"),  # overlap
+        ("stars8", "AA:00", "2020-07-01T00:00:00", INFINITE, "Current"),
+    )
+    assert fix(connection, "name_to_mac_t", "mac_address", ROW, gaps=False) == {"chained": 1, "expired": 1}
+    assert connection.execute("SELECT name, valid_until FROM name_to_mac_t ORDER BY valid_since").fetchall() == [
+        ("stars1", "2020-02-01T00:00:00"),
+        ("stars7", "2020-07-01T00:00:00"),
+        ("stars8", INFINITE),
+    ]
+    assert kinds(check(connection, "name_to_mac_t", "mac_address", ROW)) == [("AA:00", GAP)]
+    assert fix(connection, "name_to_mac_t", "mac_address", ROW) == {"chained": 1, "expired": 0}
+    assert check(connection, "name_to_mac_t", "mac_address", ROW) == []
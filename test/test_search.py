@@ -0,0 +1,102 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import pytest
+
+from tessdb.cmdline.utils import search
+
+
+@pytest.fixture
+def sites(connection):
+    connection.executemany(
+        "INSERT INTO location_t (location_id, site, location, province, country, organization) VALUES (?,?,?,?,?,?)",
+        [
+            (-1, "Unknown", "Unknown", "Unknown", "Unknown", "Unknown"),
+            (1, "Observatorio de Sierra Nevada", "Güéjar Sierra", "Granada", "Spain", "IAA"),
+            (2, "Granada centro", "Granada", "Granada", "Spain", None),
+            (3, "Montsec", "Sant Esteve de la Sarga", "Lleida", "Spain", "Parc Astronòmic"),
+        ],
+    )
+    connection.commit()
+    return connection
+
+
+@pytest.fixture
+def indexed(sites):
+    search.rebuild(sites)
+    return sites
+
+
+def sites_of(hits):
+    return [hit.location_id for hit in hits]
+
+
+def test_fold_and_tokens():
+    assert search.fold("Güéjar ASTRONÒMIC") == "guejar astronomic"
+    assert search.tokens(["Sierra-Nevada", " parc  astronòmic"]) == ["sierra", "nevada", "parc", "astronomic"]
+    assert search.tokens(["--", " "]) == []
+
+
+def test_edit_distance():
+    assert search.edit_distance("granda", "granada", 2) == 1
+    assert search.edit_distance("kitten", "sitting", 2) == 3
+    assert search.edit_distance("kitten", "sitting", 5) == 3
+    assert search.edit_distance("monts", "montsec", 1) == 2
+    assert search.edit_distance("monts", "montsec", 1, prefix=True) == 0
+    assert search.edit_distance("montsex", "montsec", 1, prefix=True) == 1
+
+
+def test_refresh(sites):
+    assert not search.exists(sites)
+    search.rebuild(sites)
+    assert search.exists(sites)
+    assert sites.execute("SELECT rowid FROM location_fts ORDER BY rowid").fetchall() == [(1,), (2,), (3,)]
+    assert not search.refresh(sites)
+    # Changes behind the index back, even those keeping the number and ids of sites
+    sites.execute("DROP TRIGGER temp.location_update_s")
+    sites.execute("UPDATE location_t SET site = 'Granada Albaicín' WHERE location_id == 2")
+    sites.commit()
+    assert search.stale(sites)
+    assert sites_of(search.search(sites, ["albaicin"])) == [2]
+    assert not search.stale(sites)
+    sites.execute("DROP TRIGGER temp.location_delete_s")
+    sites.execute("DELETE FROM location_t WHERE location_id == 1")
+    sites.commit()
+    assert search.refresh(sites)
+    assert sites.execute("SELECT rowid FROM location_fts ORDER BY rowid").fetchall() == [(2,), (3,)]
+
+
+@pytest.mark.usefixtures("indexed")
+def test_prefix_search(sites):
+    assert search.search(sites, ["  "]) is None
+    assert sites_of(search.search(sites, ["granada"])) == [2, 1]  # site name weighs more than province
+    assert sites_of(search.search(sites, ["astronomic"])) == [3]
+    assert sites_of(search.search(sites, ["sier", "nev"])) == [1]
+    assert sites_of(search.search(sites, ["granada"], limit=1)) == [2]
+
+
+@pytest.mark.usefixtures("indexed")
+def test_fuzzy_search(sites):
+    assert sites_of(search.search(sites, ["granda", "centr"])) == [2]
+    # No site has both, so any of them will do
+    assert set(sites_of(search.search(sites, ["montsek", "granda"]))) == {1, 2, 3}
+    assert search.search(sites, ["xyzzy"]) == []
+
+
+@pytest.mark.usefixtures("indexed")
+def test_track(sites):
+    sites.execute("INSERT INTO location_t (location_id, site, location) VALUES (4, 'Calar Alto', 'Gérgal')")
+    sites.execute("UPDATE location_t SET site = 'Granada Albaicín' WHERE location_id == 2")
+    sites.execute("DELETE FROM location_t WHERE location_id == 3")
+    sites.commit()
+    assert sites_of(search.search(sites, ["gergal"])) == [4]
+    assert sites_of(search.search(sites, ["albaicin"])) == [2]
+    assert search.search(sites, ["montsec"]) == []
+    sites.execute("DELETE FROM location_t WHERE location_id == 4")
+    sites.rollback()
+    assert sites_of(search.search(sites, ["calar"])) == [4]
+    # Changes through the tracked connection leave nothing to rebuild
+    assert not search.stale(sites)
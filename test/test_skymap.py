@@ -0,0 +1,75 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2024 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+import sqlite3
+
+import pytest
+
+from tessdb.cmdline.utils import skymap
+from tessdb.cmdline.utils.archive import attach_archive, detach_archive, archive_move
+from tessdb.cmdline.utils.progress import Progress
+
+from conftest import SCHEMA
+
+ROW = {"start_date": 20200101000000, "end_date": 20200131235959}
+
+
+@pytest.fixture
+def dbase(tmp_path):
+    path = str(tmp_path / "tess.db")
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    connection.executemany(
+        "INSERT INTO date_t VALUES (?,?)", [(20200100 + d, "2020-01-%02d" % d) for d in range(1, 32)]
+    )
+    connection.executemany("INSERT INTO time_t VALUES (?,?)", [(t, "%02d:00:00" % (t // 10000,)) for t in (0, 220000)])
+    connection.executemany(
+        "INSERT INTO location_t (location_id, site, longitude, latitude) VALUES (?,?,?,?)",
+        [(1, "Madrid", -3.7, 40.4), (2, "Toledo", -4.0, 39.9), (3, "Tenerife", -16.5, 28.3), (4, "Nowhere", None, None)],
+    )
+    readings = [
+        # two readings the same night at Madrid, the darkest one counts
+        (20200101, 220000, 1, 1, 20.0),
+        (20200102, 0, 1, 1, 20.4),
+        (20200105, 220000, 1, 1, 20.8),
+        (20200101, 220000, 2, 2, 21.0),
+        (20200101, 220000, 3, 3, 21.5),
+        (20200101, 220000, 4, 4, 19.0),
+    ]
+    connection.executemany(
+        "INSERT INTO tess_readings_t (date_id, time_id, tess_id, location_id, magnitude) VALUES (?,?,?,?,?)", readings
+    )
+    connection.commit()
+    connection.close()
+    return path
+
+
+def test_nightly_and_grid(dbase):
+    connection = sqlite3.connect(dbase)
+    data = skymap.nightly(connection, ROW)
+    assert sorted(data[["location_id", "magnitude"]].tolist()) == [(1, 20.4), (1, 20.8), (2, 21.0), (3, 21.5)]
+    cells = skymap.grid(data, 1.0)
+    assert cells == [
+        (-17.0, 28.0, -16.0, 29.0, 1, 1, 21.5, 21.5, 21.5),
+        (-4.0, 39.0, -3.0, 40.0, 1, 1, 21.0, 21.0, 21.0),
+        (-4.0, 40.0, -3.0, 41.0, 1, 2, 20.6, 20.6, 20.6),
+    ]
+    assert skymap.grid(data, 20.0)[1] == (-20.0, 30.0, 0.0, 50.0, 2, 3, 20.8, 20.6, 21.0)
+
+
+def test_archived_sites(dbase, tmp_path):
+    archive = tmp_path / "archive"
+    archive.mkdir()
+    connection = sqlite3.connect(dbase)
+    attach_archive(connection, str(archive / "2020.db"))
+    with Progress(connection, "archive") as progress:
+        archive_move(connection, progress, "tess_readings_t", "location_id == 3", {})
+        archive_move(connection, progress, "location_t", "location_id == 3", {})
+    detach_archive(connection)
+    assert sorted(skymap.nightly(connection, ROW)["location_id"].tolist()) == [1, 1, 2]
+    data = skymap.nightly(connection, ROW, dbase, str(archive))
+    assert sorted(data["location_id"].tolist()) == [1, 1, 2, 3]
+    assert skymap.grid(data, 1.0)[0] == (-17.0, 28.0, -16.0, 29.0, 1, 1, 21.5, 21.5, 21.5)